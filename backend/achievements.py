@@ -0,0 +1,350 @@
+"""
+Achievements Engine for Bin Smart
+Awards milestones at write time, when a user's activity counters change
+"""
+
+from bisect import bisect_right
+from database import DatabaseManager
+from notifications import create_notification
+from points_ledger import balance_sql, balances
+
+db_manager = DatabaseManager()
+
+# Bit per waste type, OR-ed into user_counters.waste_type_mask
+WASTE_TYPE_BITS = {
+    'Plastic': 1,
+    'Organic': 2,
+    'Paper': 4,
+    'E-Waste': 8,
+    'Glass': 16
+}
+
+# Rule table: one achievement per (metric, threshold)
+ACHIEVEMENT_RULES = [
+    {'key': 'points_50', 'metric': 'points', 'threshold': 50, 'title': '🌿 Eco Starter', 'message': 'Congratulations! You\'ve earned your first 50 points. Keep up the great work!'},
+    {'key': 'points_100', 'metric': 'points', 'threshold': 100, 'title': '♻️ Eco Beginner', 'message': 'Amazing! You\'ve reached 100 points. You\'re making a real difference!'},
+    {'key': 'points_250', 'metric': 'points', 'threshold': 250, 'title': '🌱 Eco Enthusiast', 'message': 'Fantastic! 250 points earned. Your dedication to the environment is inspiring!'},
+    {'key': 'points_500', 'metric': 'points', 'threshold': 500, 'title': '🏆 Eco Warrior', 'message': 'Outstanding! 500 points achieved. You\'re a true environmental champion!'},
+    {'key': 'points_1000', 'metric': 'points', 'threshold': 1000, 'title': '👑 Eco Champion', 'message': 'Incredible! 1000 points reached. You\'re leading by example in environmental conservation!'},
+    {'key': 'points_2000', 'metric': 'points', 'threshold': 2000, 'title': '🌍 Eco Legend', 'message': 'Legendary! 2000 points - your impact on the environment is remarkable!'},
+    {'key': 'disposals_1', 'metric': 'disposals', 'threshold': 1, 'title': '🗑️ First Drop', 'message': 'You made your first smart disposal. Welcome aboard!'},
+    {'key': 'disposals_10', 'metric': 'disposals', 'threshold': 10, 'title': '🔟 Regular Recycler', 'message': '10 disposals recorded. Recycling is becoming a habit!'},
+    {'key': 'disposals_50', 'metric': 'disposals', 'threshold': 50, 'title': '📦 Bin Regular', 'message': '50 disposals! The bins know you by name.'},
+    {'key': 'disposals_100', 'metric': 'disposals', 'threshold': 100, 'title': '💯 Century Club', 'message': '100 disposals - a real milestone for a cleaner city!'},
+    {'key': 'streak_3', 'metric': 'streak_days', 'threshold': 3, 'title': '🔥 3-Day Streak', 'message': 'Three days in a row! Keep the streak alive.'},
+    {'key': 'streak_7', 'metric': 'streak_days', 'threshold': 7, 'title': '🔥 Week Streak', 'message': 'A full week of daily disposals. Impressive consistency!'},
+    {'key': 'streak_30', 'metric': 'streak_days', 'threshold': 30, 'title': '🔥 Month Streak', 'message': '30 days straight - you\'re an everyday eco hero!'},
+    {'key': 'waste_types_3', 'metric': 'waste_types', 'threshold': 3, 'title': '🎨 Sorter', 'message': 'You\'ve recycled three different kinds of waste.'},
+    {'key': 'waste_types_5', 'metric': 'waste_types', 'threshold': 5, 'title': '🌈 Master Sorter', 'message': 'Every waste type covered - you\'re a sorting master!'}
+]
+
+
+class AchievementEngine:
+    """Rule table compiled into sorted thresholds per metric.
+
+    crossed() finds the rules between an old and a new counter value with two
+    bisects, so detection costs O(log rules + rules crossed) per write.
+    """
+
+    def __init__(self, rules):
+        self.rules = {rule['key']: rule for rule in rules}
+        self._rules_by_metric = {}
+        self._thresholds = {}
+
+        for rule in sorted(rules, key=lambda r: r['threshold']):
+            self._rules_by_metric.setdefault(rule['metric'], []).append(rule)
+        for metric, metric_rules in self._rules_by_metric.items():
+            self._thresholds[metric] = [rule['threshold'] for rule in metric_rules]
+
+    def crossed(self, metric, old_value, new_value):
+        """Rules with old_value < threshold <= new_value"""
+        thresholds = self._thresholds.get(metric)
+        if not thresholds or new_value <= old_value:
+            return []
+        low = bisect_right(thresholds, old_value)
+        high = bisect_right(thresholds, new_value)
+        return self._rules_by_metric[metric][low:high]
+
+    def reached(self, metric, value):
+        """All rules of a metric at or below value"""
+        thresholds = self._thresholds.get(metric, [])
+        return self._rules_by_metric.get(metric, [])[:bisect_right(thresholds, value)]
+
+    def next_rule(self, metric, value):
+        """The first rule of a metric still above value, if any"""
+        thresholds = self._thresholds.get(metric, [])
+        index = bisect_right(thresholds, value)
+        metric_rules = self._rules_by_metric.get(metric, [])
+        return metric_rules[index] if index < len(metric_rules) else None
+
+
+engine = AchievementEngine(ACHIEVEMENT_RULES)
+
+
+def waste_type_mask(waste_types):
+    mask = 0
+    for waste_type in waste_types:
+        mask |= WASTE_TYPE_BITS.get(waste_type, 0)
+    return mask
+
+
+def record_disposals(by_user):
+    """Update activity counters once scans have committed and award crossed achievements.
+
+    by_user maps user_id to the scans' summary: waste_types, points and the
+    total_points credit() returned. The whole batch is one short transaction
+    after the scans commit, so credits never wait on a counters row; each
+    user runs under a savepoint, so one failure doesn't cost the others.
+    Returns {user_id: newly awarded rules}.
+    """
+    users = sorted(user_id for user_id, entry in by_user.items() if user_id and entry.get('waste_types'))
+    if not users:
+        return {}
+
+    awarded = {}
+    with db_manager.transaction() as cursor:
+        current = balances(cursor, users)
+        for user_id in users:
+            entry = by_user[user_id]
+            cursor.execute("SAVEPOINT achievements")
+            try:
+                awarded[user_id] = update_counters(
+                    cursor, user_id, entry['waste_types'], entry['points'],
+                    entry.get('total_points'), current.get(user_id))
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT achievements")
+                print(f"Warning: Failed to update achievements for user {user_id}: {e}")
+
+    for user_id, rules in awarded.items():
+        notify_awards(user_id, rules)
+    return awarded
+
+
+def update_counters(cursor, user_id, waste_types, points_delta, total_points=None, balance=None):
+    """Bump one user's counters inside the caller's transaction; returns rules newly awarded.
+
+    total_points is the balance the credit itself returned and balance one
+    read after it committed. Points crossed run from total_points minus the
+    delta up to the larger of the two: a concurrent credit this one didn't
+    see is covered by whichever call commits last, and overlapping ranges
+    are harmless. Previous values for streaks and waste-type diversity are
+    lower bounds, and the unique key on user_achievements absorbs re-awards.
+    """
+    batch_mask = waste_type_mask(waste_types)
+    if total_points is None and balance is None:
+        return []
+    points = max(value for value in (total_points, balance) if value is not None)
+    old_points = (points if total_points is None else total_points) - points_delta
+
+    cursor.execute("""
+        INSERT INTO user_counters (user_id, disposals, streak_days, last_disposal_date, waste_type_mask)
+        VALUES (%s, %s, 1, CURDATE(), %s)
+        ON DUPLICATE KEY UPDATE
+            disposals = disposals + VALUES(disposals),
+            streak_days = CASE
+                WHEN last_disposal_date = CURDATE() THEN streak_days
+                WHEN last_disposal_date = CURDATE() - INTERVAL 1 DAY THEN streak_days + 1
+                ELSE 1
+            END,
+            last_disposal_date = CURDATE(),
+            waste_type_mask = waste_type_mask | VALUES(waste_type_mask)
+    """, (user_id, len(waste_types), batch_mask))
+
+    cursor.execute("""
+        SELECT disposals, streak_days, waste_type_mask FROM user_counters WHERE user_id = %s
+    """, (user_id,))
+    counters = cursor.fetchone()
+
+    types_now = bin(counters['waste_type_mask']).count('1')
+    crossed = (
+        engine.crossed('points', old_points, points) +
+        engine.crossed('disposals', counters['disposals'] - len(waste_types), counters['disposals']) +
+        engine.crossed('streak_days', counters['streak_days'] - 1, counters['streak_days']) +
+        engine.crossed('waste_types', bin(counters['waste_type_mask'] & ~batch_mask).count('1'), types_now)
+    )
+
+    return _insert_awards(cursor, user_id, crossed)
+
+
+def notify_awards(user_id, awarded):
+    """Tell a user about achievements update_counters awarded, after its transaction commits"""
+    for rule in awarded:
+        create_notification(user_id, rule['title'], rule['message'], 'milestone')
+
+
+def _insert_awards(cursor, user_id, rules):
+    """Record achievements, returning only the ones that were new"""
+    awarded = []
+    for rule in rules:
+        cursor.execute(
+            "INSERT IGNORE INTO user_achievements (user_id, achievement_key) VALUES (%s, %s)",
+            (user_id, rule['key'])
+        )
+        if cursor.rowcount == 1:
+            awarded.append(rule)
+    return awarded
+
+
+def get_user_achievements(user_id, cursor=None):
+    """Achievements a user has been awarded, newest first; pass a cursor to read on its connection"""
+    query = """
+        SELECT achievement_key, awarded_at
+        FROM user_achievements
+        WHERE user_id = %s
+        ORDER BY awarded_at DESC
+    """
+    if cursor is not None:
+        cursor.execute(query, (user_id,))
+        rows = cursor.fetchall()
+    else:
+        rows = db_manager.execute_query(query, (user_id,))
+
+    achievements = []
+    for row in rows or []:
+        rule = engine.rules.get(row['achievement_key'])
+        if rule:
+            achievements.append({
+                'key': rule['key'],
+                'title': rule['title'],
+                'metric': rule['metric'],
+                'threshold': rule['threshold'],
+                'awarded_at': row['awarded_at']
+            })
+    return achievements
+
+
+def milestone_progress(total_points):
+    """Latest points milestone reached plus progress towards the next one"""
+    total_points = total_points or 0
+    milestones = []
+
+    reached = engine.reached('points', total_points)
+    if reached:
+        milestones.append({
+            'title': reached[-1]['title'],
+            'description': f"Earned {reached[-1]['threshold']}+ points",
+            'achieved': True
+        })
+
+    upcoming = engine.next_rule('points', total_points)
+    if upcoming:
+        milestones.append({
+            'title': upcoming['title'],
+            'description': f"Earn {upcoming['threshold']}+ points",
+            'achieved': False,
+            'progress': total_points / upcoming['threshold'] * 100
+        })
+
+    return milestones
+
+
+def _scan_history(cursor, user_ids):
+    """Disposal count, waste-type mask, latest day, current and longest daily streak per user, from waste_scans"""
+    cursor.execute(f"""
+        SELECT user_id, waste_type, DATE(scan_date) as day, COUNT(*) as scans
+        FROM waste_scans
+        WHERE user_id IN ({', '.join(['%s'] * len(user_ids))})
+        GROUP BY user_id, waste_type, DATE(scan_date)
+    """, list(user_ids))
+
+    history = {}
+    for row in cursor.fetchall():
+        entry = history.setdefault(row['user_id'], {'disposals': 0, 'waste_type_mask': 0, 'days': set()})
+        entry['disposals'] += row['scans']
+        entry['waste_type_mask'] |= WASTE_TYPE_BITS.get(row['waste_type'], 0)
+        entry['days'].add(row['day'])
+
+    for entry in history.values():
+        days = sorted(entry.pop('days'))
+        run = longest = 0
+        for index, day in enumerate(days):
+            run = run + 1 if index and (day - days[index - 1]).days == 1 else 1
+            longest = max(longest, run)
+        entry.update(last_disposal_date=days[-1], streak_days=run, longest_streak=longest)
+    return history
+
+
+def _seed_counters(cursor, history):
+    """Bring user_counters up to what waste_scans shows, never lowering a live counter"""
+    if not history:
+        return
+    params = []
+    for user_id, entry in history.items():
+        params.extend((user_id, entry['disposals'], entry['streak_days'],
+                       entry['last_disposal_date'], entry['waste_type_mask']))
+    # streak_days is assigned before last_disposal_date so it still sees the old date
+    cursor.execute(f"""
+        INSERT INTO user_counters (user_id, disposals, streak_days, last_disposal_date, waste_type_mask)
+        VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(history))}
+        ON DUPLICATE KEY UPDATE
+            disposals = GREATEST(disposals, VALUES(disposals)),
+            streak_days = IF(last_disposal_date IS NULL OR last_disposal_date < VALUES(last_disposal_date),
+                             VALUES(streak_days), streak_days),
+            last_disposal_date = GREATEST(COALESCE(last_disposal_date, VALUES(last_disposal_date)),
+                                          VALUES(last_disposal_date)),
+            waste_type_mask = waste_type_mask | VALUES(waste_type_mask)
+    """, params)
+
+
+def backfill_achievements(chunk_size=500):
+    """Seed activity counters from waste_scans and award achievements already reached.
+
+    Only needed once for accounts that predate the engine (or after adding a
+    rule); new activity is handled by record_disposals. Walks users in id
+    order so each chunk is a short transaction, and notifies only the highest
+    new award per metric to avoid a burst of messages. Streak awards use the
+    longest daily run in the scan history.
+    """
+    last_id = 0
+    users_awarded = 0
+
+    while True:
+        with db_manager.transaction() as cursor:
+            cursor.execute(f"""
+                SELECT u.id, {balance_sql('u')} as total_points,
+                       COALESCE(c.disposals, 0) as disposals,
+                       COALESCE(c.streak_days, 0) as streak_days,
+                       COALESCE(c.waste_type_mask, 0) as waste_type_mask
+                FROM users u
+                LEFT JOIN user_counters c ON c.user_id = u.id
+                WHERE u.id > %s
+                ORDER BY u.id
+                LIMIT %s
+            """, (last_id, chunk_size))
+            users = cursor.fetchall()
+            if not users:
+                break
+
+            history = _scan_history(cursor, [user['id'] for user in users])
+            _seed_counters(cursor, history)
+
+            awarded_by_user = {}
+            for user in users:
+                scanned = history.get(user['id'], {})
+                disposals = max(user['disposals'], scanned.get('disposals', 0))
+                streak_days = max(user['streak_days'], scanned.get('longest_streak', 0))
+                mask = user['waste_type_mask'] | scanned.get('waste_type_mask', 0)
+                reached = (
+                    engine.reached('points', int(user['total_points'] or 0)) +
+                    engine.reached('disposals', disposals) +
+                    engine.reached('streak_days', streak_days) +
+                    engine.reached('waste_types', bin(mask).count('1'))
+                )
+                awarded = _insert_awards(cursor, user['id'], reached)
+                if awarded:
+                    awarded_by_user[user['id']] = awarded
+
+            last_id = users[-1]['id']
+
+        for user_id, awarded in awarded_by_user.items():
+            highest = {}
+            for rule in awarded:
+                highest[rule['metric']] = rule
+            for rule in highest.values():
+                create_notification(user_id, rule['title'], rule['message'], 'milestone')
+        users_awarded += len(awarded_by_user)
+
+        if len(users) < chunk_size:
+            break
+
+    return users_awarded
@@ -0,0 +1,262 @@
+"""
+Admin Bulk Operations for Bin Smart
+Resolves complaints and updates bins in bulk, by id list or filter, with
+chunked set-based UPDATEs and batched notifications
+"""
+
+from flask import Blueprint, request, jsonify
+from database import DatabaseManager
+from analytics import admin_required
+from notifications import queue_notifications
+from incidents import open_incidents, COMPLAINT_TYPES
+from bin_registry import bin_registry
+from data_versions import bump_version
+from mysql.connector import Error
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
+db_manager = DatabaseManager()
+
+BULK_CHUNK_SIZE = 500
+MAX_BULK_IDS = 10000
+CAPACITY_LEVELS = ['Empty', 'Low', 'Medium', 'High', 'Full']
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _parse_ids(data):
+    """Validated list of ids from a request body, or an error message"""
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return None, 'ids must be a non-empty list'
+    if len(ids) > MAX_BULK_IDS:
+        return None, f'At most {MAX_BULK_IDS} ids per request'
+    try:
+        return list(dict.fromkeys(int(item_id) for item_id in ids)), None
+    except (TypeError, ValueError):
+        return None, 'ids must be integers'
+
+
+def _complaint_filter(filters):
+    """WHERE clause and params selecting unresolved incidents from a filter predicate"""
+    clauses, params = ["status != 'resolved'"], []
+    if filters.get('bin_id') is not None:
+        clauses.append("bin_id = %s")
+        params.append(filters['bin_id'])
+    if filters.get('complaint_type'):
+        if filters['complaint_type'] not in COMPLAINT_TYPES:
+            raise ValueError('Invalid complaint_type')
+        clauses.append("complaint_type = %s")
+        params.append(filters['complaint_type'])
+    if filters.get('status'):
+        clauses.append("status = %s")
+        params.append(filters['status'])
+    if filters.get('region'):
+        bin_ids = [record.id for record in bin_registry.all() if record.region == filters['region']] or [0]
+        clauses.append(f"bin_id IN ({_placeholders(bin_ids)})")
+        params.extend(bin_ids)
+    if filters.get('reported_before'):
+        clauses.append("last_reported_at < %s")
+        params.append(filters['reported_before'])
+    return ' AND '.join(clauses), params
+
+
+def _bin_filter(filters):
+    """WHERE clause and params selecting bins from a filter predicate"""
+    clauses, params = [], []
+    for column in ('region', 'bin_type', 'capacity_level'):
+        if filters.get(column) is not None:
+            clauses.append(f"{column} = %s")
+            params.append(filters[column])
+    if filters.get('is_active') is not None:
+        clauses.append("is_active = %s")
+        params.append(bool(filters['is_active']))
+    if not clauses:
+        raise ValueError('filter needs at least one of region, bin_type, capacity_level, is_active')
+    return ' AND '.join(clauses), params
+
+
+def _id_chunks(data, table, where_builder):
+    """Chunks of ids from either data['ids'] or data['filter']"""
+    if 'ids' in data:
+        ids, error = _parse_ids(data)
+        if error:
+            raise ValueError(error)
+        return (ids[start:start + BULK_CHUNK_SIZE] for start in range(0, len(ids), BULK_CHUNK_SIZE))
+
+    if not isinstance(data.get('filter'), dict):
+        raise ValueError('Provide either ids or filter')
+    where, params = where_builder(data['filter'])
+    return (
+        [row['id'] for row in rows]
+        for rows in db_manager.iter_keyset_chunks(
+            f"SELECT id FROM {table} WHERE {where} AND id > %s ORDER BY id LIMIT %s",
+            params, BULK_CHUNK_SIZE
+        )
+    )
+
+
+def resolve_incidents_chunk(ids, resolution_notes=''):
+    """Resolve one chunk of incidents in a single transaction; returns per-id status and notifications"""
+    with db_manager.transaction() as cursor:
+        cursor.execute(f"""
+            SELECT id, bin_id, status FROM complaint_incidents
+            WHERE id IN ({_placeholders(ids)})
+            FOR UPDATE
+        """, ids)
+        incidents = {row['id']: row for row in cursor.fetchall()}
+        to_resolve = [item_id for item_id in ids if item_id in incidents and incidents[item_id]['status'] != 'resolved']
+
+        reporters = []
+        if to_resolve:
+            cursor.execute(f"""
+                UPDATE complaint_incidents
+                SET status = 'resolved', resolved_at = NOW()
+                WHERE id IN ({_placeholders(to_resolve)})
+            """, to_resolve)
+            cursor.execute(f"""
+                SELECT incident_id, user_id FROM incident_reporters
+                WHERE incident_id IN ({_placeholders(to_resolve)})
+            """, to_resolve)
+            reporters = cursor.fetchall()
+
+    results = {}
+    for item_id in ids:
+        if item_id not in incidents:
+            results[item_id] = 'not_found'
+        elif item_id in to_resolve:
+            results[item_id] = 'resolved'
+        else:
+            results[item_id] = 'already_resolved'
+
+    notifications = []
+    for reporter in reporters:
+        bin_record = bin_registry.get(incidents[reporter['incident_id']]['bin_id'])
+        message = f"Your complaint about {bin_record.location_name if bin_record else 'your bin'} has been resolved."
+        if resolution_notes:
+            message += f" Note: {resolution_notes}"
+        notifications.append((reporter['user_id'], "Complaint Resolved", message, 'info'))
+
+    for item_id in to_resolve:
+        open_incidents.close(item_id)
+    return results, notifications
+
+
+@admin_bp.route('/complaints/bulk-resolve', methods=['POST'])
+@admin_required
+def bulk_resolve_complaints():
+    """Resolve complaint incidents by id list or filter and notify their reporters"""
+    data = request.get_json() or {}
+    resolution_notes = data.get('resolution_notes', '')
+
+    results = {}
+    notifications = []
+    try:
+        for ids in _id_chunks(data, 'complaint_incidents', _complaint_filter):
+            chunk_results, chunk_notifications = resolve_incidents_chunk(ids, resolution_notes)
+            results.update(chunk_results)
+            notifications.extend(chunk_notifications)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Error as e:
+        print(f"Error in bulk_resolve_complaints: {e}")
+        # Chunks before the failure are committed, so their reporters still hear back
+        if notifications:
+            queue_notifications(notifications)
+        return jsonify({'error': 'Bulk resolve failed', 'results': _format_results(results)}), 500
+
+    # Reporters hear back in batched inserts on a background worker
+    if notifications:
+        queue_notifications(notifications)
+
+    return jsonify({
+        'message': 'Bulk resolve completed',
+        'results': _format_results(results),
+        'summary': _summarize(results),
+        'notifications_queued': len(notifications)
+    })
+
+
+def update_bins_chunk(ids, changes):
+    """Apply changes to one chunk of bins in a single transaction; returns per-id status"""
+    assignments = [f"{column} = %s" for column in changes]
+    values = list(changes.values())
+    if changes.get('capacity_level') == 'Empty':
+        assignments.append("last_emptied = NOW()")
+
+    with db_manager.transaction() as cursor:
+        cursor.execute(f"""
+            SELECT id, {', '.join(changes)} FROM bins
+            WHERE id IN ({_placeholders(ids)})
+            FOR UPDATE
+        """, ids)
+        current = {row['id']: row for row in cursor.fetchall()}
+        to_update = [
+            item_id for item_id in ids
+            if item_id in current and any(current[item_id][column] != value for column, value in changes.items())
+        ]
+
+        if to_update:
+            cursor.execute(f"""
+                UPDATE bins SET {', '.join(assignments)}
+                WHERE id IN ({_placeholders(to_update)})
+            """, values + to_update)
+            bump_version('bins', cursor)
+
+    results = {}
+    for item_id in ids:
+        if item_id not in current:
+            results[item_id] = 'not_found'
+        elif item_id in to_update:
+            results[item_id] = 'updated'
+        else:
+            results[item_id] = 'unchanged'
+    return results
+
+
+@admin_bp.route('/bins/bulk-update', methods=['POST'])
+@admin_required
+def bulk_update_bins():
+    """Set capacity_level and/or is_active on bins by id list or filter"""
+    data = request.get_json() or {}
+    requested = data.get('set') or {}
+
+    changes = {}
+    if 'capacity_level' in requested:
+        if requested['capacity_level'] not in CAPACITY_LEVELS:
+            return jsonify({'error': f'capacity_level must be one of {CAPACITY_LEVELS}'}), 400
+        changes['capacity_level'] = requested['capacity_level']
+    if 'is_active' in requested:
+        changes['is_active'] = 1 if requested['is_active'] else 0
+    if not changes:
+        return jsonify({'error': 'set must contain capacity_level and/or is_active'}), 400
+
+    results = {}
+    try:
+        for ids in _id_chunks(data, 'bins', _bin_filter):
+            results.update(update_bins_chunk(ids, changes))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Error as e:
+        print(f"Error in bulk_update_bins: {e}")
+        return jsonify({'error': 'Bulk update failed', 'results': _format_results(results)}), 500
+    finally:
+        bin_registry.refresh()
+
+    return jsonify({
+        'message': 'Bulk update completed',
+        'results': _format_results(results),
+        'summary': _summarize(results)
+    })
+
+
+def _format_results(results):
+    return [{'id': item_id, 'status': status} for item_id, status in results.items()]
+
+
+def _summarize(results):
+    summary = {}
+    for status in results.values():
+        summary[status] = summary.get(status, 0) + 1
+    return summary
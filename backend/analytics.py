@@ -5,30 +5,21 @@ Provides comprehensive data analysis and insights for municipal corporations
 
 from flask import Blueprint, request, jsonify
 from database import DatabaseManager
+from auth import admin_required
+from http_cache import conditional
 from datetime import datetime, timedelta
 import json
-from functools import wraps
+import os
 
 analytics_bp = Blueprint('analytics', __name__, url_prefix='/api/analytics')
 db_manager = DatabaseManager()
 
-# Connect to database
-if not db_manager.connect():
-    print("Failed to connect to database in analytics module")
-
-def admin_required(f):
-    """Decorator to require admin authentication"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        # For now, simple token check - implement proper JWT in production
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer admin-'):
-            return jsonify({'error': 'Admin authentication required'}), 401
-        return f(*args, **kwargs)
-    return decorated_function
+# Dashboard aggregates are recomputed at most this often per node
+ANALYTICS_CACHE_SECONDS = int(os.getenv('ANALYTICS_CACHE_SECONDS', 60))
 
 @analytics_bp.route('/users/overview', methods=['GET'])
 @admin_required
+@conditional('analytics-users-overview', max_age=ANALYTICS_CACHE_SECONDS, private=True)
 def user_analytics_overview():
     """Get comprehensive user analytics overview"""
     
@@ -88,6 +79,7 @@ def user_analytics_overview():
 
 @analytics_bp.route('/waste/analysis', methods=['GET'])
 @admin_required
+@conditional('analytics-waste-analysis', max_age=ANALYTICS_CACHE_SECONDS, private=True)
 def waste_data_analysis():
     """Comprehensive waste data analysis"""
     
@@ -143,6 +135,7 @@ def waste_data_analysis():
 
 @analytics_bp.route('/geographical/heatmap', methods=['GET'])
 @admin_required
+@conditional('analytics-geographical-heatmap', max_age=ANALYTICS_CACHE_SECONDS, private=True)
 def geographical_analysis():
     """Get geographical analysis data for heatmaps"""
     
@@ -169,16 +162,16 @@ def geographical_analysis():
         ORDER BY recent_scans ASC
     """)
     
-    # Overflow reports
+    # Overflow reports (one incident per overflow, however many people reported it)
     overflow_reports = db_manager.execute_query("""
         SELECT b.location_name, b.latitude, b.longitude,
-               COUNT(bc.id) as complaint_count
-        FROM bins b
-        LEFT JOIN bin_complaints bc ON b.id = bc.bin_id 
-        AND bc.complaint_type = 'full'
-        AND bc.created_at >= DATE_SUB(NOW(), INTERVAL 30 DAY)
+               COUNT(i.id) as incident_count,
+               SUM(i.reporter_count) as complaint_count
+        FROM complaint_incidents i
+        JOIN bins b ON b.id = i.bin_id
+        WHERE i.complaint_type = 'full'
+        AND i.last_reported_at >= DATE_SUB(NOW(), INTERVAL 30 DAY)
         GROUP BY b.id
-        HAVING complaint_count > 0
         ORDER BY complaint_count DESC
     """)
     
@@ -190,6 +183,7 @@ def geographical_analysis():
 
 @analytics_bp.route('/rewards/analysis', methods=['GET'])
 @admin_required
+@conditional('analytics-rewards-analysis', max_age=ANALYTICS_CACHE_SECONDS, private=True)
 def rewards_analysis():
     """Analyze reward system performance"""
     
@@ -251,6 +245,7 @@ def rewards_analysis():
 
 @analytics_bp.route('/predictions/bin-fullness', methods=['GET'])
 @admin_required
+@conditional('analytics-predictions-bin-fullness', max_age=ANALYTICS_CACHE_SECONDS, private=True)
 def predict_bin_fullness():
     """Basic predictive analysis for bin fullness"""
     
@@ -328,17 +323,26 @@ def export_report():
         results = db_manager.execute_query(query, (date_range,))
         
     elif report_type == 'bin_performance':
+        # Each source is reduced to one row per bin before joining, so
+        # scans, ratings and complaints don't multiply each other
         query = """
             SELECT b.location_name, b.bin_type, b.region,
-                   COUNT(ws.id) as usage_count,
-                   AVG(br.rating) as avg_rating,
-                   COUNT(bc.id) as complaint_count
+                   COALESCE(ws.usage_count, 0) as usage_count,
+                   rs.rating_sum / NULLIF(rs.rating_count, 0) as avg_rating,
+                   COALESCE(i.complaint_count, 0) as complaint_count
             FROM bins b
-            LEFT JOIN waste_scans ws ON b.id = ws.bin_id
-            LEFT JOIN bin_ratings br ON b.id = br.bin_id
-            LEFT JOIN bin_complaints bc ON b.id = bc.bin_id
-            WHERE ws.scan_date >= DATE_SUB(NOW(), INTERVAL %s DAY) OR ws.scan_date IS NULL
-            GROUP BY b.id
+            LEFT JOIN (
+                SELECT bin_id, COUNT(*) as usage_count
+                FROM waste_scans
+                WHERE scan_date >= DATE_SUB(NOW(), INTERVAL %s DAY)
+                GROUP BY bin_id
+            ) ws ON b.id = ws.bin_id
+            LEFT JOIN bin_rating_stats rs ON b.id = rs.bin_id
+            LEFT JOIN (
+                SELECT bin_id, SUM(reporter_count) as complaint_count
+                FROM complaint_incidents
+                GROUP BY bin_id
+            ) i ON b.id = i.bin_id
             ORDER BY usage_count DESC
         """
         results = db_manager.execute_query(query, (date_range,))
@@ -354,6 +358,7 @@ def export_report():
 
 @analytics_bp.route('/dashboard/summary', methods=['GET'])
 @admin_required
+@conditional('analytics-dashboard-summary', max_age=ANALYTICS_CACHE_SECONDS, private=True)
 def admin_dashboard_summary():
     """Get summary stats for admin dashboard"""
     
@@ -361,7 +366,7 @@ def admin_dashboard_summary():
     total_users = db_manager.execute_query("SELECT COUNT(*) as count FROM users")[0]['count']
     total_scans = db_manager.execute_query("SELECT COUNT(*) as count FROM waste_scans")[0]['count']
     total_bins = db_manager.execute_query("SELECT COUNT(*) as count FROM bins WHERE is_active = TRUE")[0]['count']
-    total_complaints = db_manager.execute_query("SELECT COUNT(*) as count FROM bin_complaints WHERE status != 'resolved'")[0]['count']
+    total_complaints = db_manager.execute_query("SELECT COUNT(*) as count FROM complaint_incidents WHERE status != 'resolved'")[0]['count']
     
     # Recent activity
     recent_activity = db_manager.execute_query("""
@@ -373,12 +378,12 @@ def admin_dashboard_summary():
         UNION ALL
         
         SELECT 'complaint' as activity_type, u.username, 
-               CONCAT(bc.complaint_type, ' - ', b.location_name) as details, 
-               bc.created_at as timestamp
-        FROM bin_complaints bc
-        JOIN users u ON bc.user_id = u.id
-        JOIN bins b ON bc.bin_id = b.id
-        WHERE bc.created_at >= DATE_SUB(NOW(), INTERVAL 1 DAY)
+               CONCAT(i.complaint_type, ' - ', b.location_name) as details, 
+               i.first_reported_at as timestamp
+        FROM complaint_incidents i
+        LEFT JOIN users u ON i.first_reporter_id = u.id
+        JOIN bins b ON i.bin_id = b.id
+        WHERE i.first_reported_at >= DATE_SUB(NOW(), INTERVAL 1 DAY)
         
         ORDER BY timestamp DESC
         LIMIT 10
@@ -411,6 +416,7 @@ def admin_dashboard_summary():
 
 @analytics_bp.route('/bins/status', methods=['GET'])
 @admin_required
+@conditional('analytics-bins-status', max_age=ANALYTICS_CACHE_SECONDS, private=True)
 def bin_status_analysis():
     """Get comprehensive bin status and performance analysis"""
     
@@ -425,14 +431,21 @@ def bin_status_analysis():
     # Bins requiring attention
     bins_needing_attention = db_manager.execute_query("""
         SELECT b.id, b.location_name, b.capacity_level,
-               COUNT(bc.id) as complaint_count,
-               MAX(bc.created_at) as last_complaint,
-               AVG(br.rating) as avg_rating
+               COALESCE(i.incident_count, 0) as incident_count,
+               COALESCE(i.complaint_count, 0) as complaint_count,
+               i.last_complaint,
+               rs.rating_sum / NULLIF(rs.rating_count, 0) as avg_rating
         FROM bins b
-        LEFT JOIN bin_complaints bc ON b.id = bc.bin_id AND bc.status != 'resolved'
-        LEFT JOIN bin_ratings br ON b.id = br.bin_id
-        WHERE b.capacity_level IN ('High', 'Full') OR COUNT(bc.id) > 0
-        GROUP BY b.id
+        LEFT JOIN (
+            SELECT bin_id, COUNT(*) as incident_count,
+                   SUM(reporter_count) as complaint_count,
+                   MAX(last_reported_at) as last_complaint
+            FROM complaint_incidents
+            WHERE status != 'resolved'
+            GROUP BY bin_id
+        ) i ON b.id = i.bin_id
+        LEFT JOIN bin_rating_stats rs ON b.id = rs.bin_id
+        WHERE b.capacity_level IN ('High', 'Full') OR i.incident_count > 0
         ORDER BY complaint_count DESC, b.capacity_level DESC
     """)
     
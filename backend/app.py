@@ -4,53 +4,97 @@ import os
 from dotenv import load_dotenv
 from database import DatabaseManager
 from analytics import analytics_bp
+from json_provider import FastJSONProvider
+from http_cache import conditional, compress_response
+from fieldsets import USER_FIELDS, BIN_FIELDS, REWARD_FIELDS
+from auth import (
+    auth_bp, admin_required, create_session_token, hashing_unavailable_response,
+    request_user_id, load_user, invalidate_user
+)
 from feedback_fixed import feedback_bp
+from feedback import feedback_bp as feedback_api_bp
 from reports import reports_bp
-from notifications import notifications_bp
-import random
-import uuid
-import jwt
-from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+from bootstrap import bootstrap_bp, SCAN_STATISTICS_QUERY
+from admin import admin_bp
+from notifications import (
+    notifications_bp, auto_send_daily_reminders, auto_send_bin_alerts, auto_run_retention,
+    rebuild_unread_counters
+)
+from scheduler import scheduler
+from scans import validate_scan, record_scans, scans_recorded, cached_result, MAX_BATCH_SIZE
+from scan_keys import scan_keys, purge_expired_scan_keys
+from scan_buffer import scan_buffer, commit_scan, ScanBufferFull
+from reward_index import reward_index
+from points_ledger import (
+    POINTS_SHARDS, get_balance, fold_all_shards, record_opening_balances
+)
+from redemptions import redeem, RedemptionError, MAX_IDEMPOTENCY_KEY_LENGTH
+from bin_registry import bin_registry
+from ratings import rebuild_rating_stats
+from search import migrate_legacy_suggestions
+from password_hashing import password_hasher, HashingUnavailable
 
 load_dotenv()
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
+app.after_request(compress_response)
 
 # Initialize database manager
 db_manager = DatabaseManager()
 
-# Ensure database connection is established
-db_manager.connect()
-
 # Register blueprints with URL prefix
+app.register_blueprint(auth_bp)
 app.register_blueprint(analytics_bp, url_prefix='/api')
 app.register_blueprint(feedback_bp, url_prefix='/api')
+app.register_blueprint(feedback_api_bp)
 app.register_blueprint(reports_bp, url_prefix='/api')
 app.register_blueprint(notifications_bp, url_prefix='/api')
-
-# Secret key for JWT tokens
-SECRET_KEY = os.getenv('JWT_SECRET_KEY', str(uuid.uuid4()))
-
-# Create a session token
-def create_session_token(user_id):
-    payload = {
-        'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(days=1),
-        'iat': datetime.utcnow()
-    }
-    return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
-
-# Verify token
-def verify_token(token):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
+app.register_blueprint(bootstrap_bp, url_prefix='/api')
+app.register_blueprint(admin_bp)
+
+# Periodic jobs; every node runs the scheduler but only the elected leader executes them
+scheduler.add_job('daily_reminders', auto_send_daily_reminders, '0 9 * * *', timeout=1800, jitter=60)
+scheduler.add_job('bin_alerts', auto_send_bin_alerts, '*/30 * * * *', timeout=600, jitter=30)
+scheduler.add_job('notification_retention', auto_run_retention, '30 3 * * *', timeout=3600, jitter=300)
+scheduler.add_job('scan_key_expiry', purge_expired_scan_keys, '15 * * * *', timeout=600, jitter=60)
+if POINTS_SHARDS:
+    scheduler.add_job('points_fold', fold_all_shards, '* * * * *', timeout=300)
+
+# Fork the password hashing workers before any background threads exist
+password_hasher.start()
+
+if os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true':
+    scheduler.start()
+
+def scan_buffer_busy_response():
+    """503 for scans the write-behind buffer couldn't take"""
+    response = jsonify({"error": "Scan ingestion is busy, please retry shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def scan_idempotency_key(data):
+    """A scan's dedup key, from the Idempotency-Key header or the body"""
+    return request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+
+def replay_marked(response, status):
+    if status == 'replayed':
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def rehash_password(user_id, old_hash, password):
+    """Replace a stored hash in the background, unless it changed in the meantime"""
+    def store(new_hash):
+        try:
+            with db_manager.transaction() as cursor:
+                cursor.execute(
+                    "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                    (new_hash, user_id, old_hash)
+                )
+        except Exception as e:
+            print(f"Warning: Failed to rehash password for user {user_id}: {e}")
+    password_hasher.rehash_async(password, store)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -61,57 +105,32 @@ def health_check():
 def record_waste_disposal():
     """Record waste disposal and award points"""
     data = request.get_json()
-    user_id = data.get('user_id')
-    waste_type = data.get('waste_type')
-    quantity = data.get('quantity', 1.0)
-    location_lat = data.get('location_lat')
-    location_lng = data.get('location_lng')
-    bin_id = data.get('bin_id')
-
-    if not user_id or not waste_type:
-        return jsonify({"error": "User ID and waste type are required"}), 400
+    user_id, auth_error = request_user_id(data.get('user_id'))
+    if auth_error:
+        return jsonify({"error": auth_error}), 403
 
-    # Calculate points based on waste type
-    points_map = {
-        'Plastic': 10,
-        'Organic': 5,
-        'Paper': 8,
-        'E-Waste': 20,
-        'Glass': 12
-    }
+    if not user_id or not data.get('waste_type'):
+        return jsonify({"error": "User ID and waste type are required"}), 400
 
-    points_earned = points_map.get(waste_type, 5) * float(quantity)
-
-    # Ensure database connection is active
-    if not db_manager.connection or not db_manager.connection.is_connected():
-        db_manager.connect()
+    scan, error = validate_scan({**data, 'user_id': user_id, 'idempotency_key': scan_idempotency_key(data)})
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
-        # Record the waste scan
-        scan_query = """
-            INSERT INTO waste_scans
-            (user_id, bin_id, waste_type, points_earned, quantity, location_lat, location_lng)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        db_manager.execute_query(scan_query, (user_id, bin_id, waste_type, points_earned, quantity, location_lat, location_lng))
-
-        # Update user's total points
-        update_points_query = """
-            UPDATE users SET total_points = total_points + %s WHERE id = %s
-        """
-        db_manager.execute_query(update_points_query, (points_earned, user_id))
-
-        # Get user's updated total points
-        get_points_query = "SELECT total_points FROM users WHERE id = %s"
-        result = db_manager.execute_query(get_points_query, (user_id,))
-        total_points = result[0]['total_points'] if result else points_earned
+        # Scan row and points commit together, alone or in a group commit
+        status, result = commit_scan(scan)
+        if status == 'unknown_user':
+            return jsonify({"error": "User not found"}), 404
 
-        return jsonify({
+        response = jsonify({
             "status": "success",
-            "message": f"Successfully recorded {waste_type} disposal",
-            "points_earned": points_earned,
-            "total_points": total_points
+            "message": f"Successfully recorded {result['waste_type']} disposal",
+            "points_earned": result['points_earned'],
+            "total_points": result['total_points']
         })
+        return replay_marked(response, status), 202 if status == 'queued' else 200
+    except ScanBufferFull:
+        return scan_buffer_busy_response()
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -119,101 +138,100 @@ def record_waste_disposal():
         }), 500
 
 @app.route('/api/rewards', methods=['GET'])
+@conditional('rewards', version=lambda: reward_index.catalog_version)
 def get_rewards():
     """Get available rewards"""
-    # Ensure database connection is active
-    if not db_manager.connection or not db_manager.connection.is_connected():
-        db_manager.connect()
-
-    try:
-        query = """
-            SELECT * FROM rewards
-            WHERE is_active = TRUE
-            ORDER BY points_required ASC
-        """
-        rewards = db_manager.execute_query(query)
+    fields, error = REWARD_FIELDS.requested()
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Active catalog, sorted by points required, from the eligibility index
+    return jsonify({
+        "status": "success",
+        "rewards": [REWARD_FIELDS.project(reward, fields) for reward in reward_index.rewards()]
+    })
+
+@app.route('/api/rewards/affordable/<int:user_id>', methods=['GET'])
+def get_affordable_rewards(user_id):
+    """Rewards a user can redeem right now, answered from the eligibility index"""
+    user_id, auth_error = request_user_id(user_id)
+    if auth_error:
+        return jsonify({"error": auth_error}), 403
+    total_points, rewards = reward_index.affordable(user_id)
+
+    if total_points is None:
+        return jsonify({"error": "User not found"}), 404
 
-        return jsonify({
-            "status": "success",
-            "rewards": rewards
-        })
-    except Exception as e:
-        return jsonify({
-            "status": "error",
-            "message": f"Error fetching rewards: {str(e)}"
-        }), 500
+    return jsonify({
+        "status": "success",
+        "user_id": user_id,
+        "total_points": total_points,
+        "rewards": rewards
+    })
 
 @app.route('/api/rewards/redeem', methods=['POST'])
 def redeem_reward():
     """Redeem a reward with user points"""
     data = request.get_json()
-    user_id = data.get('user_id')
+    user_id, auth_error = request_user_id(data.get('user_id'))
+    if auth_error:
+        return jsonify({"error": auth_error}), 403
     reward_id = data.get('reward_id')
+    idempotency_key = request.headers.get('Idempotency-Key')
 
     if not user_id or not reward_id:
         return jsonify({"error": "User ID and reward ID are required"}), 400
-
-    # Ensure database connection is active
-    if not db_manager.connection or not db_manager.connection.is_connected():
-        db_manager.connect()
+    if idempotency_key and len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return jsonify({"error": f"Idempotency-Key must be at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters"}), 400
 
     try:
-        # Get reward details
-        reward_query = "SELECT * FROM rewards WHERE id = %s AND is_active = TRUE"
-        reward = db_manager.execute_query(reward_query, (reward_id,))
-
-        if not reward:
-            return jsonify({"error": "Reward not found or inactive"}), 404
-
-        points_required = reward[0]['points_required']
+        reward = reward_index.get_reward(int(reward_id))
+    except (TypeError, ValueError):
+        reward = None
+    if not reward:
+        return jsonify({"error": "Reward not found or inactive"}), 404
 
-        # Check if user has enough points
-        user_query = "SELECT total_points FROM users WHERE id = %s"
-        user = db_manager.execute_query(user_query, (user_id,))
-
-        if not user:
+    try:
+        result = redeem(user_id, reward, idempotency_key)
+    except RedemptionError as e:
+        if e.status == 'user_not_found':
             return jsonify({"error": "User not found"}), 404
-
-        user_points = user[0]['total_points']
-
-        if user_points < points_required:
-            return jsonify({
-                "status": "error",
-                "message": "Not enough points to redeem this reward",
-                "user_points": user_points,
-                "points_required": points_required
-            }), 400
-
-        # Record redemption
-        redemption_query = """
-            INSERT INTO reward_redemptions
-            (user_id, reward_id, points_used)
-            VALUES (%s, %s, %s)
-        """
-        db_manager.execute_query(redemption_query, (user_id, reward_id, points_required))
-
-        # Update user points
-        update_points_query = """
-            UPDATE users SET total_points = total_points - %s WHERE id = %s
-        """
-        db_manager.execute_query(update_points_query, (points_required, user_id))
-
-        # Get updated user points
-        updated_user = db_manager.execute_query(user_query, (user_id,))
-        updated_points = updated_user[0]['total_points']
-
         return jsonify({
-            "status": "success",
-            "message": f"Successfully redeemed {reward[0]['name']}",
-            "reward": reward[0],
-            "remaining_points": updated_points
-        })
+            "status": "error",
+            "message": "Not enough points to redeem this reward",
+            "user_points": e.balance,
+            "points_required": reward['points_required']
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": f"Error redeeming reward: {str(e)}"
         }), 500
 
+    if result['replayed']:
+        if result['reward_id'] != reward['id']:
+            return jsonify({"error": "Idempotency-Key was already used for a different reward"}), 409
+    else:
+        invalidate_user(user_id)
+        reward_index.apply_points(user_id, -result['points_used'], total=result['remaining_points'])
+
+    response = jsonify({
+        "status": "success",
+        "message": f"Successfully redeemed {reward['name']}",
+        "reward": reward,
+        "redemption_id": result['redemption_id'],
+        "remaining_points": result['remaining_points']
+    })
+    if result['replayed']:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@app.route('/api/scheduler/jobs', methods=['GET'])
+@admin_required
+def get_scheduled_jobs():
+    """Scheduled jobs with their next run and recent history on this node"""
+    return jsonify(scheduler.status())
+
 @app.route('/api/db-test', methods=['GET'])
 def db_test():
     """Test database connection and functionality"""
@@ -264,8 +282,8 @@ def create_user():
         return jsonify({"error": "Username or email already exists"}), 409
 
     try:
-        # Hash the password before storing
-        password_hash = generate_password_hash(password)
+        # Hash the password before storing (on the hashing pool, off the request thread's GIL)
+        password_hash = password_hasher.hash(password)
 
         query = "INSERT INTO users (username, email, password_hash, region) VALUES (%s, %s, %s, %s)"
         result = db_manager.execute_query(query, (username, email, password_hash, city))
@@ -277,6 +295,7 @@ def create_user():
                 # Create a session token
                 user_data = new_user[0]
                 session_token = create_session_token(user_data['id'])
+                reward_index.apply_points(user_data['id'], total=user_data['total_points'] or 0)
                 return jsonify({
                     "message": "User created successfully",
                     "username": username,
@@ -286,6 +305,8 @@ def create_user():
             return jsonify({"message": "User created successfully", "username": username}), 201
         else:
             return jsonify({"error": "Failed to create user"}), 500
+    except HashingUnavailable as e:
+        return hashing_unavailable_response(e)
     except Exception as e:
         print(f"Error creating user: {e}")
         return jsonify({"error": f"Failed to create user: {str(e)}"}), 500
@@ -293,15 +314,16 @@ def create_user():
 @app.route('/api/users/<username>', methods=['GET'])
 def get_user(username):
     """Get user by username"""
-    query = "SELECT * FROM users WHERE username = %s"
+    fields, error = USER_FIELDS.requested()
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Only the requested columns are read; password_hash isn't selectable
+    query = f"SELECT {USER_FIELDS.select(fields)} FROM users u WHERE u.username = %s"
     result = db_manager.execute_query(query, (username,))
 
     if result and len(result) > 0:
-        # Don't return password hash in response
-        user_data = result[0]
-        if 'password_hash' in user_data:
-            del user_data['password_hash']
-        return jsonify(user_data)
+        return jsonify(result[0])
     else:
         return jsonify({"error": "User not found"}), 404
 
@@ -328,13 +350,20 @@ def login():
             return jsonify({"error": "Invalid username or password"}), 401
 
         user_data = result[0]
+        if POINTS_SHARDS:
+            # Credits not yet folded into users.total_points still count
+            user_data['total_points'] = get_balance(user_data['id'])
 
         # Check if password_hash field exists
         if 'password_hash' not in user_data:
             return jsonify({"error": "User account not properly configured"}), 500
 
         # Verify password
-        if check_password_hash(user_data['password_hash'], password):
+        if password_hasher.verify(user_data['password_hash'], password):
+            # Upgrade hashes made with older KDF parameters while we have the password
+            if password_hasher.needs_rehash(user_data['password_hash']):
+                rehash_password(user_data['id'], user_data['password_hash'], password)
+            
             # Create session token
             session_token = create_session_token(user_data['id'])
 
@@ -348,6 +377,8 @@ def login():
             })
         else:
             return jsonify({"error": "Invalid username or password"}), 401
+    except HashingUnavailable as e:
+        return hashing_unavailable_response(e)
     except Exception as e:
         print(f"Error during login: {e}")
         return jsonify({"error": f"Login failed: {str(e)}"}), 500
@@ -356,92 +387,141 @@ def login():
 def scan_waste():
     """Process waste scan and save to database"""
     data = request.get_json()
-    user_id = data.get('user_id')
-    waste_type = data.get('waste_type')
-    confidence = data.get('confidence', random.uniform(80, 100))
-
-    # Points mapping
-    points_map = {
-        'Plastic': 10,
-        'Organic': 5,
-        'Paper': 8,
-        'E-Waste': 20,
-        'Glass': 12
-    }
-
-    points_earned = points_map.get(waste_type, 0)
-
-    # Insert scan record
-    scan_query = """
-        INSERT INTO waste_scans (user_id, waste_type, confidence_score, points_earned)
-        VALUES (%s, %s, %s, %s)
-    """
-    scan_result = db_manager.execute_query(scan_query, (user_id, waste_type, confidence, points_earned))
-
-    # Update user points if scan was successful
-    if scan_result and user_id:
-        update_query = "UPDATE users SET total_points = total_points + %s WHERE id = %s"
-        db_manager.execute_query(update_query, (points_earned, user_id))
-
-    if scan_result:
-        return jsonify({
-            "message": "Scan recorded successfully",
-            "waste_type": waste_type,
-            "confidence": confidence,
-            "points_earned": points_earned
-        }), 201
-    else:
+    user_id, auth_error = request_user_id(data.get('user_id'))
+    if auth_error:
+        return jsonify({"error": auth_error}), 403
+
+    scan, error = validate_scan({
+        'waste_type': data.get('waste_type'),
+        'confidence': data.get('confidence'),
+        'user_id': user_id,
+        'idempotency_key': scan_idempotency_key(data)
+    })
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        status, result = commit_scan(scan)
+    except ScanBufferFull:
+        return scan_buffer_busy_response()
+    except Exception as e:
+        print(f"Error recording scan: {e}")
         return jsonify({"error": "Failed to record scan"}), 500
+    if status == 'unknown_user':
+        return jsonify({"error": "User not found"}), 404
+
+    response = jsonify({
+        "message": "Scan accepted" if status == 'queued' else "Scan recorded successfully",
+        "waste_type": result['waste_type'],
+        "confidence": result['confidence'],
+        "points_earned": result['points_earned']
+    })
+    return replay_marked(response, status), 202 if status == 'queued' else 201
+
+@app.route('/api/scan/buffer/stats', methods=['GET'])
+@admin_required
+def get_scan_buffer_stats():
+    """Write-behind buffer mode, queue depth, flush sizes and flush latency on this node"""
+    return jsonify(scan_buffer.stats())
+
+@app.route('/api/scan/dedup/stats', methods=['GET'])
+@admin_required
+def get_scan_dedup_stats():
+    """Keyed scans recorded and retries absorbed on this node"""
+    return jsonify(scan_keys.stats())
+
+@app.route('/api/scan/batch', methods=['POST'])
+def scan_waste_batch():
+    """Record many scans at once, e.g. a kiosk upload or a mobile offline queue"""
+    data = request.get_json() or {}
+    items = data.get('scans')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "scans must be a non-empty list"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} scans per batch"}), 400
+
+    # Validate everything first; only valid scans go into the single INSERT.
+    # Retries of recently recorded items are answered from memory.
+    results = [None] * len(items)
+    scans, positions = [], []
+    for index, item in enumerate(items):
+        scan, error = validate_scan(item)
+        if not error:
+            user_id, error = request_user_id(scan['user_id'])
+            if not error:
+                scan['user_id'] = user_id
+        if error:
+            results[index] = {"index": index, "status": "rejected", "error": error}
+            continue
+        cached = cached_result(scan)
+        if cached is not None:
+            results[index] = {"index": index, "status": "duplicate", "points_earned": cached['points_earned']}
+        else:
+            scans.append(scan)
+            positions.append(index)
+
+    skipped, replayed = set(), {}
+    by_user = {}
+    if scans:
+        try:
+            skipped, replayed, by_user = record_scans(scans)
+        except Exception as e:
+            print(f"Error recording scan batch: {e}")
+            return jsonify({"error": "Failed to record scans"}), 500
+        scans_recorded(by_user)
+
+    for scan_index, (index, scan) in enumerate(zip(positions, scans)):
+        if scan_index in skipped:
+            results[index] = {"index": index, "status": "rejected", "error": "User not found"}
+        elif scan_index in replayed:
+            results[index] = {"index": index, "status": "duplicate", "points_earned": replayed[scan_index]['points_earned']}
+        else:
+            results[index] = {"index": index, "status": "recorded", "points_earned": scan['points_earned']}
+
+    recorded = sum(1 for result in results if result['status'] == 'recorded')
+    duplicates = sum(1 for result in results if result['status'] == 'duplicate')
+    return jsonify({
+        "message": f"Recorded {recorded} of {len(items)} scans",
+        "recorded": recorded,
+        "duplicates": duplicates,
+        "rejected": len(items) - recorded - duplicates,
+        "results": results,
+        "users": [
+            {"user_id": user_id, "points_earned": entry['points'], "total_points": entry.get('total_points')}
+            for user_id, entry in by_user.items()
+        ]
+    }), 201 if recorded or duplicates else 400
 
 @app.route('/api/bins', methods=['GET'])
+@conditional('bins', version=lambda: bin_registry.version)
 def get_bins():
     """Get all bin locations"""
-    query = "SELECT * FROM bins"
-    result = db_manager.execute_query(query)
-
-    if result is not None:
-        return jsonify(result)
-    else:
-        return jsonify({"error": "Failed to fetch bins"}), 500
-
-@app.route('/api/leaderboard', methods=['GET'])
-def get_leaderboard():
-    """Get top users by points"""
-    query = """
-        SELECT username, total_points, created_at
-        FROM users
-        ORDER BY total_points DESC
-        LIMIT 10
-    """
-    result = db_manager.execute_query(query)
-
-    if result is not None:
-        return jsonify(result)
-    else:
-        return jsonify({"error": "Failed to fetch leaderboard"}), 500
+    fields, error = BIN_FIELDS.requested()
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify([BIN_FIELDS.project(record, fields) for record in bin_registry.all()])
 
 @app.route('/api/user/<int:user_id>/stats', methods=['GET'])
 def get_user_stats(user_id):
     """Get user statistics"""
-    # Get user info
-    user_query = "SELECT * FROM users WHERE id = %s"
-    user_result = db_manager.execute_query(user_query, (user_id,))
+    user_id, auth_error = request_user_id(user_id)
+    if auth_error:
+        return jsonify({"error": auth_error}), 403
+    fields, error = USER_FIELDS.requested()
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Get user info (the caller's own row is usually already cached by the token check,
+    # so fields are picked from the cached row rather than selected)
+    user = load_user(user_id)
 
     # Get scan statistics
-    stats_query = """
-        SELECT
-            waste_type,
-            COUNT(*) as scan_count,
-            SUM(points_earned) as total_points_from_type
-        FROM waste_scans
-        WHERE user_id = %s
-        GROUP BY waste_type
-    """
-    stats_result = db_manager.execute_query(stats_query, (user_id,))
-
-    if user_result and len(user_result) > 0:
+    stats_result = db_manager.execute_query(SCAN_STATISTICS_QUERY, (user_id,))
+
+    if user:
         return jsonify({
-            "user": user_result[0],
+            "user": USER_FIELDS.project(user, fields),
             "scan_statistics": stats_result or []
         })
     else:
@@ -467,6 +547,15 @@ def initialize_database():
     # Seed with sample data
     db_manager.seed_data()
 
+    # Seeding may have added bins
+    bin_registry.bins_changed()
+
+    # Bring unread badge counters in line with existing notifications
+    rebuild_unread_counters()
+    rebuild_rating_stats()
+    migrate_legacy_suggestions()
+    record_opening_balances()
+
     print("Database initialization completed!")
     return True
 
@@ -0,0 +1,364 @@
+"""
+Request Authentication for Bin Smart
+Verifies the bearer token once per request and resolves the caller into
+g.user / g.admin through in-memory caches, so handlers don't look users up
+"""
+
+from flask import Blueprint, request, jsonify, g, has_request_context
+from database import DatabaseManager
+from data_versions import get_version, bump_version
+from password_hashing import password_hasher, HashingUnavailable
+from fieldsets import USER_FIELDS
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+import hashlib
+import jwt
+import os
+import threading
+import time
+import uuid
+
+auth_bp = Blueprint('auth', __name__, url_prefix='/api')
+db_manager = DatabaseManager()
+
+# Secret key for JWT tokens
+SECRET_KEY = os.getenv('JWT_SECRET_KEY', str(uuid.uuid4()))
+TOKEN_LIFETIME = timedelta(days=1)
+
+# Any 'Bearer admin-...' header passes as an admin when on. On by default
+# only because AdminDashboardFixed still sends 'Bearer admin-token' and the
+# frontend has no login against /api/admin/login yet; set it to false once it
+# does, or on any deployment that doesn't serve that dashboard
+ALLOW_LEGACY_ADMIN_TOKENS = os.getenv('ALLOW_LEGACY_ADMIN_TOKENS', 'true').lower() == 'true'
+# When on, endpoints taking a user_id only accept it from a valid user token;
+# turning it off trusts whatever user_id a client sends
+REQUIRE_USER_TOKEN = os.getenv('REQUIRE_USER_TOKEN', 'true').lower() == 'true'
+
+CLAIMS_CACHE_MAX_ENTRIES = 50000
+CLAIMS_CACHE_TTL_SECONDS = 300
+# Rows changed on another node are picked up within this long
+USER_CACHE_MAX_ENTRIES = 50000
+USER_CACHE_TTL_SECONDS = 60
+
+REVOCATION_VERSION = 'revoked_tokens'
+REVOCATION_CHECK_SECONDS = 5
+# 2^20 bits (128 KiB) with 7 hashes stays under 1% false positives up to ~100k revoked tokens
+REVOCATION_FILTER_BITS = 1 << 20
+REVOCATION_FILTER_HASHES = 7
+
+# Everything handlers may see about a user; never the password hash
+USER_COLUMNS = USER_FIELDS.select()
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries also expire after a TTL"""
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[1]:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RevocationFilter:
+    """Bloom filter over the jti of every revoked token that hasn't expired yet.
+
+    A miss proves the token was never revoked, so ordinary requests cost no
+    query. A hit, real or false positive, is confirmed against revoked_tokens.
+    The filter is rebuilt when the 'revoked_tokens' data version moves, so a
+    logout on one node reaches the others within REVOCATION_CHECK_SECONDS.
+    """
+
+    def __init__(self, bits=REVOCATION_FILTER_BITS, hashes=REVOCATION_FILTER_HASHES,
+                 check_seconds=REVOCATION_CHECK_SECONDS):
+        self.bits = bits
+        self.hashes = hashes
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._filter = bytearray(bits // 8)
+        self._version = None
+        self._checked_at = 0
+
+    def _positions(self, jti):
+        digest = hashlib.blake2b(jti.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        step = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * step) % self.bits for i in range(self.hashes)]
+
+    def _add(self, bitmap, jti):
+        for position in self._positions(jti):
+            bitmap[position >> 3] |= 1 << (position & 7)
+
+    def _ensure_fresh(self):
+        if time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_seconds:
+                return
+            version = get_version(REVOCATION_VERSION)
+            if version is not None and version != self._version:
+                self._reload(version)
+            self._checked_at = time.monotonic()
+
+    def _reload(self, version):
+        rows = db_manager.execute_query("SELECT jti FROM revoked_tokens WHERE expires_at > UTC_TIMESTAMP()")
+        if rows is None:
+            return
+        bitmap = bytearray(self.bits // 8)
+        for row in rows:
+            self._add(bitmap, row['jti'])
+        self._filter = bitmap
+        self._version = version
+
+    def might_contain(self, jti):
+        self._ensure_fresh()
+        bitmap = self._filter
+        return all(bitmap[position >> 3] & (1 << (position & 7)) for position in self._positions(jti))
+
+    def is_revoked(self, jti):
+        if not self.might_contain(jti):
+            return False
+        result = db_manager.execute_query("SELECT 1 FROM revoked_tokens WHERE jti = %s", (jti,))
+        # Can't confirm either way without the database; refuse the token
+        return result is None or bool(result)
+
+    def revoke(self, jti, expires_at):
+        """Record a revoked token until it would have expired anyway"""
+        with db_manager.transaction() as cursor:
+            cursor.execute("""
+                INSERT IGNORE INTO revoked_tokens (jti, expires_at) VALUES (%s, %s)
+            """, (jti, expires_at))
+            cursor.execute("DELETE FROM revoked_tokens WHERE expires_at < UTC_TIMESTAMP() LIMIT 100")
+            bump_version(REVOCATION_VERSION, cursor)
+        with self._lock:
+            self._add(self._filter, jti)
+
+
+claims_cache = TTLCache(CLAIMS_CACHE_TTL_SECONDS, CLAIMS_CACHE_MAX_ENTRIES)
+user_cache = TTLCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES)
+revocation_filter = RevocationFilter()
+
+
+def _issue_token(claims):
+    now = datetime.now(timezone.utc)
+    payload = {**claims, 'jti': uuid.uuid4().hex, 'iat': now, 'exp': now + TOKEN_LIFETIME}
+    return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+
+
+def create_session_token(user_id):
+    return _issue_token({'user_id': user_id})
+
+
+def create_admin_token(admin_id, role):
+    return _issue_token({'admin_id': admin_id, 'role': role})
+
+
+def verify_token(token):
+    """Decoded claims of a valid, unexpired, unrevoked token, or None"""
+    claims = claims_cache.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=['HS256'], options={'require': ['exp']})
+        except jwt.InvalidTokenError:
+            return None
+        claims_cache.set(token, claims, ttl_seconds=claims['exp'] - time.time())
+    elif claims['exp'] <= time.time():
+        claims_cache.discard(token)
+        return None
+
+    if claims.get('jti') and revocation_filter.is_revoked(claims['jti']):
+        return None
+    return claims
+
+
+def load_user(user_id):
+    """A user's row without the password hash, from the cache when possible; None if missing"""
+    user = user_cache.get(user_id)
+    if user is None:
+        result = db_manager.execute_query(f"SELECT {USER_COLUMNS} FROM users u WHERE u.id = %s", (user_id,))
+        if not result:
+            return None
+        user = result[0]
+        user_cache.set(user_id, user)
+    # Callers get their own copy to modify
+    return dict(user)
+
+
+def invalidate_user(user_id):
+    """Drop a cached user row; call after every write to the users table"""
+    user_cache.discard(user_id)
+    if has_request_context() and g.get('user') and g.user['id'] == user_id:
+        g.user_stale = True
+
+
+def hashing_unavailable_response(error):
+    """503 for logins and sign-ups turned away while the hashing pool is saturated"""
+    response = jsonify({"error": f"{error}, please try again shortly"})
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
+
+def bearer_token():
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    return auth_header[len('Bearer '):].strip() or None
+
+
+def authenticate_request():
+    """Resolve the bearer token into g.user / g.admin; runs at most once per request"""
+    if g.get('auth_checked'):
+        return
+    g.auth_checked = True
+    g.user = None
+    g.admin = None
+    g.token_claims = None
+
+    token = bearer_token()
+    if not token:
+        return
+    if token.startswith('admin-'):
+        if ALLOW_LEGACY_ADMIN_TOKENS:
+            g.admin = {'id': None, 'role': 'admin', 'legacy': True}
+        return
+
+    # An invalid token leaves the request anonymous; endpoints that need a
+    # caller reject it through login_required / admin_required
+    claims = verify_token(token)
+    if claims is None:
+        return
+    g.token_claims = claims
+    if 'admin_id' in claims:
+        g.admin = {'id': claims['admin_id'], 'role': claims.get('role', 'admin')}
+    elif 'user_id' in claims:
+        g.user = load_user(claims['user_id'])
+
+
+@auth_bp.before_app_request
+def authenticate_before_request():
+    authenticate_request()
+
+
+def current_user():
+    """The authenticated user's row, reloaded if this request changed it"""
+    authenticate_request()
+    if g.get('user_stale') and g.token_claims and 'user_id' in g.token_claims:
+        g.user = load_user(g.token_claims['user_id'])
+        g.user_stale = False
+    return g.user
+
+
+def request_user_id(claimed_id):
+    """The user id a request acts as, and an error message if it may not act as claimed_id.
+
+    With a user token the token decides; a different claimed id is refused.
+    Without one the claimed id is trusted only if REQUIRE_USER_TOKEN is off;
+    a request claiming no user (an anonymous scan) stays anonymous.
+    """
+    user = current_user()
+    if user:
+        if claimed_id is not None and str(claimed_id) != str(user['id']):
+            return None, 'user_id does not match the authenticated user'
+        return user['id'], None
+    if claimed_id is None:
+        return None, None
+    if REQUIRE_USER_TOKEN:
+        return None, 'Authentication required'
+    return claimed_id, None
+
+
+def login_required(f):
+    """Decorator to require a valid user token"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user():
+            return jsonify({'error': 'Authentication required'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def admin_required(f):
+    """Decorator to require an admin token"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        authenticate_request()
+        if not g.admin:
+            return jsonify({'error': 'Admin authentication required'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@auth_bp.route('/logout', methods=['POST'])
+def logout():
+    """Revoke the presented token"""
+    authenticate_request()
+    claims = g.token_claims
+    if not claims:
+        return jsonify({'error': 'Valid token required'}), 401
+    if not claims.get('jti'):
+        return jsonify({'error': 'Token cannot be revoked'}), 400
+
+    try:
+        expires_at = datetime.fromtimestamp(claims['exp'], timezone.utc).replace(tzinfo=None)
+        revocation_filter.revoke(claims['jti'], expires_at)
+    except Exception as e:
+        print(f"Error revoking token: {e}")
+        return jsonify({'error': 'Logout failed'}), 500
+
+    claims_cache.discard(bearer_token())
+    return jsonify({'message': 'Logged out'})
+
+
+@auth_bp.route('/admin/login', methods=['POST'])
+def admin_login():
+    """Log an admin in and issue an admin token"""
+    data = request.get_json() or {}
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return jsonify({'error': 'Username and password are required'}), 400
+
+    result = db_manager.execute_query(
+        "SELECT id, username, email, role, password_hash FROM admins WHERE username = %s", (username,)
+    )
+    if result is None:
+        return jsonify({'error': 'Login failed'}), 500
+
+    try:
+        if not result or not password_hasher.verify(result[0]['password_hash'], password):
+            return jsonify({'error': 'Invalid username or password'}), 401
+    except HashingUnavailable as e:
+        return hashing_unavailable_response(e)
+
+    admin = result[0]
+    del admin['password_hash']
+    return jsonify({
+        'message': 'Login successful',
+        'admin': admin,
+        'token': create_admin_token(admin['id'], admin['role'])
+    })
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Bin Smart
+Drives endpoints through the Flask test client against the configured MySQL
+database and reports throughput and latency percentiles.
+
+Run a scenario from the backend directory, e.g.:
+
+    python bench.py feedback --requests 2000 --threads 8
+
+For a baseline, check out an older tree and load the app modules from it
+with --app-dir, e.g. for the feedback scenario:
+
+    git worktree add /tmp/before <commit>
+    python bench.py feedback --app-dir /tmp/before/backend
+
+Scenarios only run against trees that have the endpoints they drive. For
+login_storm, PASSWORD_HASH_WORKERS=0 reproduces inline hashing. The
+serializer scenario needs no database; it compares both JSON providers itself.
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from flask import Flask
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_load(app, make_request, total, threads):
+    """Call make_request(client, i) total times across threads; returns timing stats"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker(client):
+        local_latencies = []
+        local_errors = 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            response = make_request(client, i)
+            local_latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    workers = [threading.Thread(target=worker, args=(app.test_client(),)) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': total,
+        'errors': sum(errors),
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(total / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p99_ms': round(percentile(latencies, 99), 2)
+    }
+
+
+def build_app(*blueprints):
+    """A bare app with the blueprints under test, like app.py registers them"""
+    app = Flask(__name__)
+    for blueprint in blueprints:
+        app.register_blueprint(blueprint)
+    return app
+
+
+def bench_feedback(args):
+    """Mixed complaint / rating / suggestion submissions from feedback.py"""
+    from feedback import feedback_bp
+    from bin_registry import bin_registry
+    from database import DatabaseManager
+    from auth import create_session_token
+
+    app = build_app(feedback_bp)
+    bin_ids = [record.id for record in bin_registry.all()] or [1]
+    complaint_types = ['full', 'broken', 'not_working', 'dirty', 'other']
+    # Submissions act as the user their token names, so they need real users
+    users = DatabaseManager().execute_query("SELECT id FROM users ORDER BY id LIMIT %s", (args.users,))
+    if not users:
+        raise SystemExit("No users to submit feedback as")
+    auth = [{'Authorization': f"Bearer {create_session_token(user['id'])}"} for user in users]
+
+    def make_request(client, i):
+        headers = random.choice(auth)
+        kind = i % 3
+        if kind == 0:
+            return client.post('/api/feedback/complaints', json={
+                'bin_id': random.choice(bin_ids),
+                'complaint_type': random.choice(complaint_types),
+                'description': 'benchmark'
+            }, headers=headers)
+        if kind == 1:
+            return client.post('/api/feedback/ratings', json={
+                'bin_id': random.choice(bin_ids),
+                'rating': random.randint(1, 5)
+            }, headers=headers)
+        return client.post('/api/feedback/suggestions', json={
+            'title': 'Benchmark suggestion',
+            'message': 'More bins please'
+        }, headers=headers)
+
+    return run_load(app, make_request, args.requests, args.threads)
+
+
+def load_app():
+    """The full app from app.py, without starting the job scheduler"""
+    os.environ.setdefault('SCHEDULER_ENABLED', 'false')
+    from app import app
+    return app
+
+
+def bench_user(app, args):
+    """Create (once) and log in the benchmark user; returns its id, credentials and auth headers"""
+    client = app.test_client()
+    credentials = {'username': f"bench_user_{args.seed}", 'password': 'bench-password'}
+
+    client.post('/api/users', json={**credentials, 'email': f"{credentials['username']}@example.com"})
+    login = client.post('/api/login', json=credentials)
+    if login.status_code != 200:
+        raise SystemExit(f"Could not log in the benchmark user: {login.get_json()}")
+    body = login.get_json()
+    return body['user']['id'], credentials, {'Authorization': f"Bearer {body['token']}"}
+
+
+def bench_login_storm(args):
+    """Scan endpoint latency while other threads hammer /api/login"""
+    app = load_app()
+    user_id, credentials, auth = bench_user(app, args)
+
+    stop = threading.Event()
+    logins = []
+
+    def storm():
+        storm_client = app.test_client()
+        count = 0
+        while not stop.is_set():
+            storm_client.post('/api/login', json=credentials)
+            count += 1
+        logins.append(count)
+
+    stormers = [threading.Thread(target=storm) for _ in range(args.login_threads)]
+    for thread in stormers:
+        thread.start()
+
+    def make_request(scan_client, i):
+        return scan_client.post('/api/scan', json={'user_id': user_id, 'waste_type': 'Plastic'}, headers=auth)
+
+    try:
+        result = run_load(app, make_request, args.requests, args.threads)
+    finally:
+        stop.set()
+        for thread in stormers:
+            thread.join()
+
+    result['logins_completed'] = sum(logins)
+    return result
+
+
+def bench_redeem(args):
+    """Concurrent redemptions for one user; fails if the balance or redemption count is wrong.
+
+    The user can afford --affordable redemptions of the cheapest reward, far
+    fewer than --requests. Every fifth request retries the previous request's
+    Idempotency-Key and must be replayed rather than redeemed again.
+    """
+    from database import DatabaseManager
+    from reward_index import reward_index
+    from points_ledger import balances, credit, get_balance
+    from auth import invalidate_user
+
+    app = load_app()
+    db_manager = DatabaseManager()
+    user_id, _, auth = bench_user(app, args)
+    rewards = reward_index.rewards()
+    if not rewards:
+        raise SystemExit("No active rewards to redeem")
+    reward = rewards[0]
+    cost = reward['points_required']
+    starting_points = cost * args.affordable
+    # Through the ledger, so points_ledger audit still balances afterwards
+    with db_manager.transaction() as cursor:
+        adjustment = starting_points - balances(cursor, [user_id])[user_id]
+        credit(cursor, {user_id: adjustment}, 'adjustment')
+    invalidate_user(user_id)
+    reward_index.apply_points(user_id, adjustment, total=starting_points)
+
+    run_id = uuid.uuid4().hex[:12]
+    outcomes = []
+
+    def make_request(client, i):
+        key_index = i - 1 if i % 5 == 4 else i
+        response = client.post(
+            '/api/rewards/redeem',
+            json={'user_id': user_id, 'reward_id': reward['id']},
+            headers={**auth, 'Idempotency-Key': f"bench-{run_id}-{key_index}"}
+        )
+        outcomes.append((response.status_code, response.headers.get('Idempotent-Replayed') == 'true'))
+        return response
+
+    result = run_load(app, make_request, args.requests, args.threads)
+
+    redeemed = sum(1 for status, replayed in outcomes if status == 200 and not replayed)
+    balance = get_balance(user_id)
+    rows = db_manager.execute_query(
+        "SELECT COUNT(*) as count FROM reward_redemptions WHERE user_id = %s AND idempotency_key LIKE %s",
+        (user_id, f"bench-{run_id}-%")
+    )[0]['count']
+    unique_keys = len({i - 1 if i % 5 == 4 else i for i in range(args.requests)})
+
+    # Refusals for lack of points are expected and also counted in 'errors'
+    result.update({
+        'redeemed': redeemed,
+        'replayed': sum(1 for status, replayed in outcomes if replayed),
+        'refused': sum(1 for status, _ in outcomes if status == 400),
+        'final_points': balance
+    })
+    problems = []
+    if balance != starting_points - redeemed * cost:
+        problems.append(f"balance {balance} != {starting_points} - {redeemed} x {cost}")
+    if balance < 0:
+        problems.append(f"balance went negative ({balance})")
+    if rows != redeemed:
+        problems.append(f"{rows} redemption rows for {redeemed} successful redemptions")
+    if redeemed != min(args.affordable, unique_keys):
+        problems.append(f"{redeemed} redemptions, expected {min(args.affordable, unique_keys)}")
+    if problems:
+        raise SystemExit('redeem: ' + '; '.join(problems))
+    return result
+
+
+def bench_scan_batch(args):
+    """Scan ingest through /api/scan/batch; --batch-size 1 posts to /api/scan for the per-request baseline"""
+    app = load_app()
+    user_id, _, auth = bench_user(app, args)
+    waste_types = ['Plastic', 'Organic', 'Paper', 'E-Waste', 'Glass']
+
+    def make_request(client, i):
+        if args.batch_size == 1:
+            return client.post('/api/scan', json={'user_id': user_id, 'waste_type': random.choice(waste_types)},
+                               headers=auth)
+        return client.post('/api/scan/batch', json={'scans': [
+            {'user_id': user_id, 'waste_type': random.choice(waste_types)}
+            for _ in range(args.batch_size)
+        ]}, headers=auth)
+
+    result = run_load(app, make_request, args.requests, args.threads)
+    result['scans_per_second'] = round(result['requests_per_second'] * args.batch_size, 1)
+    return result
+
+
+def analytics_payload(rows):
+    """A geographical/heatmap-style response: Decimal coordinates, dates and names, as MySQL rows come back"""
+    from datetime import date, datetime, timedelta
+    from decimal import Decimal
+
+    waste_types = ['Plastic', 'Organic', 'Paper', 'E-Waste', 'Glass']
+    started = datetime(2024, 1, 1, 8, 0, 0)
+    return {
+        'disposal_heatmap': [{
+            'lat': Decimal(f"{random.uniform(18.4, 18.7):.8f}"),
+            'lng': Decimal(f"{random.uniform(73.7, 74.0):.8f}"),
+            'activity_count': random.randint(1, 500),
+            'waste_type': random.choice(waste_types)
+        } for _ in range(rows)],
+        'bin_utilization': [{
+            'id': i + 1,
+            'location_name': f"Ward {i % 40} – Market Road" if i % 5 == 0 else f"Bin {i + 1}",
+            'latitude': Decimal(f"{random.uniform(18.4, 18.7):.8f}"),
+            'longitude': Decimal(f"{random.uniform(73.7, 74.0):.8f}"),
+            'bin_type': random.choice(['general', 'recyclable', 'organic']),
+            'total_disposals': random.randint(0, 10000),
+            'capacity_level': random.randint(0, 100),
+            'recent_scans': random.randint(0, 300),
+            'last_emptied': started + timedelta(minutes=i * 37) if i % 3 else None
+        } for i in range(rows // 4)],
+        'daily_trends': [{
+            'date': date(2024, 1, 1) + timedelta(days=i // 5),
+            'waste_type': waste_types[i % 5],
+            'scan_count': random.randint(0, 2000),
+            'total_quantity': Decimal(f"{random.uniform(0, 5000):.2f}")
+        } for i in range(150)]
+    }
+
+
+def bench_serializer(args):
+    """JSON response encoding of an analytics payload, Flask's default provider against json_provider.py.
+
+    --rows sets the heatmap size. Throughput is response bytes per wall
+    second; cpu_ms is process CPU time per response.
+    """
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import FastJSONProvider, orjson
+
+    app = Flask(__name__)
+    payload = analytics_payload(args.rows)
+    providers = {'default': DefaultJSONProvider(app), 'fast': FastJSONProvider(app)}
+    bodies = {}
+    result = {'orjson': orjson is not None}
+
+    with app.app_context():
+        for name, provider in providers.items():
+            size = len(provider.response(payload).get_data())
+            started, cpu_started = time.perf_counter(), time.process_time()
+            for _ in range(args.requests):
+                provider.response(payload).get_data()
+            elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+            bodies[name] = provider.response(payload).get_data()
+            result[f"{name}_mb_per_second"] = round(size * args.requests / elapsed / 1e6, 1)
+            result[f"{name}_cpu_ms"] = round(cpu / args.requests * 1000, 3)
+
+    result['response_kb'] = round(len(bodies['default']) / 1024, 1)
+    result['speedup'] = round(result['default_cpu_ms'] / result['fast_cpu_ms'], 2)
+    if bodies['fast'] != bodies['default']:
+        raise SystemExit('serializer: fast provider output differs from the default provider')
+    return result
+
+
+SCENARIOS = {
+    'feedback': bench_feedback,
+    'login_storm': bench_login_storm,
+    'redeem': bench_redeem,
+    'scan_batch': bench_scan_batch,
+    'serializer': bench_serializer
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bin Smart endpoint benchmarks')
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--users', type=int, default=200, help='distinct user ids to spread load over')
+    parser.add_argument('--login-threads', type=int, default=16, help='login_storm: concurrent login loops')
+    parser.add_argument('--affordable', type=int, default=50, help='redeem: redemptions the balance covers')
+    parser.add_argument('--batch-size', type=int, default=50, help='scan_batch: scans per request')
+    parser.add_argument('--rows', type=int, default=2000, help='serializer: heatmap rows per response')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--app-dir', help='import the backend modules from this directory instead')
+    args = parser.parse_args()
+
+    if args.app_dir:
+        sys.path.insert(0, os.path.abspath(args.app_dir))
+
+    random.seed(args.seed)
+    result = SCENARIOS[args.scenario](args)
+    print(f"{args.scenario}: " + ', '.join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
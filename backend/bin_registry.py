@@ -0,0 +1,134 @@
+"""
+Bin Registry for Bin Smart
+Every bin held in memory as a compact record, so existence checks and
+name/region lookups don't need a query or a join
+"""
+
+from database import DatabaseManager
+from data_versions import get_version, bump_version
+import math
+import threading
+import time
+
+db_manager = DatabaseManager()
+
+VERSION_NAME = 'bins'
+# How often a node asks whether the bins have changed
+VERSION_CHECK_SECONDS = 5
+
+
+class BinRecord:
+    """One row of the bins table"""
+
+    __slots__ = (
+        'id', 'location_name', 'latitude', 'longitude', 'bin_type', 'capacity_level',
+        'total_disposals', 'last_emptied', 'region', 'is_active', 'created_at'
+    )
+
+    def __init__(self, row):
+        for field in self.__slots__:
+            setattr(self, field, row.get(field))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class BinRegistry:
+    """All bins by id, reloaded when the 'bins' data version moves.
+
+    Writers call bins_changed() after modifying bins; other nodes notice the
+    new version within VERSION_CHECK_SECONDS. Readers always see a complete
+    snapshot because a reload swaps the whole dict at once.
+    """
+
+    def __init__(self, check_seconds=VERSION_CHECK_SECONDS):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._bins = {}
+        self._version = None
+        self._checked_at = 0
+
+    def _ensure_fresh(self):
+        if time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_seconds:
+                return
+            version = get_version(VERSION_NAME)
+            if version is not None and version != self._version:
+                self._reload(version)
+            self._checked_at = time.monotonic()
+
+    def _reload(self, version):
+        rows = db_manager.execute_query("SELECT * FROM bins ORDER BY id")
+        if rows is None:
+            return
+        self._bins = {row['id']: BinRecord(row) for row in rows}
+        self._version = version
+
+    def refresh(self):
+        """Reload on the next access regardless of the version"""
+        with self._lock:
+            self._version = None
+            self._checked_at = 0
+
+    def bins_changed(self, cursor=None):
+        """Bump the bins version after a write, reloading this node straight away"""
+        bump_version(VERSION_NAME, cursor)
+        self.refresh()
+
+    @property
+    def version(self):
+        self._ensure_fresh()
+        return self._version
+
+    def get(self, bin_id):
+        self._ensure_fresh()
+        try:
+            return self._bins.get(int(bin_id))
+        except (TypeError, ValueError):
+            return None
+
+    def exists(self, bin_id):
+        return self.get(bin_id) is not None
+
+    def all(self):
+        self._ensure_fresh()
+        return list(self._bins.values())
+
+    def first_id(self):
+        self._ensure_fresh()
+        return next(iter(self._bins), None)
+
+    def decorate(self, rows, fields, key='bin_id', keep_key=True):
+        """Add bin attributes to rows in place; fields maps bin attribute -> output column"""
+        self._ensure_fresh()
+        for row in rows:
+            record = self._bins.get(row.get(key))
+            if not keep_key:
+                row.pop(key, None)
+            for field, column in fields.items():
+                row[column] = getattr(record, field) if record else None
+        return rows
+
+    def nearby(self, latitude, longitude, radius_km, limit=5, exclude_capacity=('Full',)):
+        """Active bins within radius_km of a point, closest first, as (record, distance_km)"""
+        self._ensure_fresh()
+        lat1, lng1 = math.radians(float(latitude)), math.radians(float(longitude))
+        found = []
+        for record in self._bins.values():
+            if not record.is_active or record.capacity_level in exclude_capacity:
+                continue
+            if record.latitude is None or record.longitude is None:
+                continue
+            lat2, lng2 = math.radians(float(record.latitude)), math.radians(float(record.longitude))
+            # Same spherical law of cosines the SQL version used, clamped against rounding
+            cosine = math.cos(lat1) * math.cos(lat2) * math.cos(lng2 - lng1) + math.sin(lat1) * math.sin(lat2)
+            distance_km = round(6371 * math.acos(max(-1.0, min(1.0, cosine))), 2)
+            if distance_km <= float(radius_km):
+                found.append((record, distance_km))
+        found.sort(key=lambda item: item[1])
+        return found[:limit]
+
+
+bin_registry = BinRegistry()
@@ -0,0 +1,206 @@
+"""
+Dashboard Bootstrap for Bin Smart
+Assembles everything a dashboard screen needs in one response: sections
+backed by queries run concurrently on pooled connections, each cached on its
+own, and a section that fails is reported without failing the rest
+"""
+
+from flask import Blueprint, request, jsonify
+from database import DatabaseManager
+from auth import TTLCache, request_user_id, load_user
+from achievements import milestone_progress, get_user_achievements
+from fieldsets import REWARD_FIELDS
+from notifications import get_unread_count
+from points_ledger import balance_sql
+from reward_index import reward_index
+from reports import LEADERBOARD_CACHE_SECONDS
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import os
+import time
+
+bootstrap_bp = Blueprint('bootstrap', __name__)
+db_manager = DatabaseManager()
+
+# Per-user sections are also keyed by the user's balance or unread count, so
+# a scan, redemption or new notification is visible straight away
+SECTION_CACHE_SECONDS = int(os.getenv('BOOTSTRAP_CACHE_SECONDS', 60))
+SECTION_CACHE_MAX_ENTRIES = 20000
+SECTION_TIMEOUT_SECONDS = float(os.getenv('BOOTSTRAP_SECTION_TIMEOUT_SECONDS', 3))
+# Each worker holds one pooled connection while it runs a section
+BOOTSTRAP_WORKERS = int(os.getenv('BOOTSTRAP_WORKERS', 4))
+RECENT_NOTIFICATIONS = 10
+
+SECTIONS = ('user', 'stats', 'summary', 'notifications', 'rewards', 'leaderboard')
+
+LEADERBOARD_QUERY = f"""
+    SELECT u.username, {balance_sql('u')} as total_points, u.created_at
+    FROM users u
+    ORDER BY total_points DESC
+    LIMIT 10
+"""
+
+SCAN_STATISTICS_QUERY = """
+    SELECT
+        waste_type,
+        COUNT(*) as scan_count,
+        SUM(points_earned) as total_points_from_type
+    FROM waste_scans
+    WHERE user_id = %s
+    GROUP BY waste_type
+"""
+
+_executor = ThreadPoolExecutor(max_workers=BOOTSTRAP_WORKERS, thread_name_prefix='bootstrap')
+_section_cache = TTLCache(SECTION_CACHE_SECONDS, SECTION_CACHE_MAX_ENTRIES)
+
+
+def _fetch_stats(cursor, user_id):
+    cursor.execute(SCAN_STATISTICS_QUERY, (user_id,))
+    return cursor.fetchall()
+
+
+def _fetch_summary(cursor, user_id, total_points):
+    cursor.execute("""
+        SELECT COUNT(*) as total_disposals,
+               SUM(quantity) as total_waste_disposed,
+               AVG(points_earned) as avg_points_per_disposal,
+               COUNT(DISTINCT waste_type) as waste_types_used,
+               COUNT(DISTINCT DATE(scan_date)) as active_days
+        FROM waste_scans
+        WHERE user_id = %s
+    """, (user_id,))
+    summary = cursor.fetchone()
+    summary['milestones'] = milestone_progress(total_points)
+    summary['achievements'] = get_user_achievements(user_id, cursor)
+    summary['estimated_co2_impact'] = round(float(summary['total_waste_disposed'] or 0) * 0.02, 2)
+    return summary
+
+
+def _fetch_notifications(cursor, user_id, unread_count):
+    cursor.execute("""
+        SELECT id, title, message, type, is_read, created_at
+        FROM notifications
+        WHERE user_id = %s
+        ORDER BY id DESC
+        LIMIT %s
+    """, (user_id, RECENT_NOTIFICATIONS))
+    return {'unread_count': unread_count, 'recent': cursor.fetchall()}
+
+
+def _fetch_leaderboard(cursor):
+    cursor.execute(LEADERBOARD_QUERY)
+    return cursor.fetchall()
+
+
+def _run_section(fetch, *args):
+    """Run a fetch on its own pooled connection; read-only, so the commit is a no-op"""
+    with db_manager.transaction() as cursor:
+        return fetch(cursor, *args)
+
+
+def _cached_section(key, fetch, *args, ttl_seconds=None):
+    """A section's value from the cache, or a future that fetches and caches it"""
+    value = _section_cache.get(key)
+    if value is not None:
+        return value, None
+
+    def fetch_and_cache():
+        result = _run_section(fetch, *args)
+        _section_cache.set(key, result, ttl_seconds)
+        return result
+    return None, _executor.submit(fetch_and_cache)
+
+
+def _requested_sections():
+    raw = request.args.get('sections')
+    if raw is None:
+        return list(SECTIONS), None
+    names = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = sorted(names - set(SECTIONS))
+    if unknown:
+        return None, f"Unknown sections: {', '.join(unknown)}. Allowed: {', '.join(SECTIONS)}"
+    return [name for name in SECTIONS if name in names], None
+
+
+@bootstrap_bp.route('/bootstrap/<int:user_id>', methods=['GET'])
+def bootstrap(user_id):
+    """Everything the dashboard shows on mount, in one round trip.
+
+    ?sections= picks a subset of user, stats, summary, notifications,
+    rewards and leaderboard. A section that fails or takes longer than
+    SECTION_TIMEOUT_SECONDS comes back as null with a message in 'errors';
+    the response is still 200 unless the user can't be loaded.
+    """
+    user_id, auth_error = request_user_id(user_id)
+    if auth_error:
+        return jsonify({"error": auth_error}), 403
+    sections, error = _requested_sections()
+    if error:
+        return jsonify({"error": error}), 400
+
+    started = time.perf_counter()
+    # The user row is cached (usually by the token check already) and keys the other sections
+    user = load_user(user_id)
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+    total_points = user['total_points']
+
+    result = {'user': user} if 'user' in sections else {}
+    errors = {}
+    pending = {}
+
+    if 'stats' in sections:
+        result['stats'], pending['stats'] = _cached_section(
+            ('stats', user_id, total_points), _fetch_stats, user_id)
+    if 'summary' in sections:
+        result['summary'], pending['summary'] = _cached_section(
+            ('summary', user_id, total_points), _fetch_summary, user_id, total_points)
+    if 'notifications' in sections:
+        try:
+            unread_count = get_unread_count(user_id)
+            result['notifications'], pending['notifications'] = _cached_section(
+                ('notifications', user_id, unread_count), _fetch_notifications, user_id, unread_count)
+        except Exception as e:
+            print(f"Error loading bootstrap section notifications: {e}")
+            result['notifications'] = None
+            errors['notifications'] = 'Failed to load notifications'
+    if 'leaderboard' in sections:
+        result['leaderboard'], pending['leaderboard'] = _cached_section(
+            ('leaderboard',), _fetch_leaderboard, ttl_seconds=LEADERBOARD_CACHE_SECONDS)
+
+    # Answered from memory by the eligibility index while the queries run
+    if 'rewards' in sections:
+        try:
+            catalog = reward_index.rewards()
+            _, affordable = reward_index.affordable(user_id)
+            result['rewards'] = {
+                'catalog': [REWARD_FIELDS.project(reward, REWARD_FIELDS.default) for reward in catalog],
+                'affordable_ids': [reward['id'] for reward in affordable]
+            }
+        except Exception as e:
+            print(f"Error loading bootstrap section rewards: {e}")
+            result['rewards'] = None
+            errors['rewards'] = 'Failed to load rewards'
+
+    # One deadline for all sections, so a slow one can't stack timeouts
+    deadline = started + SECTION_TIMEOUT_SECONDS
+    for name, future in pending.items():
+        if future is None:
+            continue
+        try:
+            result[name] = future.result(timeout=max(0, deadline - time.perf_counter()))
+        except FutureTimeoutError:
+            # Still queued behind slower sections; don't spend a connection on an answer nobody reads
+            future.cancel()
+            result[name] = None
+            errors[name] = f'Timed out loading {name}'
+        except Exception as e:
+            print(f"Error loading bootstrap section {name}: {e}")
+            result[name] = None
+            errors[name] = f'Failed to load {name}'
+
+    return jsonify({
+        'status': 'partial' if errors else 'success',
+        'user_id': user_id,
+        **result,
+        'errors': errors
+    })
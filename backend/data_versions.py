@@ -0,0 +1,29 @@
+"""
+Data Versions for Bin Smart
+Version counters for rarely changing datasets, bumped on every write so
+in-memory copies on any node know when to reload
+"""
+
+from database import DatabaseManager
+
+db_manager = DatabaseManager()
+
+
+def get_version(name):
+    """Current version of a dataset, 0 if it has never been bumped, None on error"""
+    result = db_manager.execute_query("SELECT version FROM data_versions WHERE name = %s", (name,))
+    if result is None:
+        return None
+    return result[0]['version'] if result else 0
+
+
+def bump_version(name, cursor=None):
+    """Record that a dataset changed; pass the cursor of the writing transaction to bump atomically"""
+    query = """
+        INSERT INTO data_versions (name, version) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """
+    if cursor is not None:
+        cursor.execute(query, (name,))
+        return True
+    return bool(db_manager.execute_query(query, (name,)))
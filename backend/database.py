@@ -1,11 +1,19 @@
 import mysql.connector
 from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
 import os
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import time
 
 load_dotenv()
 
+# mysql-connector refuses pools larger than CNX_POOL_MAXSIZE (32)
+DB_POOL_SIZE = min(int(os.getenv('DB_POOL_SIZE', 20)), pooling.CNX_POOL_MAXSIZE)
+# How long a request waits for a pooled connection to come back before failing
+DB_POOL_WAIT_SECONDS = float(os.getenv('DB_POOL_WAIT_SECONDS', 5))
+POOL_POLL_SECONDS = 0.01
+
 class DatabaseManager:
     _instance = None
     
@@ -24,7 +32,7 @@ class DatabaseManager:
         self.database = os.getenv('DB_NAME', 'bin_smart_db')
         self.connection = None
         self.pool = None
-        self.max_pool_size = 10
+        self.max_pool_size = DB_POOL_SIZE
         self.pool_name = "bin_smart_pool"
         self.pool_reset_session = True
         self.connection_timeout = 30
@@ -47,11 +55,25 @@ class DatabaseManager:
         except Error as e:
             print(f"Error initializing connection pool: {e}")
             
+    def get_pooled_connection(self):
+        """A connection from the pool, waiting up to DB_POOL_WAIT_SECONDS for one to be returned"""
+        deadline = time.monotonic() + DB_POOL_WAIT_SECONDS
+        while True:
+            try:
+                return self.pool.get_connection()
+            except PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(POOL_POLL_SECONDS)
+
     def connect(self):
         """Get connection from pool or establish direct connection if pool fails"""
+        # The shared connection is reused; replacing it would leak a pooled one
+        if self.connection is not None and self.connection.is_connected():
+            return True
         try:
             if self.pool:
-                self.connection = self.pool.get_connection()
+                self.connection = self.get_pooled_connection()
                 if self.connection.is_connected():
                     print(f"Successfully connected to MySQL database from pool: {self.database}")
                     return True
@@ -151,6 +173,57 @@ class DatabaseManager:
                 
         return None  # All retries failed
 
+    @contextmanager
+    def transaction(self):
+        """Run several statements on a dedicated pooled connection as one transaction.
+
+        Yields a dictionary cursor; commits on success and rolls back on error.
+        Unlike execute_query this exposes rowcount/lastrowid and is safe to use
+        from several threads at once.
+        """
+        connection = self.get_pooled_connection() if self.pool else self.create_connection()
+        cursor = connection.cursor(dictionary=True, buffered=True)
+        try:
+            yield cursor
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+
+    def create_connection(self):
+        """Open a dedicated connection outside the pool (e.g. to hold a named lock)"""
+        return mysql.connector.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            connection_timeout=self.connection_timeout
+        )
+
+    def iter_keyset_chunks(self, query, params=(), chunk_size=500, key='id'):
+        """Yield a query's rows in chunks ordered by key, each chunk its own short query.
+
+        The query must end with '<key column> > %s ORDER BY <key column> LIMIT %s';
+        the last seen key and chunk size are appended to params. Each chunk is
+        read on a pooled connection of its own, not the shared one, so
+        background jobs can page through tables while requests run.
+        """
+        last_key = 0
+        while True:
+            with self.transaction() as cursor:
+                cursor.execute(query, tuple(params) + (last_key, chunk_size))
+                rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            last_key = rows[-1][key]
+
     def create_database_if_not_exists(self):
         """Create database if it doesn't exist"""
         try:
@@ -247,6 +320,9 @@ class DatabaseManager:
                     points_used INT NOT NULL,
                     redemption_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     status ENUM('pending', 'completed', 'cancelled') DEFAULT 'pending',
+                    idempotency_key VARCHAR(64),
+                    balance_after INT,
+                    UNIQUE KEY uq_redemptions_idempotency (user_id, idempotency_key),
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
                     FOREIGN KEY (reward_id) REFERENCES rewards(id) ON DELETE CASCADE
                 )
@@ -261,6 +337,8 @@ class DatabaseManager:
                     status ENUM('open', 'in_progress', 'resolved') DEFAULT 'open',
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     resolved_at TIMESTAMP NULL,
+                    migrated_incident_id INT NULL,
+                    INDEX idx_complaints_migration (migrated_incident_id, created_at, id),
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
                     FOREIGN KEY (bin_id) REFERENCES bins(id) ON DELETE CASCADE
                 )
@@ -278,6 +356,19 @@ class DatabaseManager:
                     FOREIGN KEY (bin_id) REFERENCES bins(id) ON DELETE CASCADE
                 )
             """,
+            'bin_rating_stats': """
+                CREATE TABLE IF NOT EXISTS bin_rating_stats (
+                    bin_id INT PRIMARY KEY,
+                    rating_count INT NOT NULL DEFAULT 0,
+                    rating_sum INT NOT NULL DEFAULT 0,
+                    rating_1 INT NOT NULL DEFAULT 0,
+                    rating_2 INT NOT NULL DEFAULT 0,
+                    rating_3 INT NOT NULL DEFAULT 0,
+                    rating_4 INT NOT NULL DEFAULT 0,
+                    rating_5 INT NOT NULL DEFAULT 0,
+                    FOREIGN KEY (bin_id) REFERENCES bins(id) ON DELETE CASCADE
+                )
+            """,
             'notifications': """
                 CREATE TABLE IF NOT EXISTS notifications (
                     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -287,8 +378,151 @@ class DatabaseManager:
                     type ENUM('reminder', 'alert', 'reward', 'milestone', 'info') NOT NULL,
                     is_read BOOLEAN DEFAULT FALSE,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_notifications_type_created (type, created_at),
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            """,
+            'user_counters': """
+                CREATE TABLE IF NOT EXISTS user_counters (
+                    user_id INT PRIMARY KEY,
+                    disposals INT NOT NULL DEFAULT 0,
+                    streak_days INT NOT NULL DEFAULT 0,
+                    last_disposal_date DATE NULL,
+                    waste_type_mask INT NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            """,
+            'user_achievements': """
+                CREATE TABLE IF NOT EXISTS user_achievements (
+                    user_id INT NOT NULL,
+                    achievement_key VARCHAR(50) NOT NULL,
+                    awarded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, achievement_key),
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            """,
+            'notification_counters': """
+                CREATE TABLE IF NOT EXISTS notification_counters (
+                    user_id INT PRIMARY KEY,
+                    unread_count INT NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            """,
+            'bin_alert_log': """
+                CREATE TABLE IF NOT EXISTS bin_alert_log (
+                    user_id INT NOT NULL,
+                    bin_id INT NOT NULL,
+                    sent_at TIMESTAMP NOT NULL,
+                    PRIMARY KEY (user_id, bin_id),
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                    FOREIGN KEY (bin_id) REFERENCES bins(id) ON DELETE CASCADE
+                )
+            """,
+            'complaint_incidents': """
+                CREATE TABLE IF NOT EXISTS complaint_incidents (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    bin_id INT NOT NULL,
+                    complaint_type ENUM('full', 'broken', 'not_working', 'dirty', 'other') NOT NULL,
+                    description TEXT,
+                    status ENUM('open', 'in_progress', 'resolved') DEFAULT 'open',
+                    first_reporter_id INT NULL,
+                    reporter_count INT NOT NULL DEFAULT 0,
+                    first_reported_at TIMESTAMP NOT NULL,
+                    last_reported_at TIMESTAMP NOT NULL,
+                    resolved_at TIMESTAMP NULL,
+                    INDEX idx_incidents_bin_type (bin_id, complaint_type, status),
+                    INDEX idx_incidents_status_reported (status, last_reported_at),
+                    FOREIGN KEY (bin_id) REFERENCES bins(id) ON DELETE CASCADE,
+                    FOREIGN KEY (first_reporter_id) REFERENCES users(id) ON DELETE SET NULL
+                )
+            """,
+            'incident_reporters': """
+                CREATE TABLE IF NOT EXISTS incident_reporters (
+                    incident_id INT NOT NULL,
+                    user_id INT NOT NULL,
+                    description TEXT,
+                    reported_at TIMESTAMP NOT NULL,
+                    PRIMARY KEY (incident_id, user_id),
+                    INDEX idx_reporters_user (user_id, reported_at),
+                    FULLTEXT INDEX ft_reporters_description (description),
+                    FOREIGN KEY (incident_id) REFERENCES complaint_incidents(id) ON DELETE CASCADE,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            """,
+            'suggestions': """
+                CREATE TABLE IF NOT EXISTS suggestions (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    category VARCHAR(50) NOT NULL DEFAULT 'general',
+                    title VARCHAR(200) NOT NULL,
+                    message TEXT NOT NULL,
+                    status ENUM('open', 'in_progress', 'resolved') DEFAULT 'open',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_suggestions_category_created (category, created_at),
+                    FULLTEXT INDEX ft_suggestions_text (title, message),
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
                 )
+            """,
+            'data_versions': """
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    name VARCHAR(50) PRIMARY KEY,
+                    version BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                )
+            """,
+            'scheduled_job_runs': """
+                CREATE TABLE IF NOT EXISTS scheduled_job_runs (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    job_name VARCHAR(100) NOT NULL,
+                    node VARCHAR(255) NOT NULL,
+                    status ENUM('success', 'error', 'timeout') NOT NULL,
+                    started_at TIMESTAMP NOT NULL,
+                    duration_ms INT NOT NULL,
+                    detail TEXT,
+                    INDEX idx_job_started (job_name, started_at)
+                )
+            """,
+            'points_ledger': """
+                CREATE TABLE IF NOT EXISTS points_ledger (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    delta INT NOT NULL,
+                    reason ENUM('opening', 'scan', 'redemption', 'adjustment') NOT NULL,
+                    reference_id INT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_ledger_user (user_id, id)
+                )
+            """,
+            'points_shards': """
+                CREATE TABLE IF NOT EXISTS points_shards (
+                    user_id INT NOT NULL,
+                    shard TINYINT UNSIGNED NOT NULL,
+                    points INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, shard)
+                )
+            """,
+            'scan_keys': """
+                CREATE TABLE IF NOT EXISTS scan_keys (
+                    scan_key VARCHAR(80) PRIMARY KEY,
+                    result JSON NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_scan_keys_created (created_at)
+                )
+            """,
+            'reward_eligibility_changes': """
+                CREATE TABLE IF NOT EXISTS reward_eligibility_changes (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+            'revoked_tokens': """
+                CREATE TABLE IF NOT EXISTS revoked_tokens (
+                    jti CHAR(32) PRIMARY KEY,
+                    expires_at DATETIME NOT NULL,
+                    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_revoked_expires (expires_at)
+                )
             """
         }
 
@@ -299,6 +533,40 @@ class DatabaseManager:
             else:
                 print(f"Failed to create table '{table_name}'")
 
+        # Columns and indexes added after the tables were first released
+        self.ensure_column('reward_redemptions', 'idempotency_key', 'VARCHAR(64)')
+        self.ensure_column('reward_redemptions', 'balance_after', 'INT')
+        self.ensure_index('reward_redemptions', 'uq_redemptions_idempotency', '(user_id, idempotency_key)', kind='UNIQUE KEY')
+        self.ensure_index('notifications', 'idx_notifications_type_created', '(type, created_at)')
+        self.ensure_index('users', 'idx_users_region_activity', '(region, last_activity)')
+        self.ensure_index('incident_reporters', 'ft_reporters_description', '(description)', kind='FULLTEXT INDEX')
+        self.ensure_column('bin_complaints', 'migrated_incident_id', 'INT NULL')
+        self.ensure_index('bin_complaints', 'idx_complaints_migration', '(migrated_incident_id, created_at, id)')
+
+    def ensure_column(self, table_name, column_name, definition):
+        """Add a column to an existing table if it isn't there yet"""
+        check_column_query = """
+            SELECT COUNT(*) as count FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """
+        result = self.execute_query(check_column_query, (table_name, column_name))
+
+        if result and result[0]['count'] == 0:
+            self.execute_query(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}")
+            print(f"Added column '{column_name}' to {table_name} table")
+
+    def ensure_index(self, table_name, index_name, definition, kind='INDEX'):
+        """Add an index to an existing table if it isn't there yet"""
+        check_index_query = """
+            SELECT COUNT(*) as count FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """
+        result = self.execute_query(check_index_query, (table_name, index_name))
+        
+        if result and result[0]['count'] == 0:
+            self.execute_query(f"ALTER TABLE {table_name} ADD {kind} {index_name} {definition}")
+            print(f"Added index '{index_name}' to {table_name} table")
+
     def seed_data(self):
         """Insert sample data"""
         # First check if the region column exists in bins table, add if not
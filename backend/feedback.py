@@ -5,14 +5,92 @@ Handles user complaints, bin ratings, and feedback
 
 from flask import Blueprint, request, jsonify
 from database import DatabaseManager
+from notifications import (
+    create_bulk_notifications, create_bulk_notifications_async,
+    insert_notifications, announce_notifications,
+    get_unread_count, mark_notifications_read, mark_notification_read_by_id, read_ids_error
+)
+from auth import request_user_id
+from incidents import add_report, open_incidents, resolve_incident, COMPLAINT_TYPES
+from bin_registry import bin_registry
+from ratings import apply_rating, get_rating_stats
+from search import search_feedback
+from analytics import admin_required
+from collections import OrderedDict
 from datetime import datetime
+import threading
+import time
 
-feedback_bp = Blueprint('feedback', __name__, url_prefix='/api/feedback')
+# feedback_fixed's blueprint already has the name 'feedback'
+feedback_bp = Blueprint('feedback_api', __name__, url_prefix='/api/feedback')
 db_manager = DatabaseManager()
 
-# Connect to database
-if not db_manager.connect():
-    print("Failed to connect to database in feedback module")
+KNOWN_USERS_MAX = 100000
+ADMIN_IDS_TTL_SECONDS = 60
+MAX_LIST_LIMIT = 100
+
+class KnownUsers:
+    """Bounded LRU set of user ids known to exist, so submissions skip the user lookup"""
+    
+    def __init__(self, max_entries=KNOWN_USERS_MAX):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()
+    
+    def __contains__(self, user_id):
+        with self._lock:
+            if user_id in self._ids:
+                self._ids.move_to_end(user_id)
+                return True
+            return False
+    
+    def add(self, user_id):
+        with self._lock:
+            self._ids[user_id] = None
+            self._ids.move_to_end(user_id)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+known_users = KnownUsers()
+_admin_ids = {'ids': None, 'loaded_at': 0}
+
+def ensure_user(cursor, user_id):
+    """Create a placeholder user record unless the user is already known to exist"""
+    if user_id in known_users:
+        return
+    cursor.execute("""
+        INSERT INTO users (id, username, email) 
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE id = id
+    """, (user_id, f"user_{user_id}", f"user_{user_id}@example.com"))
+
+def acting_user_id(data):
+    """The user a write acts as, from the token or a body user_id it must match; (id, error response)"""
+    user_id, auth_error = request_user_id(data.get('user_id'))
+    if auth_error:
+        return None, (jsonify({'error': auth_error}), 403)
+    if user_id is None:
+        return None, (jsonify({'error': 'Authentication required'}), 401)
+    return user_id, None
+
+def get_admin_ids():
+    """Admin ids for fan-out notifications, cached for a minute"""
+    if _admin_ids['ids'] is None or time.time() - _admin_ids['loaded_at'] > ADMIN_IDS_TTL_SECONDS:
+        admin_results = db_manager.execute_query("SELECT id FROM admins")
+        if admin_results is not None:
+            _admin_ids['ids'] = [admin['id'] for admin in admin_results]
+            _admin_ids['loaded_at'] = time.time()
+    return _admin_ids['ids'] or [1]  # Default to admin ID 1 if no admins
+
+def limit_arg(default=20, maximum=MAX_LIST_LIMIT):
+    """?limit= as a positive int capped at maximum, and an error message if it isn't one"""
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        return None, 'limit must be an integer'
+    if limit < 1:
+        return None, 'limit must be at least 1'
+    return min(limit, maximum), None
 
 @feedback_bp.route('/complaints', methods=['POST'])
 def submit_complaint():
@@ -20,67 +98,49 @@ def submit_complaint():
     try:
         data = request.get_json()
         
-        required_fields = ['user_id', 'bin_id', 'complaint_type']
+        required_fields = ['bin_id', 'complaint_type']
         for field in required_fields:
             if field not in data:
                 return jsonify({'error': f'{field} is required'}), 400
         
-        user_id = data['user_id']
+        user_id, auth_error = acting_user_id(data)
+        if auth_error:
+            return auth_error
         bin_id = data['bin_id']
         complaint_type = data['complaint_type']
         description = data.get('description', '')
         
         # Validate complaint type
-        valid_types = ['full', 'broken', 'not_working', 'dirty', 'other']
-        if complaint_type not in valid_types:
+        if complaint_type not in COMPLAINT_TYPES:
             return jsonify({'error': 'Invalid complaint type'}), 400
         
-        # Check if user exists, if not create a basic user record
-        user_check_query = "SELECT id FROM users WHERE id = %s"
-        user_exists = db_manager.execute_query(user_check_query, (user_id,))
-        
-        if not user_exists:
-            # Create a basic user record
-            create_user_query = """
-                INSERT INTO users (id, username, email) 
-                VALUES (%s, %s, %s)
-                ON DUPLICATE KEY UPDATE id = id
-            """
-            db_manager.execute_query(create_user_query, (user_id, f"user_{user_id}", f"user_{user_id}@example.com"))
-        
         # Check if bin exists
-        bin_check_query = "SELECT id FROM bins WHERE id = %s"
-        bin_exists = db_manager.execute_query(bin_check_query, (bin_id,))
-        
-        if not bin_exists:
+        if not bin_registry.exists(bin_id):
             return jsonify({'error': 'Invalid bin ID'}), 400
         
-        query = """
-            INSERT INTO bin_complaints (user_id, bin_id, complaint_type, description)
-            VALUES (%s, %s, %s, %s)
-        """
+        # User, complaint and confirmation notification commit together
+        with db_manager.transaction() as cursor:
+            ensure_user(cursor, user_id)
+            # Reports of the same problem with the same bin join one incident
+            incident = add_report(cursor, user_id, bin_id, complaint_type, description)
+            
+            if incident['coalesced']:
+                message = (f"Thanks! This {complaint_type} bin issue has already been reported "
+                           f"({incident['reporter_count']} reports) and will be addressed soon.")
+            else:
+                message = f"Your complaint about {complaint_type} bin has been submitted and will be addressed soon."
+            notification = (user_id, "Complaint Submitted", message, "info")
+            notification_ids = insert_notifications(cursor, [notification])
         
-        result = db_manager.execute_query(query, (user_id, bin_id, complaint_type, description))
+        known_users.add(user_id)
+        open_incidents.touch(bin_id, complaint_type, incident['incident_id'])
+        announce_notifications([notification], notification_ids)
         
-        if result:
-            # Create notification for user (ignore errors if notification fails)
-            try:
-                notification_query = """
-                    INSERT INTO notifications (user_id, title, message, type)
-                    VALUES (%s, %s, %s, %s)
-                """
-                db_manager.execute_query(notification_query, (
-                    user_id, 
-                    "Complaint Submitted", 
-                    f"Your complaint about {complaint_type} bin has been submitted and will be addressed soon.",
-                    "info"
-                ))
-            except Exception as e:
-                print(f"Warning: Failed to create notification: {e}")
-            
-            return jsonify({'message': 'Complaint submitted successfully'}), 201
-        else:
-            return jsonify({'error': 'Failed to submit complaint'}), 500
+        return jsonify({
+            'message': 'Complaint submitted successfully',
+            'incident_id': incident['incident_id'],
+            'reporter_count': incident['reporter_count']
+        }), 201
     
     except Exception as e:
         print(f"Error in submit_complaint: {e}")
@@ -91,82 +151,71 @@ def get_complaints():
     """Get complaints (admin view or user-specific)"""
     user_id = request.args.get('user_id')
     status = request.args.get('status', 'all')
-    limit = int(request.args.get('limit', 20))
+    limit, limit_error = limit_arg()
+    if limit_error:
+        return jsonify({'error': limit_error}), 400
     
     if user_id:
-        # User-specific complaints
+        # User-specific complaints: the user's own reports with their incident's status
         query = """
-            SELECT bc.*, b.location_name, b.bin_type
-            FROM bin_complaints bc
-            JOIN bins b ON bc.bin_id = b.id
-            WHERE bc.user_id = %s
+            SELECT i.id, r.user_id, i.bin_id, i.complaint_type, r.description,
+                   i.status, r.reported_at as created_at, i.resolved_at,
+                   i.reporter_count
+            FROM incident_reporters r
+            JOIN complaint_incidents i ON r.incident_id = i.id
+            WHERE r.user_id = %s
         """
         params = [user_id]
+        order_by = "r.reported_at"
+        bin_fields = {'location_name': 'location_name', 'bin_type': 'bin_type'}
     else:
-        # Admin view - all complaints
+        # Admin view - one row per incident, however many people reported it
         query = """
-            SELECT bc.*, u.username, b.location_name, b.bin_type, b.region
-            FROM bin_complaints bc
-            JOIN users u ON bc.user_id = u.id
-            JOIN bins b ON bc.bin_id = b.id
+            SELECT i.*, i.first_reported_at as created_at, u.username
+            FROM complaint_incidents i
+            LEFT JOIN users u ON i.first_reporter_id = u.id
+            WHERE 1 = 1
         """
         params = []
+        order_by = "i.last_reported_at"
+        bin_fields = {'location_name': 'location_name', 'bin_type': 'bin_type', 'region': 'region'}
     
     if status != 'all':
-        query += " AND bc.status = %s"
+        query += " AND i.status = %s"
         params.append(status)
     
-    query += " ORDER BY bc.created_at DESC LIMIT %s"
+    query += f" ORDER BY {order_by} DESC LIMIT %s"
     params.append(limit)
     
     result = db_manager.execute_query(query, params)
-    return jsonify({'complaints': result or []})
+    return jsonify({'complaints': bin_registry.decorate(result or [], bin_fields)})
 
 @feedback_bp.route('/complaints/<int:complaint_id>/resolve', methods=['PUT'])
+@admin_required
 def resolve_complaint(complaint_id):
-    """Mark a complaint as resolved (admin action)"""
-    data = request.get_json()
+    """Mark a complaint incident as resolved and notify everyone who reported it (admin action)"""
+    data = request.get_json() or {}
     resolution_notes = data.get('resolution_notes', '')
     
-    query = """
-        UPDATE bin_complaints 
-        SET status = 'resolved', resolved_at = NOW()
-        WHERE id = %s
-    """
+    incident = resolve_incident(complaint_id)
     
-    result = db_manager.execute_query(query, (complaint_id,))
+    if not incident:
+        return jsonify({'error': 'Complaint not found'}), 404
     
-    if result:
-        # Get complaint details to send notification
-        complaint_query = """
-            SELECT bc.user_id, u.username, b.location_name
-            FROM bin_complaints bc
-            JOIN users u ON bc.user_id = u.id
-            JOIN bins b ON bc.bin_id = b.id
-            WHERE bc.id = %s
-        """
-        complaint_info = db_manager.execute_query(complaint_query, (complaint_id,))
-        
-        if complaint_info:
-            # Notify user about resolution
-            notification_query = """
-                INSERT INTO notifications (user_id, title, message, type)
-                VALUES (%s, %s, %s, %s)
-            """
-            message = f"Your complaint about {complaint_info[0]['location_name']} has been resolved."
-            if resolution_notes:
-                message += f" Note: {resolution_notes}"
-                
-            db_manager.execute_query(notification_query, (
-                complaint_info[0]['user_id'],
-                "Complaint Resolved",
-                message,
-                "info"
-            ))
-        
-        return jsonify({'message': 'Complaint resolved successfully'})
-    else:
-        return jsonify({'error': 'Failed to resolve complaint'}), 500
+    bin_record = bin_registry.get(incident['bin_id'])
+    location_name = bin_record.location_name if bin_record else 'your bin'
+    
+    # Notify reporters about resolution
+    message = f"Your complaint about {location_name} has been resolved."
+    if resolution_notes:
+        message += f" Note: {resolution_notes}"
+    
+    create_bulk_notifications(incident['reporters'], "Complaint Resolved", message, "info")
+    
+    return jsonify({
+        'message': 'Complaint resolved successfully',
+        'reporters_notified': len(incident['reporters'])
+    })
 
 @feedback_bp.route('/ratings', methods=['POST'])
 def submit_rating():
@@ -174,12 +223,14 @@ def submit_rating():
     try:
         data = request.get_json()
         
-        required_fields = ['user_id', 'bin_id', 'rating']
+        required_fields = ['bin_id', 'rating']
         for field in required_fields:
             if field not in data:
                 return jsonify({'error': f'{field} is required'}), 400
         
-        user_id = data['user_id']
+        user_id, auth_error = acting_user_id(data)
+        if auth_error:
+            return auth_error
         bin_id = data['bin_id']
         rating = data['rating']
         comment = data.get('comment', '')
@@ -188,39 +239,17 @@ def submit_rating():
         if not (1 <= rating <= 5):
             return jsonify({'error': 'Rating must be between 1 and 5'}), 400
         
-        # Check if user exists, if not create a basic user record
-        user_check_query = "SELECT id FROM users WHERE id = %s"
-        user_exists = db_manager.execute_query(user_check_query, (user_id,))
-        
-        if not user_exists:
-            # Create a basic user record
-            create_user_query = """
-                INSERT INTO users (id, username, email) 
-                VALUES (%s, %s, %s)
-                ON DUPLICATE KEY UPDATE id = id
-            """
-            db_manager.execute_query(create_user_query, (user_id, f"user_{user_id}", f"user_{user_id}@example.com"))
-        
         # Check if bin exists
-        bin_check_query = "SELECT id FROM bins WHERE id = %s"
-        bin_exists = db_manager.execute_query(bin_check_query, (bin_id,))
-        
-        if not bin_exists:
+        if not bin_registry.exists(bin_id):
             return jsonify({'error': 'Invalid bin ID'}), 400
         
-        # Use INSERT ... ON DUPLICATE KEY UPDATE to handle updates
-        query = """
-            INSERT INTO bin_ratings (user_id, bin_id, rating, comment)
-            VALUES (%s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE rating = VALUES(rating), comment = VALUES(comment), created_at = NOW()
-        """
-        
-        result = db_manager.execute_query(query, (user_id, bin_id, rating, comment))
+        # Insert or update the rating and the bin's aggregate together
+        with db_manager.transaction() as cursor:
+            ensure_user(cursor, user_id)
+            apply_rating(cursor, user_id, bin_id, rating, comment)
         
-        if result:
-            return jsonify({'message': 'Rating submitted successfully'}), 201
-        else:
-            return jsonify({'error': 'Failed to submit rating'}), 500
+        known_users.add(user_id)
+        return jsonify({'message': 'Rating submitted successfully'}), 201
     
     except Exception as e:
         print(f"Error in submit_rating: {e}")
@@ -230,13 +259,8 @@ def submit_rating():
 def get_bin_ratings(bin_id):
     """Get ratings for a specific bin"""
     
-    # Get average rating and total ratings
-    avg_query = """
-        SELECT AVG(rating) as avg_rating, COUNT(*) as total_ratings
-        FROM bin_ratings
-        WHERE bin_id = %s
-    """
-    avg_result = db_manager.execute_query(avg_query, (bin_id,))
+    # Average, total and histogram from the maintained aggregate
+    stats = get_rating_stats(bin_id)
     
     # Get individual ratings
     ratings_query = """
@@ -250,8 +274,7 @@ def get_bin_ratings(bin_id):
     ratings_result = db_manager.execute_query(ratings_query, (bin_id,))
     
     return jsonify({
-        'average_rating': round(avg_result[0]['avg_rating'], 2) if avg_result and avg_result[0]['avg_rating'] else 0,
-        'total_ratings': avg_result[0]['total_ratings'] if avg_result else 0,
+        **stats,
         'ratings': ratings_result or []
     })
 
@@ -261,7 +284,9 @@ def submit_suggestion():
     try:
         data = request.get_json()
         
-        user_id = data.get('user_id', 1)  # Default to user 1 if not provided
+        user_id, auth_error = acting_user_id(data)
+        if auth_error:
+            return auth_error
         title = data.get('title', 'Service Suggestion')
         message = data.get('message', '')
         category = data.get('category', 'general')
@@ -269,78 +294,74 @@ def submit_suggestion():
         if not message:
             return jsonify({'error': 'Message is required'}), 400
         
-        # Check if user exists, if not create a basic user record
-        user_check_query = "SELECT id FROM users WHERE id = %s"
-        user_exists = db_manager.execute_query(user_check_query, (user_id,))
+        with db_manager.transaction() as cursor:
+            ensure_user(cursor, user_id)
+            cursor.execute("""
+                INSERT INTO suggestions (user_id, category, title, message)
+                VALUES (%s, %s, %s, %s)
+            """, (user_id, category, title[:200], message))
+            # Create notification for the user who submitted the suggestion
+            notification = (user_id, "Suggestion Received", f"Thank you for your suggestion: {title}", "info")
+            notification_ids = insert_notifications(cursor, [notification])
         
-        if not user_exists:
-            # Create a basic user record
-            create_user_query = """
-                INSERT INTO users (id, username, email) 
-                VALUES (%s, %s, %s)
-                ON DUPLICATE KEY UPDATE id = id
-            """
-            db_manager.execute_query(create_user_query, (user_id, f"user_{user_id}", f"user_{user_id}@example.com"))
+        known_users.add(user_id)
+        announce_notifications([notification], notification_ids)
         
-        # Store as a special type of complaint with category 'suggestion'
-        # First, let's get any available bin ID as we need one for the foreign key
-        get_bin_query = "SELECT id FROM bins LIMIT 1"
-        bin_result = db_manager.execute_query(get_bin_query)
-        default_bin_id = bin_result[0]['id'] if bin_result else 1
+        # Notify admins about the new suggestion without holding up the response
+        create_bulk_notifications_async(
+            get_admin_ids(),
+            "New Suggestion Received",
+            f"User {user_id} submitted a suggestion: {title}",
+            "alert"
+        )
         
-        query = """
-            INSERT INTO bin_complaints (user_id, bin_id, complaint_type, description)
-            VALUES (%s, %s, 'other', %s)
-        """
-        
-        suggestion_text = f"SUGGESTION [{category}]: {title} - {message}"
-        result = db_manager.execute_query(query, (user_id, default_bin_id, suggestion_text))
-        
-        if result:
-            # Create notification for admin users about the new suggestion
-            admin_query = "SELECT id FROM admins"
-            admin_results = db_manager.execute_query(admin_query)
-            admin_ids = [admin['id'] for admin in admin_results] if admin_results else [1]  # Default to admin ID 1 if no admins
-            
-            # Import notification functions from a separate module to avoid circular imports
-            import sys
-            sys.path.append('.')
-            from notifications import create_notification, create_bulk_notifications
-            
-            try:
-                # Create notification for the user who submitted the suggestion
-                create_notification(
-                    user_id, 
-                    "Suggestion Received", 
-                    f"Thank you for your suggestion: {title}", 
-                    "info"
-                )
-                
-                # Notify admins about the new suggestion
-                create_bulk_notifications(
-                    admin_ids,
-                    "New Suggestion Received",
-                    f"User {user_id} submitted a suggestion: {title}",
-                    "alert"
-                )
-                print(f"Notifications created for suggestion: {title}")
-            except Exception as e:
-                print(f"Error creating notifications: {e}")
-            
-            return jsonify({'message': 'Suggestion submitted successfully'}), 201
-        else:
-            return jsonify({'error': 'Failed to submit suggestion'}), 500
+        return jsonify({'message': 'Suggestion submitted successfully'}), 201
     
     except Exception as e:
         print(f"Error in submit_suggestion: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@feedback_bp.route('/search', methods=['GET'])
+@admin_required
+def search():
+    """Ranked full-text search over complaints and suggestions (admin view)"""
+    kind = request.args.get('type', 'all')  # all, complaint, suggestion
+    if kind not in ('all', 'complaint', 'suggestion'):
+        return jsonify({'error': 'type must be all, complaint or suggestion'}), 400
+    
+    limit, limit_error = limit_arg()
+    if limit_error:
+        return jsonify({'error': limit_error}), 400
+    status = request.args.get('status')
+    
+    terms, results = search_feedback(
+        request.args.get('q', ''),
+        kind=kind,
+        type_filter=request.args.get('category') or request.args.get('complaint_type'),
+        region=request.args.get('region'),
+        status=None if status in (None, 'all') else status,
+        date_from=request.args.get('date_from'),
+        date_to=request.args.get('date_to'),
+        limit=limit
+    )
+    
+    return jsonify({
+        'terms': terms,
+        'results': results,
+        'count': len(results)
+    })
+
 @feedback_bp.route('/notifications/<int:user_id>', methods=['GET'])
 def get_user_notifications(user_id):
     """Get notifications for a specific user"""
+    user_id, auth_error = request_user_id(user_id)
+    if auth_error:
+        return jsonify({'error': auth_error}), 403
     
     unread_only = request.args.get('unread_only', 'false').lower() == 'true'
-    limit = int(request.args.get('limit', 20))
+    limit, limit_error = limit_arg()
+    if limit_error:
+        return jsonify({'error': limit_error}), 400
     
     query = """
         SELECT id, title, message, type, is_read, created_at
@@ -356,33 +377,41 @@ def get_user_notifications(user_id):
     params.append(limit)
     
     result = db_manager.execute_query(query, params)
-    return jsonify({'notifications': result or []})
+    return jsonify({
+        'notifications': result or [],
+        'unread_count': get_unread_count(user_id)
+    })
 
 @feedback_bp.route('/notifications/<int:notification_id>/mark-read', methods=['PUT'])
 def mark_notification_read(notification_id):
-    """Mark a notification as read"""
-    
-    query = "UPDATE notifications SET is_read = TRUE WHERE id = %s"
-    result = db_manager.execute_query(query, (notification_id,))
+    """Mark one of the caller's notifications as read"""
+    user_id, auth_error = acting_user_id(request.get_json(silent=True) or {})
+    if auth_error:
+        return auth_error
     
-    if result:
+    if mark_notification_read_by_id(notification_id, user_id):
         return jsonify({'message': 'Notification marked as read'})
     else:
-        return jsonify({'error': 'Failed to update notification'}), 500
+        return jsonify({'error': 'Notification not found'}), 404
 
 @feedback_bp.route('/notifications/bulk-read', methods=['PUT'])
 def mark_all_notifications_read():
-    """Mark all notifications as read for a user"""
-    data = request.get_json()
-    user_id = data.get('user_id')
+    """Mark a user's notifications as read: a list of ids, everything up to a cursor, or all"""
+    data = request.get_json() or {}
     
-    if not user_id:
+    if not data.get('user_id'):
         return jsonify({'error': 'user_id is required'}), 400
+    user_id, auth_error = request_user_id(data['user_id'])
+    if auth_error:
+        return jsonify({'error': auth_error}), 403
+    ids_error = read_ids_error(data.get('ids'))
+    if ids_error:
+        return jsonify({'error': ids_error}), 400
     
-    query = "UPDATE notifications SET is_read = TRUE WHERE user_id = %s"
-    result = db_manager.execute_query(query, (user_id,))
+    marked = mark_notifications_read(user_id, data.get('ids'), data.get('up_to_id'))
     
-    if result:
-        return jsonify({'message': 'All notifications marked as read'})
-    else:
-        return jsonify({'error': 'Failed to update notifications'}), 500
+    return jsonify({
+        'message': f'{marked} notifications marked as read',
+        'marked_read': marked,
+        'unread_count': get_unread_count(user_id)
+    })
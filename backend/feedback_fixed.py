@@ -3,26 +3,15 @@ from flask_cors import CORS
 import json
 import os
 from datetime import datetime
+from notification_hub import notification_hub
+from feedback_store import feedback_store
+from bin_registry import bin_registry
+from database import DatabaseManager
+from incidents import add_report, open_incidents, COMPLAINT_TYPES
+from feedback import ensure_user, known_users
 
 feedback_bp = Blueprint('feedback', __name__)
-
-# Mock feedback data storage
-feedback_data = {
-    'complaints': [],
-    'notifications': []
-}
-
-# Mock bins data
-mock_bins = [
-    {"id": 1, "name": "Central Park - Main Entrance", "type": "Mixed", "location": "Manhattan"},
-    {"id": 2, "name": "Downtown Recycling Center", "type": "Plastic", "location": "Manhattan"},
-    {"id": 3, "name": "City Hall - East Side", "type": "Paper", "location": "Manhattan"},
-    {"id": 4, "name": "Tech District E-Waste Point", "type": "E-Waste", "location": "Manhattan"},
-    {"id": 5, "name": "Riverside Glass Collection", "type": "Glass", "location": "Manhattan"},
-    {"id": 6, "name": "Brooklyn Bridge Park", "type": "Mixed", "location": "Brooklyn"},
-    {"id": 7, "name": "Queens Community Center", "type": "Organic", "location": "Queens"},
-    {"id": 8, "name": "Bronx Zoo Entrance", "type": "Mixed", "location": "Bronx"}
-]
+db_manager = DatabaseManager()
 
 @feedback_bp.route('/complaints', methods=['GET', 'POST', 'OPTIONS'])
 def handle_complaints():
@@ -33,8 +22,7 @@ def handle_complaints():
     if request.method == 'GET':
         user_id = request.args.get('user_id', 1)
         # Filter complaints by user_id if provided
-        user_complaints = [c for c in feedback_data['complaints'] if c.get('user_id') == int(user_id)]
-        return jsonify(user_complaints)
+        return jsonify(feedback_store.for_user('complaints', int(user_id)))
 
     if request.method == 'POST':
         try:
@@ -42,22 +30,39 @@ def handle_complaints():
             if not data:
                 return jsonify({"error": "No data provided"}), 400
 
-            complaint = {
-                'id': len(feedback_data['complaints']) + 1,
-                'user_id': data.get('user_id', 1),
-                'bin_id': data.get('bin_id'),
+            try:
+                user_id = int(data.get('user_id', 1))
+            except (TypeError, ValueError):
+                return jsonify({"error": "user_id must be an integer"}), 400
+
+            # Complaints about a known bin also join its incident, which the dashboards and admins work from
+            incident = None
+            bin_id = data.get('bin_id')
+            if bin_id is not None and bin_registry.exists(bin_id):
+                bin_id = int(bin_id)
+                complaint_type = data.get('complaint_type')
+                incident_type = complaint_type if complaint_type in COMPLAINT_TYPES else 'other'
+                with db_manager.transaction() as cursor:
+                    ensure_user(cursor, user_id)
+                    incident = add_report(cursor, user_id, bin_id, incident_type, data.get('description', ''))
+                known_users.add(user_id)
+                open_incidents.touch(bin_id, incident_type, incident['incident_id'])
+
+            complaint = feedback_store.insert('complaints', {
+                'user_id': user_id,
+                'bin_id': bin_id,
+                'incident_id': incident['incident_id'] if incident else None,
                 'complaint_type': data.get('complaint_type', 'General'),
                 'description': data.get('description', ''),
                 'status': 'Pending',
                 'created_at': datetime.now().isoformat(),
                 'priority': data.get('priority', 'Medium')
-            }
-
-            feedback_data['complaints'].append(complaint)
+            })
 
             return jsonify({
                 "message": "Complaint submitted successfully",
                 "complaint_id": complaint['id'],
+                "incident_id": complaint['incident_id'],
                 "status": "success"
             }), 201
 
@@ -73,8 +78,7 @@ def handle_notifications():
     if request.method == 'GET':
         user_id = request.args.get('user_id', 1)
         # Filter notifications by user_id if provided
-        user_notifications = [n for n in feedback_data['notifications'] if n.get('user_id') == int(user_id)]
-        return jsonify(user_notifications)
+        return jsonify(feedback_store.for_user('notifications', int(user_id)))
 
     if request.method == 'POST':
         try:
@@ -82,17 +86,21 @@ def handle_notifications():
             if not data:
                 return jsonify({"error": "No data provided"}), 400
 
-            notification = {
-                'id': len(feedback_data['notifications']) + 1,
-                'user_id': data.get('user_id', 1),
+            # Streams are keyed by the integer id, so '5' must become 5 before publishing
+            try:
+                user_id = int(data.get('user_id', 1))
+            except (TypeError, ValueError):
+                return jsonify({"error": "user_id must be an integer"}), 400
+
+            notification = feedback_store.insert('notifications', {
+                'user_id': user_id,
                 'title': data.get('title', 'New Notification'),
                 'message': data.get('message', ''),
                 'type': data.get('type', 'info'),
                 'read': False,
                 'created_at': datetime.now().isoformat()
-            }
-
-            feedback_data['notifications'].append(notification)
+            })
+            notification_hub.publish(notification['user_id'], 'notification', notification)
 
             return jsonify({
                 "message": "Notification created successfully",
@@ -109,7 +117,7 @@ def handle_notification(notification_id):
     if request.method == 'OPTIONS':
         return jsonify({"status": "ok"}), 200
 
-    notification = next((n for n in feedback_data['notifications'] if n['id'] == notification_id), None)
+    notification = feedback_store.get('notifications', notification_id)
 
     if not notification:
         return jsonify({"error": "Notification not found"}), 404
@@ -124,9 +132,7 @@ def handle_notification(notification_id):
                 return jsonify({"error": "No data provided"}), 400
 
             # Update notification fields
-            for key, value in data.items():
-                if key in notification:
-                    notification[key] = value
+            feedback_store.update('notifications', notification_id, data)
 
             return jsonify({
                 "message": "Notification updated successfully",
@@ -138,7 +144,7 @@ def handle_notification(notification_id):
 
     if request.method == 'DELETE':
         try:
-            feedback_data['notifications'] = [n for n in feedback_data['notifications'] if n['id'] != notification_id]
+            feedback_store.delete('notifications', notification_id)
             return jsonify({
                 "message": "Notification deleted successfully",
                 "status": "success"
@@ -147,21 +153,13 @@ def handle_notification(notification_id):
         except Exception as e:
             return jsonify({"error": f"Failed to delete notification: {str(e)}"}), 500
 
-@feedback_bp.route('/bins', methods=['GET', 'OPTIONS'])
-def get_bins():
-    """Get all available bins"""
-    if request.method == 'OPTIONS':
-        return jsonify({"status": "ok"}), 200
-
-    return jsonify(mock_bins)
-
 @feedback_bp.route('/complaints/<int:complaint_id>', methods=['GET', 'PUT', 'DELETE', 'OPTIONS'])
 def handle_complaint(complaint_id):
     """Handle individual complaint operations"""
     if request.method == 'OPTIONS':
         return jsonify({"status": "ok"}), 200
 
-    complaint = next((c for c in feedback_data['complaints'] if c['id'] == complaint_id), None)
+    complaint = feedback_store.get('complaints', complaint_id)
 
     if not complaint:
         return jsonify({"error": "Complaint not found"}), 404
@@ -176,9 +174,7 @@ def handle_complaint(complaint_id):
                 return jsonify({"error": "No data provided"}), 400
 
             # Update complaint fields
-            for key, value in data.items():
-                if key in complaint:
-                    complaint[key] = value
+            feedback_store.update('complaints', complaint_id, data)
 
             return jsonify({
                 "message": "Complaint updated successfully",
@@ -190,7 +186,7 @@ def handle_complaint(complaint_id):
 
     if request.method == 'DELETE':
         try:
-            feedback_data['complaints'] = [c for c in feedback_data['complaints'] if c['id'] != complaint_id]
+            feedback_store.delete('complaints', complaint_id)
             return jsonify({
                 "message": "Complaint deleted successfully",
                 "status": "success"
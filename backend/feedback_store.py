@@ -0,0 +1,266 @@
+"""
+Feedback Store for Bin Smart
+Keeps the complaints and notifications served by feedback_fixed in memory,
+indexed by id and by user, and durable through an append-only log that
+several worker processes can share
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no flock, so run a single worker process there
+    fcntl = None
+
+DATA_DIR = os.getenv('FEEDBACK_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+# Log entries written before the log is folded into a fresh snapshot
+COMPACT_EVERY = 1000
+
+
+class Collection:
+    """Records by id plus a secondary index from user_id to that user's ids"""
+
+    def __init__(self, name):
+        self.name = name
+        self.records = {}
+        self.by_user = {}
+        self.next_id = 1
+
+    def put(self, record):
+        previous = self.records.get(record['id'])
+        if previous is not None:
+            self._unindex(previous)
+        self.records[record['id']] = record
+        # Dicts keep insertion order, so each user's ids stay in creation order
+        self.by_user.setdefault(record.get('user_id'), {})[record['id']] = None
+        self.next_id = max(self.next_id, record['id'] + 1)
+
+    def remove(self, record_id):
+        record = self.records.pop(record_id, None)
+        if record is not None:
+            self._unindex(record)
+        return record
+
+    def _unindex(self, record):
+        ids = self.by_user.get(record.get('user_id'))
+        if ids is not None:
+            ids.pop(record['id'], None)
+            if not ids:
+                del self.by_user[record.get('user_id')]
+
+
+class FeedbackStore:
+    """Record store with snapshot + append-only log durability, shared by worker processes.
+
+    Every mutation is appended to ``feedback.log`` as one JSON line and then
+    applied in memory. Every ``compact_every`` entries the whole state is
+    written to ``feedback.snapshot.json`` (via a temp file and rename) and the
+    log is swapped for an empty one, so recovery is one snapshot load plus a
+    short log replay. A torn final log line from a crash is skipped.
+
+    Processes serialize on an flock of ``feedback.lock``: writers hold it
+    exclusively, readers shared. Before each operation a process replays the
+    log lines other processes appended since it last looked, or reloads
+    everything when the log was swapped by a compaction.
+
+    Ids are monotonic per collection and survive restarts, because the
+    snapshot stores the next id and replayed records move it forward.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, collections=('complaints', 'notifications'), compact_every=COMPACT_EVERY):
+        self.data_dir = data_dir
+        self.compact_every = compact_every
+        self.collection_names = collections
+        self.snapshot_path = os.path.join(data_dir, 'feedback.snapshot.json')
+        self.log_path = os.path.join(data_dir, 'feedback.log')
+        self.lock_path = os.path.join(data_dir, 'feedback.lock')
+        self._lock = threading.RLock()
+        self._collections = {}
+        self._log = None
+        self._log_offset = 0
+        self._log_entries = 0
+        self._torn_tail = False
+        self._lock_depth = 0
+
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._lock_file = open(self.lock_path, 'a+b')
+        with self._locked(exclusive=False):
+            self._load()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """Hold the thread lock and the inter-process file lock; re-entrant within a thread"""
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _load(self):
+        """Rebuild memory from the snapshot plus the whole log"""
+        self._collections = {name: Collection(name) for name in self.collection_names}
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            for name, state in snapshot.get('collections', {}).items():
+                collection = self._collections.setdefault(name, Collection(name))
+                for record in state['records']:
+                    collection.put(record)
+                collection.next_id = max(collection.next_id, state['next_id'])
+
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.log_path, 'ab')
+        self._log_offset = 0
+        self._log_entries = 0
+        self._torn_tail = False
+        self._replay_log()
+
+    def _replay_log(self):
+        """Apply the log lines past the offset this process has already read"""
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        if not data:
+            return
+
+        lines = data.split(b'\n')
+        # An unterminated last line is torn; writers start a new line after it
+        self._torn_tail = bool(lines[-1])
+        for line in lines:
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                print(f"Skipping unreadable entry in {self.log_path}")
+                continue
+            self._apply(entry)
+            self._log_entries += 1
+        self._log_offset += len(data)
+
+    def _sync(self):
+        """Catch up with writes made by other processes; call with the file lock held"""
+        try:
+            swapped = os.stat(self.log_path).st_ino != os.fstat(self._log.fileno()).st_ino
+        except FileNotFoundError:
+            swapped = True
+        if swapped:
+            self._load()
+        else:
+            self._replay_log()
+
+    def _apply(self, entry):
+        collection = self._collections.setdefault(entry['collection'], Collection(entry['collection']))
+        if entry['op'] == 'put':
+            collection.put(entry['record'])
+        elif entry['op'] == 'delete':
+            collection.remove(entry['id'])
+
+    def _append(self, entry):
+        """Log an entry, then apply it; call with the exclusive lock held after _sync()"""
+        line = json.dumps(entry, default=str).encode('utf-8') + b'\n'
+        if self._torn_tail:
+            line = b'\n' + line
+            self._torn_tail = False
+        self._log.write(line)
+        self._log.flush()
+        self._log_offset += len(line)
+        self._log_entries += 1
+        self._apply(entry)
+        if self._log_entries >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Write a snapshot of the current state and start an empty log"""
+        with self._locked(exclusive=True):
+            self._sync()
+            snapshot = {
+                'collections': {
+                    name: {'next_id': collection.next_id, 'records': list(collection.records.values())}
+                    for name, collection in self._collections.items()
+                }
+            }
+            temp_path = self.snapshot_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+
+            # A new file rather than a truncate, so other processes see the swap by inode
+            empty_path = self.log_path + '.tmp'
+            open(empty_path, 'wb').close()
+            os.replace(empty_path, self.log_path)
+            self._log.close()
+            self._log = open(self.log_path, 'ab')
+            self._log_offset = 0
+            self._log_entries = 0
+            self._torn_tail = False
+
+    def insert(self, collection, record):
+        """Store a new record under the next id and return it"""
+        with self._locked(exclusive=True):
+            self._sync()
+            record = {'id': self._collections[collection].next_id, **record}
+            self._append({'op': 'put', 'collection': collection, 'record': record})
+            return dict(record)
+
+    def get(self, collection, record_id):
+        with self._locked(exclusive=False):
+            self._sync()
+            record = self._collections[collection].records.get(record_id)
+            return dict(record) if record is not None else None
+
+    def update(self, collection, record_id, changes):
+        """Apply changes to existing fields of a record; returns it, or None if missing"""
+        with self._locked(exclusive=True):
+            self._sync()
+            record = self._collections[collection].records.get(record_id)
+            if record is None:
+                return None
+            updated = dict(record)
+            updated.update({key: value for key, value in changes.items() if key in record and key != 'id'})
+            self._append({'op': 'put', 'collection': collection, 'record': updated})
+            return dict(updated)
+
+    def delete(self, collection, record_id):
+        with self._locked(exclusive=True):
+            self._sync()
+            if record_id not in self._collections[collection].records:
+                return False
+            self._append({'op': 'delete', 'collection': collection, 'id': record_id})
+            return True
+
+    def for_user(self, collection, user_id):
+        """A user's records in creation order"""
+        with self._locked(exclusive=False):
+            self._sync()
+            records = self._collections[collection].records
+            return [dict(records[record_id]) for record_id in self._collections[collection].by_user.get(user_id, ())]
+
+    def stats(self):
+        with self._locked(exclusive=False):
+            self._sync()
+            return {
+                'collections': {name: len(collection.records) for name, collection in self._collections.items()},
+                'log_entries': self._log_entries
+            }
+
+
+feedback_store = FeedbackStore()
@@ -0,0 +1,88 @@
+"""
+Sparse Fieldsets for Bin Smart
+Per-endpoint whitelists of the fields a read endpoint may return, used both
+to validate ?fields= and to build the SELECT column list, so unrequested and
+secret columns are never read
+"""
+
+from flask import request
+from points_ledger import balance_sql
+
+MAX_FIELDS_PARAMETER_LENGTH = 500
+
+
+class Fieldset:
+    """Field name -> SQL expression for one endpoint, plus its default projection"""
+
+    def __init__(self, columns, default=None):
+        self.columns = columns
+        self.default = list(default or columns)
+
+    def requested(self):
+        """Fields named in ?fields=, the default projection without it, and an error message"""
+        raw = request.args.get('fields')
+        if raw is None:
+            return list(self.default), None
+        if len(raw) > MAX_FIELDS_PARAMETER_LENGTH:
+            return None, 'fields is too long'
+        names = [name.strip() for name in raw.split(',') if name.strip()]
+        if not names:
+            return None, 'fields must name at least one field'
+        unknown = sorted(set(names) - set(self.columns))
+        if unknown:
+            return None, f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(self.columns)}"
+        # Whitelist order, without duplicates
+        return [name for name in self.columns if name in names], None
+
+    def select(self, fields=None, required=()):
+        """SELECT column list for fields plus any the handler itself needs"""
+        wanted = set(self.default if fields is None else fields) | set(required)
+        columns = []
+        for name, expression in self.columns.items():
+            if name not in wanted:
+                continue
+            if expression.split('.')[-1] == name:
+                columns.append(expression)
+            else:
+                columns.append(f"{expression} as {name}")
+        return ', '.join(columns)
+
+    def project(self, row, fields):
+        """Only the requested fields of a row or cached record"""
+        if isinstance(row, dict):
+            return {name: row.get(name) for name in fields}
+        return {name: getattr(row, name, None) for name in fields}
+
+
+# A users row as clients may see it; password_hash is deliberately absent
+USER_FIELDS = Fieldset({
+    'id': 'u.id',
+    'username': 'u.username',
+    'email': 'u.email',
+    'total_points': balance_sql('u'),
+    'last_activity': 'u.last_activity',
+    'region': 'u.region',
+    'created_at': 'u.created_at'
+})
+
+USER_SUMMARY_FIELDS = Fieldset({
+    **USER_FIELDS.columns,
+    'total_disposals': 'COUNT(ws.id)',
+    'total_waste_disposed': 'SUM(ws.quantity)',
+    'avg_points_per_disposal': 'AVG(ws.points_earned)',
+    'waste_types_used': 'COUNT(DISTINCT ws.waste_type)',
+    'active_days': 'COUNT(DISTINCT DATE(ws.scan_date))'
+})
+
+BIN_FIELDS = Fieldset({
+    name: name for name in (
+        'id', 'location_name', 'latitude', 'longitude', 'bin_type', 'capacity_level',
+        'total_disposals', 'last_emptied', 'region', 'is_active', 'created_at'
+    )
+})
+
+REWARD_FIELDS = Fieldset({
+    name: name for name in (
+        'id', 'name', 'description', 'points_required', 'category', 'is_active', 'created_at'
+    )
+})
@@ -0,0 +1,20 @@
+"""
+Gunicorn Settings for Bin Smart
+gevent workers serve each request on a greenlet, so idle notification
+streams cost memory rather than OS threads. Create the tables once with
+`python app.py`, then serve from the backend directory with:
+
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('FLASK_PORT', 8080)}"
+worker_class = 'gevent'
+workers = int(os.getenv('WEB_WORKERS', 2))
+# Concurrent connections per worker: open streams (MAX_OPEN_STREAMS, 5000 by
+# default under gevent) plus headroom for regular requests
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', 6000))
+# Each worker must import the app after gevent has patched threading
+preload_app = False
+graceful_timeout = 30
@@ -0,0 +1,155 @@
+"""
+HTTP Caching for Bin Smart
+Strong ETags for read endpoints taken from data versions, If-None-Match
+answered with 304 before any database work, and gzip/deflate compression of
+large responses
+"""
+
+from flask import request, g, current_app, make_response
+from auth import TTLCache
+from functools import wraps
+import gzip
+import hashlib
+import itertools
+import os
+import uuid
+import zlib
+
+# Smaller bodies aren't worth the CPU; their headers are most of the bytes anyway
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/csv')
+# Preferred first when a client accepts both
+ENCODINGS = ('gzip', 'deflate')
+
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_TTL_SECONDS = 3600
+
+# Tags of max_age responses are only unique within this process
+NODE_TAG = uuid.uuid4().hex[:8]
+
+_responses = TTLCache(RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES)
+_sequence = itertools.count(1)
+
+
+def _query_tag():
+    if not request.query_string:
+        return ''
+    return '-' + hashlib.blake2b(request.query_string, digest_size=6).hexdigest()
+
+
+def _matching_tag(etag):
+    """The tag from If-None-Match that names this representation, in any encoding"""
+    if not request.if_none_match:
+        return None
+    for candidate in (etag,) + tuple(f"{etag}-{encoding}" for encoding in ENCODINGS):
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def _finish(response, etag, private):
+    response.set_etag(etag)
+    # Clients keep the body but must revalidate before every use
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _not_modified(etag, private):
+    return _finish(current_app.response_class(status=304), etag, private)
+
+
+def conditional(name, version=None, max_age=None, private=False):
+    """Give a GET endpoint a strong ETag and answer If-None-Match with 304.
+
+    version is a callable returning the current version of the data behind
+    the response without a query, e.g. bin_registry's; the tag is built from
+    it, so every node agrees on it. Without one, max_age reuses a rendered
+    response for that many seconds under a tag of its own. Either way the
+    last 200 body per URL is kept, so an unchanged read never reaches the
+    view. Put it below the auth decorators; private marks per-caller data.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+
+            key = (name, request.full_path)
+            entry = _responses.get(key)
+            if version is not None:
+                current = version()
+                if current is None:
+                    return f(*args, **kwargs)
+                etag = f"{name}-{current}{_query_tag()}"
+                if entry is not None and entry['etag'] != etag:
+                    entry = None
+            elif entry is not None:
+                etag = entry['etag']
+            else:
+                etag = None
+
+            if etag is not None:
+                matched = _matching_tag(etag)
+                if matched:
+                    return _not_modified(matched, private)
+
+            if entry is not None:
+                g.cached_response = entry
+                response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+                return _finish(response, etag, private)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            if etag is None:
+                etag = f"{name}-{NODE_TAG}-{next(_sequence)}"
+            entry = {'etag': etag, 'body': response.get_data(), 'mimetype': response.mimetype, 'encoded': {}}
+            _responses.set(key, entry, ttl_seconds=max_age)
+            g.cached_response = entry
+            return _finish(response, etag, private)
+        return decorated_function
+    return decorator
+
+
+def _encode(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 keeps the bytes identical for identical bodies, as a strong ETag needs
+        return gzip.compress(data, COMPRESS_LEVEL, mtime=0)
+    return zlib.compress(data, COMPRESS_LEVEL)
+
+
+def compress_response(response):
+    """after_request hook: gzip or deflate large text bodies for clients that accept it"""
+    if (response.status_code < 200 or response.status_code >= 300 or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.content_length is not None and response.content_length < COMPRESS_MIN_BYTES:
+        return response
+    encoding = next((name for name in ENCODINGS if request.accept_encodings[name]), None)
+    if encoding is None:
+        return response
+
+    # A cached body's compressed copy is reused until its tag changes
+    entry = g.get('cached_response')
+    data = entry['encoded'].get(encoding) if entry else None
+    if data is None:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        data = _encode(body, encoding)
+        if entry:
+            entry['encoded'][encoding] = data
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Complaint Incidents for Bin Smart
+Coalesces repeated complaints about the same bin and problem into one
+incident that tracks how many people reported it
+
+Move legacy bin_complaints rows into incidents once, from the backend directory:
+
+    python incidents.py migrate
+"""
+
+from database import DatabaseManager
+from datetime import datetime, timedelta
+import argparse
+import threading
+
+db_manager = DatabaseManager()
+
+# Reports of the same (bin, complaint type) this close together join one incident
+INCIDENT_WINDOW_HOURS = 24
+COMPLAINT_TYPES = ('full', 'broken', 'not_working', 'dirty', 'other')
+MIGRATION_CHUNK_SIZE = 500
+
+
+class OpenIncidentIndex:
+    """(bin_id, complaint_type) -> (incident_id, last_reported_at) for open incidents.
+
+    Lets a complaint storm skip the duplicate search: a hit only re-reads
+    that incident's status by primary key, since another node may have
+    resolved it. A miss still checks the database inside the write
+    transaction, so incidents opened by another node are joined rather than
+    duplicated.
+    """
+
+    def __init__(self, window_hours=INCIDENT_WINDOW_HOURS):
+        self.window = timedelta(hours=window_hours)
+        self._lock = threading.Lock()
+        self._open = {}
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        incidents = db_manager.execute_query("""
+            SELECT id, bin_id, complaint_type, last_reported_at
+            FROM complaint_incidents
+            WHERE status != 'resolved' AND last_reported_at >= %s
+        """, (datetime.now() - self.window,))
+        if incidents is None:
+            return
+        with self._lock:
+            for incident in incidents:
+                self._open[(incident['bin_id'], incident['complaint_type'])] = (
+                    incident['id'], incident['last_reported_at']
+                )
+            self._loaded = True
+
+    def find(self, bin_id, complaint_type):
+        """Id of the open incident a new report should join, if it is still in its window"""
+        self._ensure_loaded()
+        key = (bin_id, complaint_type)
+        with self._lock:
+            entry = self._open.get(key)
+            if entry is None:
+                return None
+            if datetime.now() - entry[1] > self.window:
+                del self._open[key]
+                return None
+            return entry[0]
+
+    def touch(self, bin_id, complaint_type, incident_id):
+        with self._lock:
+            self._open[(bin_id, complaint_type)] = (incident_id, datetime.now())
+
+    def close(self, incident_id):
+        with self._lock:
+            for key, entry in list(self._open.items()):
+                if entry[0] == incident_id:
+                    del self._open[key]
+
+
+open_incidents = OpenIncidentIndex()
+
+
+def report_complaint(user_id, bin_id, complaint_type, description=''):
+    """Record a complaint, joining the open incident for the bin and type if there is one.
+
+    Returns the incident id, its reporter count and whether the report was
+    coalesced into an existing incident. A user reporting the same incident
+    twice is only counted once.
+    """
+    with db_manager.transaction() as cursor:
+        incident = add_report(cursor, user_id, bin_id, complaint_type, description)
+    open_incidents.touch(bin_id, complaint_type, incident['incident_id'])
+    return incident
+
+
+def add_report(cursor, user_id, bin_id, complaint_type, description=''):
+    """report_complaint inside a caller's transaction; call open_incidents.touch() once it commits"""
+    now = datetime.now()
+    incident_id = open_incidents.find(bin_id, complaint_type)
+
+    if incident_id is not None:
+        # Resolving on another node doesn't reach this node's index
+        cursor.execute("SELECT status FROM complaint_incidents WHERE id = %s FOR UPDATE", (incident_id,))
+        cached = cursor.fetchone()
+        if not cached or cached['status'] == 'resolved':
+            open_incidents.close(incident_id)
+            incident_id = None
+
+    if incident_id is None:
+        cursor.execute("""
+            SELECT id FROM complaint_incidents
+            WHERE bin_id = %s AND complaint_type = %s
+            AND status != 'resolved' AND last_reported_at >= %s
+            ORDER BY id DESC LIMIT 1
+            FOR UPDATE
+        """, (bin_id, complaint_type, now - open_incidents.window))
+        existing = cursor.fetchone()
+        incident_id = existing['id'] if existing else None
+
+    coalesced = incident_id is not None
+    if not coalesced:
+        cursor.execute("""
+            INSERT INTO complaint_incidents
+                (bin_id, complaint_type, description, first_reporter_id,
+                 reporter_count, first_reported_at, last_reported_at)
+            VALUES (%s, %s, %s, %s, 0, %s, %s)
+        """, (bin_id, complaint_type, description, user_id, now, now))
+        incident_id = cursor.lastrowid
+
+    cursor.execute("""
+        INSERT IGNORE INTO incident_reporters (incident_id, user_id, description, reported_at)
+        VALUES (%s, %s, %s, %s)
+    """, (incident_id, user_id, description, now))
+    new_reporter = cursor.rowcount == 1
+
+    # LAST_INSERT_ID(expr) hands the new count back without another SELECT
+    cursor.execute("""
+        UPDATE complaint_incidents
+        SET reporter_count = LAST_INSERT_ID(reporter_count + %s), last_reported_at = %s
+        WHERE id = %s
+    """, (1 if new_reporter else 0, now, incident_id))
+
+    return {
+        'incident_id': incident_id,
+        'reporter_count': cursor.lastrowid,
+        'coalesced': coalesced
+    }
+
+
+def resolve_incident(incident_id):
+    """Mark an incident resolved; returns its bin and reporter ids, or None if it doesn't exist"""
+    with db_manager.transaction() as cursor:
+        cursor.execute("""
+            UPDATE complaint_incidents
+            SET status = 'resolved', resolved_at = NOW()
+            WHERE id = %s
+        """, (incident_id,))
+        cursor.execute("SELECT bin_id FROM complaint_incidents WHERE id = %s", (incident_id,))
+        incident = cursor.fetchone()
+        if not incident:
+            return None
+        cursor.execute("SELECT user_id FROM incident_reporters WHERE incident_id = %s", (incident_id,))
+        reporters = [row['user_id'] for row in cursor.fetchall()]
+
+    open_incidents.close(incident_id)
+    return {'bin_id': incident['bin_id'], 'reporters': reporters}
+
+
+def migrate_legacy_complaints(chunk_size=MIGRATION_CHUNK_SIZE):
+    """Copy bin_complaints rows into incidents, coalescing open reports like add_report does.
+
+    Resolved complaints become one resolved incident each. Rows are locked
+    chunk by chunk and stamped with the incident they went into rather than
+    deleted, so the originals stay for audit and a rerun skips them. A user
+    reporting the same incident again has the description appended to their
+    reporter row. Legacy suggestions are left for migrate_legacy_suggestions.
+    """
+    moved = 0
+    window = timedelta(hours=INCIDENT_WINDOW_HOURS)
+    # (bin_id, complaint_type, status) -> (incident_id, last_reported_at), across chunks
+    open_by_key = {}
+
+    while True:
+        with db_manager.transaction() as cursor:
+            cursor.execute("""
+                SELECT id, user_id, bin_id, complaint_type, description, status, created_at, resolved_at
+                FROM bin_complaints
+                WHERE migrated_incident_id IS NULL
+                  AND NOT (complaint_type = 'other' AND description LIKE 'SUGGESTION [%%')
+                ORDER BY created_at, id
+                LIMIT %s
+                FOR UPDATE
+            """, (chunk_size,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            touched = set()
+            for row in rows:
+                key = (row['bin_id'], row['complaint_type'], row['status'])
+                entry = open_by_key.get(key) if row['status'] != 'resolved' else None
+                if entry is not None and row['created_at'] - entry[1] <= window:
+                    incident_id = entry[0]
+                    cursor.execute(
+                        "UPDATE complaint_incidents SET last_reported_at = %s WHERE id = %s",
+                        (row['created_at'], incident_id)
+                    )
+                else:
+                    cursor.execute("""
+                        INSERT INTO complaint_incidents
+                            (bin_id, complaint_type, description, status, first_reporter_id,
+                             reporter_count, first_reported_at, last_reported_at, resolved_at)
+                        VALUES (%s, %s, %s, %s, %s, 0, %s, %s, %s)
+                    """, (row['bin_id'], row['complaint_type'], row['description'], row['status'],
+                          row['user_id'], row['created_at'], row['created_at'], row['resolved_at']))
+                    incident_id = cursor.lastrowid
+                if row['status'] != 'resolved':
+                    open_by_key[key] = (incident_id, row['created_at'])
+
+                cursor.execute("""
+                    INSERT INTO incident_reporters (incident_id, user_id, description, reported_at)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE description = CONCAT_WS('\n', description, VALUES(description))
+                """, (incident_id, row['user_id'], row['description'], row['created_at']))
+                cursor.execute(
+                    "UPDATE bin_complaints SET migrated_incident_id = %s WHERE id = %s",
+                    (incident_id, row['id'])
+                )
+                touched.add(incident_id)
+
+            touched = sorted(touched)
+            cursor.execute(f"""
+                UPDATE complaint_incidents i
+                SET reporter_count = (SELECT COUNT(*) FROM incident_reporters r WHERE r.incident_id = i.id)
+                WHERE i.id IN ({', '.join(['%s'] * len(touched))})
+            """, touched)
+
+        moved += len(rows)
+        if len(rows) < chunk_size:
+            break
+
+    if moved:
+        print(f"Copied {moved} legacy complaints from bin_complaints into incidents")
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bin Smart complaint incident tools')
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('--chunk-size', type=int, default=MIGRATION_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    # The app adds these at startup too; the migration may run before it has
+    db_manager.ensure_column('bin_complaints', 'migrated_incident_id', 'INT NULL')
+    db_manager.ensure_index('bin_complaints', 'idx_complaints_migration', '(migrated_incident_id, created_at, id)')
+    print(f"Migrated {migrate_legacy_complaints(args.chunk_size)} legacy complaints")
+
+
+if __name__ == '__main__':
+    main()
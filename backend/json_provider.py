@@ -0,0 +1,108 @@
+"""
+JSON Responses for Bin Smart
+Serializes responses with orjson when it is installed, producing the same
+bytes as Flask's default provider, and falls back to the standard json module
+for anything orjson would write differently
+"""
+
+from flask.json.provider import DefaultJSONProvider
+from datetime import date, datetime
+from decimal import Decimal
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Python's json escapes DEL and everything above it when ensure_ascii is on
+_NON_ASCII = re.compile('[\x7f-\U0010ffff]')
+# orjson writes 1e16 and 0.00001 where json.dumps writes 1e+16 and 1e-05; the
+# lookbehind keeps 'e' as the literal prefix, which searches far faster
+_FLOAT_EXPONENT = re.compile(rb'e(?<=[0-9]e)')
+
+_COMPACT_SEPARATORS = (',', ':')
+_INDENTED_SEPARATORS = (',', ': ')
+_DUMPS_ARGUMENTS = {'default', 'indent', 'separators', 'sort_keys', 'ensure_ascii'}
+
+_DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _http_date(value):
+    """werkzeug's http_date for naive datetimes and plain dates, without the timezone round trip"""
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        _DAY_NAMES[value.weekday()], value.day, _MONTH_NAMES[value.month - 1], value.year,
+        getattr(value, 'hour', 0), getattr(value, 'minute', 0), getattr(value, 'second', 0)
+    )
+
+
+def _escape_char(match):
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return '\\u{0:04x}\\u{1:04x}'.format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return '\\u{0:04x}'.format(code)
+
+
+def escape_non_ascii(text):
+    """Escape characters the way json.dumps(ensure_ascii=True) does"""
+    if text.isascii() and '\x7f' not in text:
+        return text
+    return _NON_ASCII.sub(_escape_char, text)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider with an orjson fast path for the arguments responses use.
+
+    Dates are still written with http_date and Decimals with str, as the
+    default provider does. Objects orjson rejects (dicts with non-string keys,
+    integers beyond 64 bits) or whose floats it would write in another
+    exponent notation go through json.dumps. NaN and infinity come out as
+    null rather than json.dumps' non-standard NaN; MySQL can't store them, so
+    query results never hold one.
+    """
+
+    def _fast_default(self, value):
+        kind = type(value)
+        if kind is Decimal:
+            return str(value)
+        if (kind is datetime and value.tzinfo is None) or kind is date:
+            return _http_date(value)
+        return self.default(value)
+
+    def _orjson_options(self, kwargs):
+        """orjson option flags equivalent to the dumps kwargs, or None if they can't be matched"""
+        if orjson is None or set(kwargs) - _DUMPS_ARGUMENTS:
+            return None
+        if kwargs.get('default', self.default) is not self.default:
+            return None
+
+        indent = kwargs.get('indent')
+        separators = kwargs.get('separators')
+        if indent is None and separators == _COMPACT_SEPARATORS:
+            options = 0
+        elif indent == 2 and separators in (None, _INDENTED_SEPARATORS):
+            options = orjson.OPT_INDENT_2
+        else:
+            return None
+
+        # Dates and dataclasses go through the default hook like they do for json.dumps
+        options |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if kwargs.get('sort_keys', self.sort_keys):
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        options = self._orjson_options(kwargs)
+        if options is not None:
+            try:
+                data = orjson.dumps(obj, default=self._fast_default, option=options)
+            except TypeError:
+                data = None
+            if data is not None and not _FLOAT_EXPONENT.search(data) and b'0.0000' not in data:
+                text = data.decode()
+                return escape_non_ascii(text) if kwargs.get('ensure_ascii', self.ensure_ascii) else text
+        if kwargs.get('default', self.default) is self.default:
+            kwargs['default'] = self._fast_default
+        return super().dumps(obj, **kwargs)
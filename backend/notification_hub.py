@@ -0,0 +1,214 @@
+"""
+Notification Hub for Bin Smart
+In-process pub/sub that pushes new notifications to Server-Sent Event streams.
+
+Serve the app with gevent workers (see gunicorn.conf.py) so an idle stream
+parks a greenlet rather than an OS thread; under the threaded development
+server every open stream holds a thread.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+# Events kept per user so a reconnecting stream can resume via Last-Event-ID
+BACKLOG_SIZE = 50
+# Users whose backlog is kept in memory; the least recently notified are evicted first
+MAX_BACKLOG_USERS = 10000
+# Streams refused past this many per process: a greenlet each under gevent, a
+# thread each otherwise. Keep it below gunicorn's worker_connections.
+GREEN_STREAM_LIMIT = 5000
+THREADED_STREAM_LIMIT = 200
+
+
+def green_threads():
+    """Whether gevent has patched threading, so blocking waits park greenlets"""
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+MAX_OPEN_STREAMS = int(os.getenv('MAX_OPEN_STREAMS') or
+                       (GREEN_STREAM_LIMIT if green_threads() else THREADED_STREAM_LIMIT))
+
+
+class Subscription:
+    """A single open stream waiting for events for one user"""
+
+    __slots__ = ('user_id', 'pending', 'condition', 'closed')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def push(self, event):
+        with self.condition:
+            self.pending.append(event)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def wait(self, timeout):
+        """Block until events arrive or the timeout expires, then drain them"""
+        with self.condition:
+            if not self.pending and not self.closed:
+                self.condition.wait(timeout)
+            events = list(self.pending)
+            self.pending.clear()
+            return events
+
+
+class _Backlog(deque):
+    """Recent events for one user, remembering the newest one that fell off"""
+
+    def __init__(self, size):
+        super().__init__(maxlen=size)
+        self.dropped_through = 0
+
+    def append(self, event):
+        if len(self) == self.maxlen:
+            self.dropped_through = self[0]['seq']
+        super().append(event)
+
+    def newest_seq(self):
+        return self[-1]['seq'] if self else self.dropped_through
+
+
+class NotificationHub:
+    """Fans notifications out to the open streams of each user.
+
+    Subscriptions are plain objects parked on a condition variable, so the hub
+    itself never starts a thread per connection; the worker serving a stream
+    is held until it closes. subscribe() refuses streams beyond max_streams so
+    idle streams can't take every worker from regular requests.
+
+    Event ids are ``<epoch>-<sequence>``; the epoch changes on every restart so
+    stale ids from a previous process always trigger a resync.
+    """
+
+    def __init__(self, backlog_size=BACKLOG_SIZE, max_backlog_users=MAX_BACKLOG_USERS,
+                 max_streams=MAX_OPEN_STREAMS):
+        self.backlog_size = backlog_size
+        self.max_backlog_users = max_backlog_users
+        self.max_streams = max_streams
+        self._open_streams = 0
+        self.epoch = str(int(time.time() * 1000))
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._evicted_through = 0
+        self._backlogs = OrderedDict()
+        self._subscribers = {}
+
+    def publish(self, user_id, event_type, data):
+        """Publish an event to a user's open streams and backlog"""
+        with self._lock:
+            self._sequence += 1
+            event = {
+                'id': f"{self.epoch}-{self._sequence}",
+                'seq': self._sequence,
+                'event': event_type,
+                'data': data
+            }
+
+            backlog = self._backlogs.get(user_id)
+            if backlog is None:
+                backlog = self._backlogs[user_id] = _Backlog(self.backlog_size)
+            else:
+                self._backlogs.move_to_end(user_id)
+            backlog.append(event)
+
+            while len(self._backlogs) > self.max_backlog_users:
+                _, evicted = self._backlogs.popitem(last=False)
+                self._evicted_through = max(self._evicted_through, evicted.newest_seq())
+
+            subscribers = list(self._subscribers.get(user_id, ()))
+
+        for subscription in subscribers:
+            subscription.push(event)
+        return event['id']
+
+    def subscribe(self, user_id, last_event_id=None):
+        """Open a stream for a user, queueing anything missed since last_event_id; None when full"""
+        subscription = Subscription(user_id)
+
+        with self._lock:
+            if self._open_streams >= self.max_streams:
+                return None
+            self._open_streams += 1
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+
+            if last_event_id:
+                for event in self._missed_events(user_id, last_event_id):
+                    subscription.pending.append(event)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Detach a stream from the hub"""
+        subscription.close()
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers and subscription in subscribers:
+                self._open_streams -= 1
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def streaming_users(self):
+        """Ids of users with at least one open stream on this node"""
+        with self._lock:
+            return set(self._subscribers)
+
+    def _missed_events(self, user_id, last_event_id):
+        """Events after last_event_id, or a resync marker if they can't be replayed"""
+        epoch, _, seq = last_event_id.partition('-')
+        try:
+            last_seq = int(seq)
+        except ValueError:
+            last_seq = None
+
+        if epoch != self.epoch or last_seq is None:
+            return [self._resync_event()]
+
+        backlog = self._backlogs.get(user_id)
+        dropped_through = backlog.dropped_through if backlog else self._evicted_through
+        if last_seq < dropped_through:
+            return [self._resync_event()]
+
+        return [event for event in backlog or () if event['seq'] > last_seq]
+
+    def _resync_event(self):
+        # Tells the client to refetch its notification list once over HTTP
+        return {'id': None, 'seq': self._sequence, 'event': 'resync', 'data': {}}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open_streams': sum(len(s) for s in self._subscribers.values()),
+                'users_streaming': len(self._subscribers),
+                'users_with_backlog': len(self._backlogs),
+                'last_event_id': f"{self.epoch}-{self._sequence}"
+            }
+
+
+def format_sse(event):
+    """Render an event in text/event-stream wire format"""
+    lines = []
+    if event.get('id'):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {json.dumps(event['data'], default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+notification_hub = NotificationHub()
@@ -3,30 +3,469 @@ Notification System for Bin Smart
 Handles push notifications, alerts, and reminders
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response
 from database import DatabaseManager
+from analytics import admin_required
+from auth import bearer_token, verify_token, request_user_id
+from notification_hub import notification_hub, format_sse
+from reward_index import reward_index
+from bin_registry import bin_registry
+from scheduler import check_job
+from mysql.connector import Error
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
+import threading
+import time
 
 notifications_bp = Blueprint('notifications', __name__, url_prefix='/api/notifications')
 db_manager = DatabaseManager()
 
-# Connect to database
-if not db_manager.connect():
-    print("Failed to connect to database in notifications module")
+# Server-Sent Events stream settings
+STREAM_HEARTBEAT_SECONDS = 25
+STREAM_MAX_SECONDS = 30 * 60  # Clients reconnect with Last-Event-ID after this
+STREAM_RETRY_MS = 5000
+
+JOB_CHUNK_SIZE = 500
+# Largest ids list one mark-read request may send; it becomes one IN (...) list
+MAX_READ_IDS = 500
+BIN_ALERT_DEDUPE_HOURS = 24
+
+# Unread badge counts cached per node
+UNREAD_CACHE_TTL_SECONDS = 30
+UNREAD_CACHE_MAX_ENTRIES = 100000
+FANOUT_WORKERS = 2
+
+# Notifications written by other nodes reach this node's streams within this long
+RELAY_INTERVAL_SECONDS = 2
+RELAY_CHUNK_SIZE = 1000
+
+class UnreadCounterCache:
+    """Per-user unread counts kept in memory for badge refreshes.
+
+    Entries expire after a short TTL so counts written by other nodes are
+    picked up; local inserts and reads adjust cached entries in place.
+    """
+
+    def __init__(self, ttl_seconds=UNREAD_CACHE_TTL_SECONDS, max_entries=UNREAD_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                return None
+            return entry[0]
+
+    def set(self, user_id, count):
+        with self._lock:
+            self._entries[user_id] = (count, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def adjust(self, user_id, delta):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries[user_id] = (max(entry[0] + delta, 0), entry[1])
+
+unread_counts = UnreadCounterCache()
+
+class NotificationRelay:
+    """Pushes notifications written on other nodes to this node's open streams.
+
+    The hub only reaches streams in its own process, so while any are open
+    one thread per node reads new notifications rows in id order and
+    publishes those for streaming users. Rows this process published itself
+    are skipped by id. Clients still refetch the list on reconnect, which
+    covers a row whose id committed after a higher one was read.
+    """
+
+    def __init__(self, interval_seconds=RELAY_INTERVAL_SECONDS, chunk_size=RELAY_CHUNK_SIZE):
+        self.interval_seconds = interval_seconds
+        self.chunk_size = chunk_size
+        self._last_id = None
+        self._local_ids = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='notification-relay', daemon=True)
+                self._thread.start()
+
+    def published(self, notification_ids):
+        """Record ids this process has already pushed to its own streams"""
+        with self._lock:
+            if self._last_id is not None:
+                self._local_ids.update(i for i in notification_ids if i > self._last_id)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error relaying notifications: {e}")
+            time.sleep(self.interval_seconds)
+
+    def poll(self):
+        """Publish rows newer than the last one seen; returns how many were pushed"""
+        streaming = notification_hub.streaming_users()
+        if self._last_id is None or not streaming:
+            # Nobody to push to: just move past everything written so far
+            with db_manager.transaction() as cursor:
+                cursor.execute("SELECT COALESCE(MAX(id), 0) as last_id FROM notifications")
+                last_id = cursor.fetchone()['last_id']
+            self._advance(last_id)
+            return 0
+
+        pushed = 0
+        while True:
+            with db_manager.transaction() as cursor:
+                cursor.execute("""
+                    SELECT id, user_id, title, message, type, created_at
+                    FROM notifications
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (self._last_id, self.chunk_size))
+                rows = cursor.fetchall()
+            if not rows:
+                return pushed
+            with self._lock:
+                local_ids = set(self._local_ids)
+            for row in rows:
+                if row['user_id'] in streaming and row['id'] not in local_ids:
+                    notification_hub.publish(row['user_id'], 'notification', {
+                        'id': row['id'],
+                        'title': row['title'],
+                        'message': row['message'],
+                        'type': row['type'],
+                        'created_at': row['created_at'].isoformat() if row['created_at'] else None
+                    })
+                    pushed += 1
+            self._advance(rows[-1]['id'])
+            if len(rows) < self.chunk_size:
+                return pushed
+
+    def _advance(self, last_id):
+        with self._lock:
+            self._last_id = last_id if self._last_id is None else max(self._last_id, last_id)
+            self._local_ids = {i for i in self._local_ids if i > self._last_id}
+
+notification_relay = NotificationRelay()
 
 def create_notification(user_id, title, message, notification_type='info'):
     """Helper function to create a notification"""
-    query = """
-        INSERT INTO notifications (user_id, title, message, type)
-        VALUES (%s, %s, %s, %s)
+    try:
+        with db_manager.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO notifications (user_id, title, message, type)
+                VALUES (%s, %s, %s, %s)
+            """, (user_id, title, message, notification_type))
+            notification_id = cursor.lastrowid
+            cursor.execute("""
+                INSERT INTO notification_counters (user_id, unread_count) VALUES (%s, 1)
+                ON DUPLICATE KEY UPDATE unread_count = unread_count + 1
+            """, (user_id,))
+    except Error as e:
+        print(f"Error creating notification: {e}")
+        return False
+    
+    unread_counts.adjust(user_id, 1)
+    notification_relay.published([notification_id])
+    notification_hub.publish(user_id, 'notification', {
+        'id': notification_id,
+        'title': title,
+        'message': message,
+        'type': notification_type,
+        'created_at': datetime.now().isoformat()
+    })
+    
+    return True
+
+def get_unread_count(user_id):
+    """Unread notification count, from cache or a single primary-key read"""
+    count = unread_counts.get(user_id)
+    if count is not None:
+        return count
+    
+    result = db_manager.execute_query(
+        "SELECT unread_count FROM notification_counters WHERE user_id = %s", (user_id,)
+    )
+    count = result[0]['unread_count'] if result else 0
+    unread_counts.set(user_id, count)
+    return count
+
+def mark_notifications_read(user_id, notification_ids=None, up_to_id=None):
+    """Mark a user's notifications read in one statement and return how many changed.
+
+    Pass notification_ids for a specific list, up_to_id to clear everything up
+    to a cursor, or neither to clear all.
     """
-    return db_manager.execute_query(query, (user_id, title, message, notification_type))
+    query = "UPDATE notifications SET is_read = TRUE WHERE user_id = %s AND is_read = FALSE"
+    params = [user_id]
+    
+    if notification_ids:
+        query += f" AND id IN ({', '.join(['%s'] * len(notification_ids))})"
+        params.extend(notification_ids)
+    elif up_to_id is not None:
+        query += " AND id <= %s"
+        params.append(up_to_id)
+    
+    with db_manager.transaction() as cursor:
+        cursor.execute(query, params)
+        marked = cursor.rowcount
+        if marked:
+            cursor.execute("""
+                UPDATE notification_counters
+                SET unread_count = GREATEST(unread_count - %s, 0)
+                WHERE user_id = %s
+            """, (marked, user_id))
+    
+    unread_counts.adjust(user_id, -marked)
+    return marked
+
+def read_ids_error(notification_ids):
+    """Why a mark-read ids list is unacceptable, or None"""
+    if notification_ids is None:
+        return None
+    if not isinstance(notification_ids, list) or not all(
+            isinstance(i, int) and not isinstance(i, bool) for i in notification_ids):
+        return 'ids must be a list of integers'
+    if len(notification_ids) > MAX_READ_IDS:
+        return f'ids may list at most {MAX_READ_IDS} notifications; use up_to_id for more'
+    return None
+
+def mark_notification_read_by_id(notification_id, user_id):
+    """Mark one of a user's notifications read; returns False if the user has no such notification"""
+    with db_manager.transaction() as cursor:
+        cursor.execute(
+            "SELECT user_id, is_read FROM notifications WHERE id = %s AND user_id = %s FOR UPDATE",
+            (notification_id, user_id)
+        )
+        notification = cursor.fetchone()
+        if not notification:
+            return False
+        if notification['is_read']:
+            return True
+        
+        cursor.execute("UPDATE notifications SET is_read = TRUE WHERE id = %s", (notification_id,))
+        cursor.execute("""
+            UPDATE notification_counters
+            SET unread_count = GREATEST(unread_count - 1, 0)
+            WHERE user_id = %s
+        """, (notification['user_id'],))
+    
+    unread_counts.adjust(notification['user_id'], -1)
+    return True
+
+def rebuild_unread_counters(user_ids=None):
+    """Recompute notification_counters from the notifications table (run before serving).
+
+    With user_ids, only those users are recounted, safely while serving: the
+    count is a locking read, taken in the same order mark-read takes its
+    locks, so a concurrent mark-read lands either before or after it.
+    """
+    if user_ids is not None:
+        user_ids = sorted(set(user_ids))
+        for start in range(0, len(user_ids), JOB_CHUNK_SIZE):
+            chunk = user_ids[start:start + JOB_CHUNK_SIZE]
+            counts = dict.fromkeys(chunk, 0)
+            with db_manager.transaction() as cursor:
+                cursor.execute(f"""
+                    SELECT user_id, COUNT(*) as unread FROM notifications
+                    WHERE user_id IN ({', '.join(['%s'] * len(chunk))}) AND is_read = FALSE
+                    GROUP BY user_id
+                    LOCK IN SHARE MODE
+                """, chunk)
+                counts.update((row['user_id'], row['unread']) for row in cursor.fetchall())
+                cursor.execute(f"""
+                    INSERT INTO notification_counters (user_id, unread_count)
+                    VALUES {', '.join(['(%s, %s)'] * len(counts))}
+                    ON DUPLICATE KEY UPDATE unread_count = VALUES(unread_count)
+                """, [value for item in counts.items() for value in item])
+            for user_id, count in counts.items():
+                unread_counts.set(user_id, count)
+        return len(user_ids)
+
+    db_manager.execute_query("UPDATE notification_counters SET unread_count = 0")
+    return db_manager.execute_query("""
+        INSERT INTO notification_counters (user_id, unread_count)
+        SELECT user_id, COUNT(*) FROM notifications
+        WHERE is_read = FALSE
+        GROUP BY user_id
+        ON DUPLICATE KEY UPDATE unread_count = VALUES(unread_count)
+    """)
+
+def insert_notifications(cursor, notifications):
+    """Multi-row insert of (user_id, title, message, type) tuples inside a caller's transaction.
+
+    Returns the new ids in order; InnoDB gives a single multi-row INSERT
+    consecutive ids starting at lastrowid.
+    """
+    if not notifications:
+        return []
+    
+    cursor.execute(f"""
+        INSERT INTO notifications (user_id, title, message, type)
+        VALUES {', '.join(['(%s, %s, %s, %s)'] * len(notifications))}
+    """, [value for notification in notifications for value in notification])
+    first_id = cursor.lastrowid
+    
+    new_by_user = {}
+    for notification in notifications:
+        new_by_user[notification[0]] = new_by_user.get(notification[0], 0) + 1
+    cursor.execute(f"""
+        INSERT INTO notification_counters (user_id, unread_count)
+        VALUES {', '.join(['(%s, %s)'] * len(new_by_user))}
+        ON DUPLICATE KEY UPDATE unread_count = unread_count + VALUES(unread_count)
+    """, [value for item in new_by_user.items() for value in item])
+    return list(range(first_id, first_id + len(notifications)))
+
+def announce_notifications(notifications, notification_ids):
+    """Update unread caches and push events once inserted notifications are committed"""
+    created_at = datetime.now().isoformat()
+    notification_relay.published(notification_ids)
+    for notification_id, (user_id, title, message, notification_type) in zip(notification_ids, notifications):
+        unread_counts.adjust(user_id, 1)
+        notification_hub.publish(user_id, 'notification', {
+            'id': notification_id,
+            'title': title,
+            'message': message,
+            'type': notification_type,
+            'created_at': created_at
+        })
+
+def create_notifications_bulk(notifications):
+    """Create many notifications with one multi-row insert; returns how many were written"""
+    written = 0
+    for start in range(0, len(notifications), JOB_CHUNK_SIZE):
+        chunk = notifications[start:start + JOB_CHUNK_SIZE]
+        try:
+            with db_manager.transaction() as cursor:
+                notification_ids = insert_notifications(cursor, chunk)
+        except Error as e:
+            print(f"Error creating notifications: {e}")
+            continue
+        announce_notifications(chunk, notification_ids)
+        written += len(chunk)
+    return written
 
 def create_bulk_notifications(user_ids, title, message, notification_type='info'):
     """Helper function to create notifications for multiple users"""
-    for user_id in user_ids:
-        create_notification(user_id, title, message, notification_type)
+    return create_notifications_bulk([
+        (user_id, title, message, notification_type) for user_id in user_ids
+    ])
+
+# Fan-outs that shouldn't hold up the request that triggered them
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='notification-fanout')
+
+def queue_notifications(notifications):
+    """Queue create_notifications_bulk on a background worker and return immediately"""
+    def fan_out():
+        try:
+            return create_notifications_bulk(notifications)
+        except Exception as e:
+            print(f"Error in background notification fan-out: {e}")
+    return _fanout_executor.submit(fan_out)
+
+def create_bulk_notifications_async(user_ids, title, message, notification_type='info'):
+    """create_bulk_notifications without holding up the caller"""
+    return queue_notifications([
+        (user_id, title, message, notification_type) for user_id in user_ids
+    ])
+
+@notifications_bp.route('/stream/<int:user_id>', methods=['GET'])
+def stream_notifications(user_id):
+    """Push new notifications to a user as Server-Sent Events.
+
+    EventSource can't send headers, so the user's token may come as ?token=
+    instead of an Authorization header; either way it must name user_id.
+    """
+    token = request.args.get('token') or bearer_token()
+    claims = verify_token(token) if token else None
+    if not claims or 'user_id' not in claims:
+        return jsonify({'error': 'Authentication required'}), 401
+    if str(claims['user_id']) != str(user_id):
+        return jsonify({'error': 'user_id does not match the authenticated user'}), 403
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    notification_relay.start()
+    subscription = notification_hub.subscribe(user_id, last_event_id)
+    if subscription is None:
+        return jsonify({'error': 'Too many open streams, try again later'}), 503, {
+            'Retry-After': str(STREAM_RETRY_MS // 1000)
+        }
+    
+    def generate():
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            
+            while time.monotonic() < deadline:
+                events = subscription.wait(STREAM_HEARTBEAT_SECONDS)
+                if subscription.closed:
+                    break
+                if not events:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": heartbeat\n\n"
+                    continue
+                for event in events:
+                    yield format_sse(event)
+        finally:
+            notification_hub.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@notifications_bp.route('/stream/stats', methods=['GET'])
+@admin_required
+def stream_stats():
+    """Open stream counts for monitoring"""
+    return jsonify(notification_hub.stats())
+
+@notifications_bp.route('/unread-count/<int:user_id>', methods=['GET'])
+def unread_count(user_id):
+    """Unread notification count for the UI badge"""
+    user_id, auth_error = request_user_id(user_id)
+    if auth_error:
+        return jsonify({'error': auth_error}), 403
+    return jsonify({'user_id': user_id, 'unread_count': get_unread_count(user_id)})
+
+@notifications_bp.route('/read', methods=['PUT'])
+def mark_read_batch():
+    """Mark a list of notifications, or everything up to a cursor, as read"""
+    data = request.get_json() or {}
+    notification_ids = data.get('ids')
+    up_to_id = data.get('up_to_id')
+    
+    if not data.get('user_id'):
+        return jsonify({'error': 'user_id is required'}), 400
+    user_id, auth_error = request_user_id(data['user_id'])
+    if auth_error:
+        return jsonify({'error': auth_error}), 403
+    if not notification_ids and up_to_id is None:
+        return jsonify({'error': 'ids or up_to_id is required'}), 400
+    ids_error = read_ids_error(notification_ids)
+    if ids_error:
+        return jsonify({'error': ids_error}), 400
+    
+    marked = mark_notifications_read(user_id, notification_ids, up_to_id)
+    
+    return jsonify({
+        'message': f'{marked} notifications marked as read',
+        'marked_read': marked,
+        'unread_count': get_unread_count(user_id)
+    })
 
 @notifications_bp.route('/send', methods=['POST'])
 def send_notification():
@@ -101,33 +540,42 @@ def broadcast_notification():
         'active_only': active_only
     })
 
-@notifications_bp.route('/schedule-reminders', methods=['POST'])
-def schedule_disposal_reminders():
-    """Send disposal reminders to inactive users"""
+def run_disposal_reminders():
+    """Send disposal reminders to inactive users, walking users in id order"""
     
     # Find users who haven't disposed anything in the last week
     inactive_users_query = """
-        SELECT u.id, u.username, u.last_activity
+        SELECT u.id
         FROM users u
         LEFT JOIN waste_scans ws ON u.id = ws.user_id 
         AND ws.scan_date >= DATE_SUB(NOW(), INTERVAL 7 DAY)
         WHERE ws.id IS NULL 
         AND u.last_activity >= DATE_SUB(NOW(), INTERVAL 30 DAY)
         AND u.total_points > 0
+        AND u.id > %s
+        ORDER BY u.id
+        LIMIT %s
     """
     
-    inactive_users = db_manager.execute_query(inactive_users_query)
-    
-    if not inactive_users:
-        return jsonify({'message': 'No inactive users found', 'reminders_sent': 0})
-    
     reminder_title = "🌱 Time to Go Green Again!"
     reminder_message = "Hi there! We miss seeing your eco-friendly contributions. There are smart bins nearby waiting for your next disposal. Every action counts towards a cleaner environment!"
     
     success_count = 0
-    for user in inactive_users:
-        if create_notification(user['id'], reminder_title, reminder_message, 'reminder'):
-            success_count += 1
+    for inactive_users in db_manager.iter_keyset_chunks(inactive_users_query, chunk_size=JOB_CHUNK_SIZE):
+        check_job()
+        for user in inactive_users:
+            if create_notification(user['id'], reminder_title, reminder_message, 'reminder'):
+                success_count += 1
+    
+    return success_count
+
+@notifications_bp.route('/schedule-reminders', methods=['POST'])
+def schedule_disposal_reminders():
+    """Send disposal reminders to inactive users"""
+    success_count = run_disposal_reminders()
+    
+    if not success_count:
+        return jsonify({'message': 'No inactive users found', 'reminders_sent': 0})
     
     return jsonify({
         'message': f'Disposal reminders sent to {success_count} inactive users',
@@ -136,49 +584,99 @@ def schedule_disposal_reminders():
 
 @notifications_bp.route('/milestone-check', methods=['POST'])
 def check_and_notify_milestones():
-    """Check for users who reached milestones and notify them"""
-    
-    # Define milestones
-    milestones = [
-        {'points': 50, 'title': '🌿 Eco Starter', 'message': 'Congratulations! You\'ve earned your first 50 points. Keep up the great work!'},
-        {'points': 100, 'title': '♻️ Eco Beginner', 'message': 'Amazing! You\'ve reached 100 points. You\'re making a real difference!'},
-        {'points': 250, 'title': '🌱 Eco Enthusiast', 'message': 'Fantastic! 250 points earned. Your dedication to the environment is inspiring!'},
-        {'points': 500, 'title': '🏆 Eco Warrior', 'message': 'Outstanding! 500 points achieved. You\'re a true environmental champion!'},
-        {'points': 1000, 'title': '👑 Eco Champion', 'message': 'Incredible! 1000 points reached. You\'re leading by example in environmental conservation!'},
-        {'points': 2000, 'title': '🌍 Eco Legend', 'message': 'Legendary! 2000 points - your impact on the environment is remarkable!'}
-    ]
+    """Backfill achievements for users who reached milestones before the engine existed"""
+    # Imported here because achievements notifies through this module
+    from achievements import backfill_achievements
     
+    users_awarded = backfill_achievements()
+    
+    return jsonify({
+        'message': f'Milestone notifications sent to {users_awarded} users',
+        'notifications_sent': users_awarded
+    })
+
+def run_full_bin_alerts(dedupe_hours=BIN_ALERT_DEDUPE_HOURS):
+    """Send each recently active user one digest of the full bins in their region.
+
+    Full bins come from the bin registry; one query finds the active users in
+    their regions and one more the pairs already alerted within the dedupe
+    window, so the work scales with affected users rather than bins x users.
+    """
+    now = datetime.now()
+    full_bins = {}
+    for record in bin_registry.all():
+        if record.is_active and record.capacity_level in ('High', 'Full') and record.region:
+            full_bins.setdefault(record.region, []).append(record)
+    
+    if not full_bins:
+        return {'notifications_sent': 0, 'bins_alerted': 0, 'users_notified': 0}
+    
+    regions = list(full_bins)
+    users = db_manager.execute_query(f"""
+        SELECT id, region FROM users
+        WHERE region IN ({', '.join(['%s'] * len(regions))})
+        AND last_activity >= %s
+        ORDER BY id
+    """, regions + [now - timedelta(days=7)])
+    
+    bin_ids = [record.id for records in full_bins.values() for record in records]
+    recently_alerted = db_manager.execute_query(f"""
+        SELECT user_id, bin_id FROM bin_alert_log
+        WHERE bin_id IN ({', '.join(['%s'] * len(bin_ids))})
+        AND sent_at >= %s
+    """, bin_ids + [now - timedelta(hours=dedupe_hours)])
+    already_sent = {(row['user_id'], row['bin_id']) for row in recently_alerted or []}
+    
+    bins_by_user = {}
+    for user in users or []:
+        pending = [
+            {'bin_id': record.id, 'location_name': record.location_name}
+            for record in full_bins[user['region']]
+            if (user['id'], record.id) not in already_sent
+        ]
+        if pending:
+            bins_by_user[user['id']] = pending
+    
+    user_ids = list(bins_by_user)
     notifications_sent = 0
     
-    for milestone in milestones:
-        # Find users who recently crossed this milestone (in last 24 hours)
-        query = """
-            SELECT u.id, u.username, u.total_points
-            FROM users u
-            WHERE u.total_points >= %s
-            AND u.total_points < %s + 100
-            AND NOT EXISTS (
-                SELECT 1 FROM notifications n 
-                WHERE n.user_id = u.id 
-                AND n.title = %s 
-                AND n.created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-            )
-        """
+    for start in range(0, len(user_ids), JOB_CHUNK_SIZE):
+        check_job()
+        chunk = user_ids[start:start + JOB_CHUNK_SIZE]
+        digests = [(user_id, "⚠️ Bin Alert", bin_digest_message(bins_by_user[user_id]), 'alert') for user_id in chunk]
+        alerted = [(user_id, pair['bin_id'], now) for user_id in chunk for pair in bins_by_user[user_id]]
         
-        eligible_users = db_manager.execute_query(query, (
-            milestone['points'], 
-            milestone['points'], 
-            milestone['title']
-        ))
+        try:
+            with db_manager.transaction() as cursor:
+                notification_ids = insert_notifications(cursor, digests)
+                cursor.execute(f"""
+                    INSERT INTO bin_alert_log (user_id, bin_id, sent_at)
+                    VALUES {', '.join(['(%s, %s, %s)'] * len(alerted))}
+                    ON DUPLICATE KEY UPDATE sent_at = VALUES(sent_at)
+                """, [value for row in alerted for value in row])
+        except Error as e:
+            print(f"Error sending bin alert digests: {e}")
+            continue
         
-        for user in eligible_users or []:
-            if create_notification(user['id'], milestone['title'], milestone['message'], 'milestone'):
-                notifications_sent += 1
+        announce_notifications(digests, notification_ids)
+        notifications_sent += len(digests)
     
-    return jsonify({
-        'message': f'Milestone notifications sent to {notifications_sent} users',
-        'notifications_sent': notifications_sent
-    })
+    return {
+        'notifications_sent': notifications_sent,
+        'bins_alerted': len({pair['bin_id'] for pairs in bins_by_user.values() for pair in pairs}),
+        'users_notified': notifications_sent
+    }
+
+def bin_digest_message(bins):
+    """One message covering every full bin a user should avoid"""
+    if len(bins) == 1:
+        return f"The bin at {bins[0]['location_name']} is nearly full. Consider using alternative bins nearby."
+    
+    names = [b['location_name'] for b in bins[:5]]
+    message = f"{len(bins)} bins in your area are nearly full: " + ", ".join(names)
+    if len(bins) > 5:
+        message += f" and {len(bins) - 5} more"
+    return message + ". Consider using alternative bins nearby."
 
 @notifications_bp.route('/bin-alerts', methods=['POST'])
 def send_bin_alerts():
@@ -187,35 +685,11 @@ def send_bin_alerts():
     alert_type = request.json.get('type', 'full_bins')  # full_bins, maintenance
     
     if alert_type == 'full_bins':
-        # Notify users about full bins in their region
-        full_bins_query = """
-            SELECT DISTINCT b.region, b.location_name, b.id
-            FROM bins b
-            WHERE b.capacity_level IN ('High', 'Full')
-            AND b.is_active = TRUE
-        """
-        
-        full_bins = db_manager.execute_query(full_bins_query)
-        notifications_sent = 0
-        
-        for bin_info in full_bins or []:
-            # Get users in this region
-            users_in_region = db_manager.execute_query(
-                "SELECT id FROM users WHERE region = %s AND last_activity >= DATE_SUB(NOW(), INTERVAL 7 DAY)",
-                (bin_info['region'],)
-            )
-            
-            alert_title = "⚠️ Bin Alert"
-            alert_message = f"The bin at {bin_info['location_name']} is nearly full. Consider using alternative bins nearby."
-            
-            for user in users_in_region or []:
-                if create_notification(user['id'], alert_title, alert_message, 'alert'):
-                    notifications_sent += 1
+        result = run_full_bin_alerts()
         
         return jsonify({
             'message': f'Full bin alerts sent',
-            'notifications_sent': notifications_sent,
-            'bins_alerted': len(full_bins) if full_bins else 0
+            **result
         })
     
     return jsonify({'error': 'Invalid alert type'}), 400
@@ -233,26 +707,16 @@ def notify_nearby_bins():
     if not all([user_lat, user_lng, user_id]):
         return jsonify({'error': 'latitude, longitude, and user_id are required'}), 400
     
-    # Find nearby bins using simple distance calculation
-    # Note: For production, consider using proper geospatial queries
-    nearby_bins_query = """
-        SELECT location_name, bin_type, capacity_level,
-               ROUND(
-                   6371 * acos(
-                       cos(radians(%s)) * cos(radians(latitude)) * 
-                       cos(radians(longitude) - radians(%s)) + 
-                       sin(radians(%s)) * sin(radians(latitude))
-                   ), 2
-               ) AS distance_km
-        FROM bins 
-        WHERE is_active = TRUE
-        AND capacity_level NOT IN ('Full')
-        HAVING distance_km <= %s
-        ORDER BY distance_km
-        LIMIT 5
-    """
-    
-    nearby_bins = db_manager.execute_query(nearby_bins_query, (user_lat, user_lng, user_lat, radius_km))
+    # Find nearby bins in the registry using simple distance calculation
+    nearby_bins = [
+        {
+            'location_name': record.location_name,
+            'bin_type': record.bin_type,
+            'capacity_level': record.capacity_level,
+            'distance_km': distance_km
+        }
+        for record, distance_km in bin_registry.nearby(user_lat, user_lng, radius_km)
+    ]
     
     if not nearby_bins:
         return jsonify({'message': 'No nearby bins found', 'notification_sent': False})
@@ -277,83 +741,143 @@ def notify_nearby_bins():
         'bins': nearby_bins
     })
 
-@notifications_bp.route('/reward-alerts', methods=['POST'])
-def send_reward_alerts():
-    """Notify users when they have enough points for rewards"""
-    
-    # Get users who have enough points for available rewards but haven't redeemed recently
-    query = """
-        SELECT DISTINCT u.id, u.username, u.total_points,
-               r.name as reward_name, r.points_required
-        FROM users u
-        CROSS JOIN rewards r
-        WHERE u.total_points >= r.points_required
-        AND r.is_active = TRUE
-        AND NOT EXISTS (
-            SELECT 1 FROM reward_redemptions rr 
-            WHERE rr.user_id = u.id 
-            AND rr.reward_id = r.id 
-            AND rr.redemption_date >= DATE_SUB(NOW(), INTERVAL 30 DAY)
-        )
-        AND NOT EXISTS (
-            SELECT 1 FROM notifications n
-            WHERE n.user_id = u.id
-            AND n.type = 'reward'
-            AND n.created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-        )
-        ORDER BY u.total_points DESC, r.points_required ASC
+def run_reward_alerts():
+    """Notify users whose points recently unlocked new rewards.
+
+    Works through reward_eligibility_changes, which every node writes in the
+    transaction that credits the points, in id order up to the newest row at
+    the start. Each chunk's rows are deleted once its alerts are sent; users
+    still in their weekly cooldown get a fresh row and are checked next run.
     """
+    with db_manager.transaction() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) as last_id FROM reward_eligibility_changes")
+        last_id = cursor.fetchone()['last_id']
     
-    eligible_rewards = db_manager.execute_query(query)
     notifications_sent = 0
-    
-    # Group by user to avoid spam
-    user_rewards = {}
-    for item in eligible_rewards or []:
-        user_id = item['id']
-        if user_id not in user_rewards:
-            user_rewards[user_id] = {
-                'username': item['username'],
-                'total_points': item['total_points'],
-                'rewards': []
-            }
-        user_rewards[user_id]['rewards'].append({
-            'name': item['reward_name'],
-            'points': item['points_required']
-        })
-    
-    # Send one notification per user with their available rewards
-    for user_id, user_info in user_rewards.items():
-        rewards_list = user_info['rewards'][:3]  # Limit to top 3 rewards
+    eligible_users = 0
+    handled = set()
+    after_id = 0
+    
+    while after_id < last_id:
+        check_job()
+        with db_manager.transaction() as cursor:
+            cursor.execute("""
+                SELECT id, user_id FROM reward_eligibility_changes
+                WHERE id > %s AND id <= %s
+                ORDER BY id
+                LIMIT %s
+            """, (after_id, last_id, JOB_CHUNK_SIZE))
+            rows = cursor.fetchall()
+        if not rows:
+            break
+        
+        # A user queued twice this run is only alerted, or deferred, once
+        chunk = list(dict.fromkeys(row['user_id'] for row in rows if row['user_id'] not in handled))
+        handled.update(chunk)
+        deferred = []
         
-        reward_title = "🎁 Rewards Available!"
-        reward_message = f"Great news! You have {user_info['total_points']} points and can redeem:\\n"
-        reward_message += "\\n".join([f"• {r['name']} ({r['points']} pts)" for r in rewards_list])
+        if chunk:
+            placeholders = ', '.join(['%s'] * len(chunk))
+            with db_manager.transaction() as cursor:
+                # Skip rewards redeemed in the last 30 days
+                cursor.execute(f"""
+                    SELECT user_id, reward_id FROM reward_redemptions
+                    WHERE user_id IN ({placeholders})
+                    AND redemption_date >= DATE_SUB(NOW(), INTERVAL 30 DAY)
+                """, chunk)
+                redeemed = {(row['user_id'], row['reward_id']) for row in cursor.fetchall()}
+                
+                # Don't send more than one reward alert a week
+                cursor.execute(f"""
+                    SELECT DISTINCT user_id FROM notifications
+                    WHERE user_id IN ({placeholders})
+                    AND type = 'reward'
+                    AND created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)
+                """, chunk)
+                alerted = {row['user_id'] for row in cursor.fetchall()}
         
-        if len(user_info['rewards']) > 3:
-            reward_message += f"\\n...and {len(user_info['rewards']) - 3} more rewards!"
+        for user_id in chunk:
+            total_points, rewards = reward_index.affordable(user_id)
+            rewards = [r for r in rewards if (user_id, r['id']) not in redeemed]
+            if not rewards:
+                continue
+            if user_id in alerted:
+                deferred.append(user_id)
+                continue
+            
+            eligible_users += 1
+            rewards_list = rewards[:3]  # Limit to top 3 rewards
+            
+            reward_title = "🎁 Rewards Available!"
+            reward_message = f"Great news! You have {total_points} points and can redeem:\\n"
+            reward_message += "\\n".join([f"• {r['name']} ({r['points_required']} pts)" for r in rewards_list])
+            
+            if len(rewards) > 3:
+                reward_message += f"\\n...and {len(rewards) - 3} more rewards!"
+            
+            if create_notification(user_id, reward_title, reward_message, 'reward'):
+                notifications_sent += 1
         
-        if create_notification(user_id, reward_title, reward_message, 'reward'):
-            notifications_sent += 1
+        with db_manager.transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM reward_eligibility_changes WHERE id > %s AND id <= %s",
+                (after_id, rows[-1]['id'])
+            )
+            if deferred:
+                cursor.execute(f"""
+                    INSERT INTO reward_eligibility_changes (user_id)
+                    VALUES {', '.join(['(%s)'] * len(deferred))}
+                """, deferred)
+        after_id = rows[-1]['id']
+    
+    return {
+        'notifications_sent': notifications_sent,
+        'eligible_users': eligible_users
+    }
+
+@notifications_bp.route('/reward-alerts', methods=['POST'])
+def send_reward_alerts():
+    """Notify users whose points recently unlocked new rewards"""
+    result = run_reward_alerts()
     
     return jsonify({
-        'message': f'Reward alerts sent to {notifications_sent} users',
-        'notifications_sent': notifications_sent,
-        'eligible_users': len(user_rewards)
+        'message': f"Reward alerts sent to {result['notifications_sent']} users",
+        **result
     })
 
-# Auto-notification scheduler functions (would be called by a cron job or scheduler)
+@notifications_bp.route('/retention/run', methods=['POST'])
+@admin_required
+def run_notification_retention():
+    """Expire old notifications now and report what was reclaimed"""
+    # Imported here because retention adjusts this module's unread counters
+    from retention import run_retention
+    
+    return jsonify(run_retention())
+
+@notifications_bp.route('/retention/partition', methods=['POST'])
+@admin_required
+def partition_notifications():
+    """One-off switch of the notifications table to monthly partitions"""
+    from retention import enable_partitioning
+    
+    if not enable_partitioning():
+        return jsonify({'message': 'Notifications table is already partitioned'})
+    return jsonify({'message': 'Notifications table partitioned by month'})
+
+# Scheduled jobs, registered with the scheduler in app.py
 def auto_send_daily_reminders():
     """Function to be called daily by scheduler"""
-    # Send disposal reminders
-    schedule_disposal_reminders()
-    
-    # Check milestones
-    check_and_notify_milestones()
-    
-    # Send reward alerts
-    send_reward_alerts()
+    # Milestones are awarded at write time by the achievements engine
+    return {
+        'reminders_sent': run_disposal_reminders(),
+        'reward_alerts': run_reward_alerts()
+    }
 
 def auto_send_bin_alerts():
     """Function to be called periodically to check bin status"""
-    send_bin_alerts()
+    return run_full_bin_alerts()
+
+def auto_run_retention():
+    """Function to be called nightly to expire old notifications"""
+    from retention import run_retention
+    return run_retention()
@@ -0,0 +1,161 @@
+"""
+Password Hashing for Bin Smart
+Runs the deliberately slow password KDF in a bounded process pool so login
+spikes don't hold the GIL and stall every other request on the worker
+"""
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+import multiprocessing
+import os
+import threading
+
+# werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', 16))
+# 0 hashes inline on the request thread (the old behaviour)
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+# Jobs queued or running before new ones are turned away
+HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', HASH_WORKERS * 8 or 1))
+HASH_TIMEOUT_SECONDS = float(os.getenv('PASSWORD_HASH_TIMEOUT_SECONDS', 5))
+
+
+class HashingUnavailable(Exception):
+    """The hashing pool is saturated or a job took too long; callers should answer 503"""
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+def _noop():
+    return True
+
+
+class PasswordHasher:
+    """Hash and verify passwords on a process pool with a pending-job limit and a timeout.
+
+    A semaphore slot is taken per submitted job and only given back when the
+    worker process finishes it, so jobs abandoned after a timeout still count
+    against the limit until they really stop using CPU. A pool broken by a
+    killed worker is shut down and replaced on the next job.
+    """
+
+    def __init__(self, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH,
+                 workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING, timeout=HASH_TIMEOUT_SECONDS):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._canonical_method = None
+
+    def start(self):
+        """Create the pool and its workers now, before the app starts other threads"""
+        if self.workers <= 0:
+            return
+        with self._executor_lock:
+            if self._executor is None:
+                # Fork starts every worker up front on the first submit, so warming
+                # up here keeps later forks away from a process full of threads
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._executor.submit(_noop).result()
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _discard(self, executor):
+        """Shut down a broken pool so the next job starts a fresh one"""
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        if executor is not None:
+            print("Password hashing pool broke; starting a new one")
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, func, *args):
+        """Queue a job on the pool, or raise HashingUnavailable if too many are pending or it broke"""
+        if not self._slots.acquire(blocking=False):
+            raise HashingUnavailable('Password hashing is busy')
+        executor = None
+        try:
+            for attempt in range(2):
+                try:
+                    self.start()
+                    executor = self._executor
+                    future = executor.submit(func, *args)
+                    break
+                except BrokenProcessPool:
+                    self._discard(executor)
+                    if attempt:
+                        raise HashingUnavailable('Password hashing is unavailable')
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        future.executor = executor
+        return future
+
+    def _run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        future = self.submit(func, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashingUnavailable('Password hashing timed out')
+        except BrokenProcessPool:
+            self._discard(future.executor)
+            raise HashingUnavailable('Password hashing is unavailable')
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        return self._run(_verify, password_hash, password)
+
+    def canonical_method(self):
+        """The configured method with werkzeug's defaults filled in, as it appears in stored hashes"""
+        if self._canonical_method is None:
+            self._canonical_method = _hash('', self.method, 1).split('$', 1)[0]
+        return self._canonical_method
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with different KDF parameters than the current ones"""
+        return bool(password_hash) and password_hash.split('$', 1)[0] != self.canonical_method()
+
+    def rehash_async(self, password, on_done):
+        """Hash password in the background and pass the result to on_done; skipped when busy"""
+        if self.workers <= 0:
+            on_done(self.hash(password))
+            return True
+        try:
+            future = self.submit(_hash, password, self.method, self.salt_length)
+        except HashingUnavailable:
+            return False
+
+        def callback(done):
+            if done.cancelled():
+                return
+            error = done.exception()
+            if error is None:
+                on_done(done.result())
+            elif isinstance(error, BrokenProcessPool):
+                self._discard(future.executor)
+        future.add_done_callback(callback)
+        return True
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Points Ledger for Bin Smart
+Every points change is appended to points_ledger. With POINTS_SHARDS set,
+credits land on one of N counter rows per user instead of the users row and
+are folded into users.total_points periodically, so a busy user's writes
+don't queue on one row lock.
+
+Audit balances against the ledger from the backend directory:
+
+    python points_ledger.py audit [--user-id N] [--fix]
+"""
+
+from database import DatabaseManager
+from data_versions import bump_version
+from scheduler import check_job
+import argparse
+import os
+import random
+
+db_manager = DatabaseManager()
+
+# 0 writes straight to users.total_points; N spreads credits over N counter rows
+POINTS_SHARDS = int(os.getenv('POINTS_SHARDS', 0))
+FOLD_CHUNK_SIZE = 500
+AUDIT_CHUNK_SIZE = 1000
+# data_versions row and lock name for the one-time opening balance migration
+OPENING_BALANCES_MARKER = 'points_opening_balances'
+OPENING_LOCK_TIMEOUT_SECONDS = 60
+
+
+def balance_sql(alias='u'):
+    """SQL expression for a user's spendable balance, for a users table aliased alias"""
+    if not POINTS_SHARDS:
+        return f"{alias}.total_points"
+    return (f"({alias}.total_points + COALESCE("
+            f"(SELECT SUM(s.points) FROM points_shards s WHERE s.user_id = {alias}.id), 0))")
+
+
+def record_entries(cursor, entries, reason, reference_id=None):
+    """Append (user_id, delta) pairs to the ledger with one multi-row INSERT"""
+    entries = [(user_id, delta) for user_id, delta in entries if delta]
+    if not entries:
+        return
+    params = []
+    for user_id, delta in entries:
+        params.extend((user_id, delta, reason, reference_id))
+    cursor.execute(f"""
+        INSERT INTO points_ledger (user_id, delta, reason, reference_id)
+        VALUES {', '.join(['(%s, %s, %s, %s)'] * len(entries))}
+    """, params)
+
+
+def credit(cursor, points_by_user, reason):
+    """Add points for several users inside the caller's transaction; returns new balances.
+
+    Without shards this is one UPDATE per user in id order. With shards each
+    user's credit goes to a random counter row, which concurrent writers for
+    the same user rarely share.
+    """
+    record_entries(cursor, sorted(points_by_user.items()), reason)
+
+    totals = {}
+    if not POINTS_SHARDS:
+        for user_id in sorted(points_by_user):
+            # LAST_INSERT_ID(expr) hands the new total back without another SELECT
+            cursor.execute("""
+                UPDATE users SET total_points = LAST_INSERT_ID(total_points + %s) WHERE id = %s
+            """, (points_by_user[user_id], user_id))
+            totals[user_id] = cursor.lastrowid
+        return totals
+
+    for user_id in sorted(points_by_user):
+        cursor.execute("""
+            INSERT INTO points_shards (user_id, shard, points) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE points = points + VALUES(points)
+        """, (user_id, random.randrange(POINTS_SHARDS), points_by_user[user_id]))
+    return balances(cursor, points_by_user)
+
+
+def balances(cursor, user_ids):
+    """Current balances of several users, read through the caller's cursor"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    cursor.execute(f"""
+        SELECT u.id, {balance_sql('u')} as balance FROM users u
+        WHERE u.id IN ({', '.join(['%s'] * len(user_ids))})
+    """, user_ids)
+    return {row['id']: int(row['balance']) for row in cursor.fetchall()}
+
+
+def get_balance(user_id):
+    """A user's balance, None if the user doesn't exist"""
+    result = db_manager.execute_query(
+        f"SELECT {balance_sql('u')} as balance FROM users u WHERE u.id = %s", (user_id,)
+    )
+    return int(result[0]['balance']) if result else None
+
+
+def fold_user(cursor, user_id):
+    """Move a user's shard counters into users.total_points, holding their locks until commit"""
+    if not POINTS_SHARDS:
+        return
+    cursor.execute("SELECT COALESCE(SUM(points), 0) as points FROM points_shards WHERE user_id = %s FOR UPDATE", (user_id,))
+    points = int(cursor.fetchone()['points'])
+    if points:
+        cursor.execute("UPDATE users SET total_points = total_points + %s WHERE id = %s", (points, user_id))
+        cursor.execute("UPDATE points_shards SET points = 0 WHERE user_id = %s", (user_id,))
+
+
+def fold_all_shards(chunk_size=FOLD_CHUNK_SIZE):
+    """Fold every user's pending shard counters, one short transaction per user"""
+    folded = 0
+    for rows in db_manager.iter_keyset_chunks(
+        "SELECT DISTINCT user_id FROM points_shards WHERE points != 0 AND user_id > %s ORDER BY user_id LIMIT %s",
+        (), chunk_size, key='user_id'
+    ):
+        check_job()
+        for row in rows:
+            with db_manager.transaction() as cursor:
+                fold_user(cursor, row['user_id'])
+            folded += 1
+    return {'users_folded': folded}
+
+
+def record_opening_balances():
+    """Give users without ledger history an 'opening' entry for the balance they already have.
+
+    Runs once per database: nodes starting together queue on a named lock,
+    and the first one records a data_versions marker in the same transaction
+    as the entries, so the rest find it and skip. Returns the entries added.
+    """
+    connection = db_manager.create_connection()
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s) as acquired", (OPENING_BALANCES_MARKER, OPENING_LOCK_TIMEOUT_SECONDS))
+        if cursor.fetchone()['acquired'] != 1:
+            print("Skipped opening balances: another node is still recording them")
+            return 0
+        try:
+            cursor.execute("SELECT version FROM data_versions WHERE name = %s", (OPENING_BALANCES_MARKER,))
+            marker = cursor.fetchone()
+            if marker and marker['version']:
+                return 0
+            cursor.execute("""
+                INSERT INTO points_ledger (user_id, delta, reason)
+                SELECT u.id, u.total_points, 'opening' FROM users u
+                WHERE u.total_points != 0
+                AND NOT EXISTS (SELECT 1 FROM points_ledger l WHERE l.user_id = u.id)
+            """)
+            added = cursor.rowcount
+            bump_version(OPENING_BALANCES_MARKER, cursor)
+            connection.commit()
+            return added
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (OPENING_BALANCES_MARKER,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def audit(user_id=None, fix=False, chunk_size=AUDIT_CHUNK_SIZE):
+    """Compare balances with the sum of each user's ledger entries.
+
+    With fix, users.total_points is set so the balance equals the ledger sum.
+    Returns the users checked and the mismatches found.
+    """
+    filters = "AND u.id = %s " if user_id is not None else ""
+    params = (user_id,) if user_id is not None else ()
+    checked = 0
+    mismatches = []
+
+    for rows in db_manager.iter_keyset_chunks(f"""
+        SELECT u.id, u.total_points, {balance_sql('u')} as balance,
+               COALESCE((SELECT SUM(l.delta) FROM points_ledger l WHERE l.user_id = u.id), 0) as ledger_total
+        FROM users u
+        WHERE 1 = 1 {filters}AND u.id > %s ORDER BY u.id LIMIT %s
+    """, params, chunk_size):
+        checked += len(rows)
+        for row in rows:
+            if int(row['balance']) != int(row['ledger_total']):
+                mismatches.append({
+                    'user_id': row['id'],
+                    'balance': int(row['balance']),
+                    'ledger_total': int(row['ledger_total'])
+                })
+
+    if fix:
+        for mismatch in mismatches:
+            with db_manager.transaction() as cursor:
+                fold_user(cursor, mismatch['user_id'])
+                cursor.execute("""
+                    UPDATE users SET total_points = (
+                        SELECT COALESCE(SUM(delta), 0) FROM points_ledger WHERE user_id = %s
+                    ) WHERE id = %s
+                """, (mismatch['user_id'], mismatch['user_id']))
+
+    return {'users_checked': checked, 'mismatches': mismatches, 'fixed': fix}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bin Smart points ledger tools')
+    parser.add_argument('command', choices=['audit', 'fold'])
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--fix', action='store_true', help='audit: reset mismatched balances to the ledger sum')
+    args = parser.parse_args()
+
+    if args.command == 'fold':
+        print(fold_all_shards())
+        return
+
+    result = audit(args.user_id, args.fix)
+    for mismatch in result['mismatches']:
+        print(f"user {mismatch['user_id']}: balance {mismatch['balance']}, ledger {mismatch['ledger_total']}")
+    print(f"Checked {result['users_checked']} users, {len(result['mismatches'])} mismatched"
+          + (", fixed" if args.fix and result['mismatches'] else ""))
+
+
+if __name__ == '__main__':
+    main()
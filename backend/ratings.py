@@ -0,0 +1,74 @@
+"""
+Bin Ratings for Bin Smart
+Stores user ratings and keeps a per-bin aggregate (count, sum, histogram)
+up to date, so rating reads cost one row per bin
+"""
+
+from database import DatabaseManager
+
+db_manager = DatabaseManager()
+
+RATING_VALUES = range(1, 6)
+HISTOGRAM_COLUMNS = [f"rating_{value}" for value in RATING_VALUES]
+
+
+def record_rating(user_id, bin_id, rating, comment=''):
+    """Insert or replace a user's rating of a bin and apply the change to the bin's aggregate"""
+    with db_manager.transaction() as cursor:
+        apply_rating(cursor, user_id, bin_id, rating, comment)
+    return True
+
+
+def apply_rating(cursor, user_id, bin_id, rating, comment=''):
+    """record_rating inside a caller's transaction"""
+    cursor.execute(
+        "SELECT rating FROM bin_ratings WHERE user_id = %s AND bin_id = %s FOR UPDATE",
+        (user_id, bin_id)
+    )
+    previous = cursor.fetchone()
+    old_rating = previous['rating'] if previous else None
+
+    cursor.execute("""
+        INSERT INTO bin_ratings (user_id, bin_id, rating, comment)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE rating = VALUES(rating), comment = VALUES(comment), created_at = NOW()
+    """, (user_id, bin_id, rating, comment))
+
+    # Deltas: a new rating adds one vote, a changed rating moves a vote between buckets
+    histogram = [(value == rating) - (value == old_rating) for value in RATING_VALUES]
+    cursor.execute(f"""
+        INSERT INTO bin_rating_stats (bin_id, rating_count, rating_sum, {', '.join(HISTOGRAM_COLUMNS)})
+        VALUES (%s, %s, %s, {', '.join(['%s'] * len(HISTOGRAM_COLUMNS))})
+        ON DUPLICATE KEY UPDATE
+            rating_count = rating_count + VALUES(rating_count),
+            rating_sum = rating_sum + VALUES(rating_sum),
+            {', '.join(f"{column} = {column} + VALUES({column})" for column in HISTOGRAM_COLUMNS)}
+    """, [bin_id, 0 if previous else 1, rating - (old_rating or 0)] + histogram)
+
+
+def get_rating_stats(bin_id):
+    """Average, count and histogram of a bin's ratings"""
+    result = db_manager.execute_query(
+        f"SELECT rating_count, rating_sum, {', '.join(HISTOGRAM_COLUMNS)} FROM bin_rating_stats WHERE bin_id = %s",
+        (bin_id,)
+    )
+    stats = result[0] if result else {}
+    count = stats.get('rating_count') or 0
+    return {
+        'average_rating': round(stats['rating_sum'] / count, 2) if count else 0,
+        'total_ratings': count,
+        'histogram': {str(value): stats.get(f"rating_{value}") or 0 for value in RATING_VALUES}
+    }
+
+
+def rebuild_rating_stats():
+    """Recompute every bin's aggregate from bin_ratings (startup or repair)"""
+    histogram = ', '.join(f"SUM(rating = {value})" for value in RATING_VALUES)
+    with db_manager.transaction() as cursor:
+        cursor.execute("DELETE FROM bin_rating_stats")
+        cursor.execute(f"""
+            INSERT INTO bin_rating_stats (bin_id, rating_count, rating_sum, {', '.join(HISTOGRAM_COLUMNS)})
+            SELECT bin_id, COUNT(*), SUM(rating), {histogram}
+            FROM bin_ratings
+            GROUP BY bin_id
+        """)
@@ -0,0 +1,105 @@
+"""
+Reward Redemptions for Bin Smart
+Redeems rewards in one transaction around a conditional balance update, with
+Idempotency-Key support so client retries never redeem twice
+"""
+
+from database import DatabaseManager
+from points_ledger import fold_user, record_entries
+from mysql.connector import errorcode, IntegrityError
+
+db_manager = DatabaseManager()
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+
+
+class RedemptionError(Exception):
+    """A redemption that could not go ahead; status is the reason"""
+
+    def __init__(self, status, balance=None):
+        super().__init__(status)
+        self.status = status
+        self.balance = balance
+
+
+def _find_by_key(cursor, user_id, idempotency_key):
+    cursor.execute("""
+        SELECT id, reward_id, points_used, balance_after
+        FROM reward_redemptions
+        WHERE user_id = %s AND idempotency_key = %s
+    """, (user_id, idempotency_key))
+    return cursor.fetchone()
+
+
+def _result(redemption, replayed):
+    return {
+        'redemption_id': redemption['id'],
+        'reward_id': redemption['reward_id'],
+        'points_used': redemption['points_used'],
+        'remaining_points': redemption['balance_after'],
+        'replayed': replayed
+    }
+
+
+def redeem(user_id, reward, idempotency_key=None):
+    """Spend a user's points on a reward from the catalog.
+
+    The balance check and the deduction are one conditional UPDATE, so
+    concurrent redemptions can never overdraw. A repeated idempotency key
+    returns the original redemption instead of redeeming again, whatever the
+    balance is now. Raises RedemptionError with status 'user_not_found' or
+    'insufficient_points'.
+    """
+    points_required = reward['points_required']
+    try:
+        with db_manager.transaction() as cursor:
+            if idempotency_key:
+                existing = _find_by_key(cursor, user_id, idempotency_key)
+                if existing:
+                    return _result(existing, replayed=True)
+
+            # Pending shard credits count towards the balance; folding locks them until commit
+            fold_user(cursor, user_id)
+
+            if points_required == 0:
+                # Subtracting nothing changes no row, so rowcount can't tell us the user exists
+                cursor.execute("SELECT total_points FROM users WHERE id = %s FOR UPDATE", (user_id,))
+                user = cursor.fetchone()
+                if not user:
+                    raise RedemptionError('user_not_found')
+                balance_after = user['total_points']
+            else:
+                # LAST_INSERT_ID(expr) hands the new balance back without another SELECT
+                cursor.execute("""
+                    UPDATE users SET total_points = LAST_INSERT_ID(total_points - %s)
+                    WHERE id = %s AND total_points >= %s
+                """, (points_required, user_id, points_required))
+                if cursor.rowcount == 0:
+                    cursor.execute("SELECT total_points FROM users WHERE id = %s", (user_id,))
+                    user = cursor.fetchone()
+                    if not user:
+                        raise RedemptionError('user_not_found')
+                    raise RedemptionError('insufficient_points', user['total_points'])
+                balance_after = cursor.lastrowid
+
+            cursor.execute("""
+                INSERT INTO reward_redemptions
+                (user_id, reward_id, points_used, idempotency_key, balance_after)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (user_id, reward['id'], points_required, idempotency_key, balance_after))
+            redemption_id = cursor.lastrowid
+            record_entries(cursor, [(user_id, -points_required)], 'redemption', redemption_id)
+
+            return _result({
+                'id': redemption_id,
+                'reward_id': reward['id'],
+                'points_used': points_required,
+                'balance_after': balance_after
+            }, replayed=False)
+    except IntegrityError as e:
+        # A concurrent retry with the same key committed first; ours rolled back
+        if e.errno != errorcode.ER_DUP_ENTRY or not idempotency_key:
+            raise
+
+    with db_manager.transaction() as cursor:
+        return _result(_find_by_key(cursor, user_id, idempotency_key), replayed=True)
@@ -5,21 +5,31 @@ Handles user disposal history, leaderboards, and export functionality
 
 from flask import Blueprint, request, jsonify, make_response
 from database import DatabaseManager
+from achievements import milestone_progress, get_user_achievements
+from bin_registry import bin_registry
+from fieldsets import USER_SUMMARY_FIELDS
+from auth import request_user_id
+from points_ledger import balance_sql
+from http_cache import conditional
 from datetime import datetime, timedelta
 import csv
 import io
 import json
+import os
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/api/reports')
 db_manager = DatabaseManager()
 
-# Connect to database
-if not db_manager.connect():
-    print("Failed to connect to database in reports module")
+# A node re-renders each leaderboard URL at most this often
+LEADERBOARD_CACHE_SECONDS = int(os.getenv('LEADERBOARD_CACHE_SECONDS', 10))
+MAX_LEADERBOARD_LIMIT = 100
 
 @reports_bp.route('/history/<int:user_id>', methods=['GET'])
 def get_user_disposal_history(user_id):
     """Get comprehensive disposal history for a user"""
+    user_id, auth_error = request_user_id(user_id)
+    if auth_error:
+        return jsonify({'error': auth_error}), 403
     
     page = int(request.args.get('page', 1))
     limit = int(request.args.get('limit', 20))
@@ -29,43 +39,36 @@ def get_user_disposal_history(user_id):
     
     offset = (page - 1) * limit
     
-    # Base query
-    query = """
-        SELECT ws.id, ws.waste_type, ws.quantity, ws.points_earned, 
-               ws.scan_date, ws.confidence_score,
-               b.location_name as bin_location, b.region,
-               ws.location_lat, ws.location_lng
-        FROM waste_scans ws
-        LEFT JOIN bins b ON ws.bin_id = b.id
-        WHERE ws.user_id = %s
-    """
+    # Filters shared by the page and the total count
+    where = " WHERE ws.user_id = %s"
     params = [user_id]
     
     # Add filters
     if waste_type_filter != 'all':
-        query += " AND ws.waste_type = %s"
+        where += " AND ws.waste_type = %s"
         params.append(waste_type_filter)
     
     if date_from:
-        query += " AND ws.scan_date >= %s"
+        where += " AND ws.scan_date >= %s"
         params.append(date_from)
     
     if date_to:
-        query += " AND ws.scan_date <= %s"
+        where += " AND ws.scan_date <= %s"
         params.append(date_to)
     
-    query += " ORDER BY ws.scan_date DESC LIMIT %s OFFSET %s"
-    params.extend([limit, offset])
+    # Bin name and region come from the registry rather than a join
+    query = """
+        SELECT ws.id, ws.waste_type, ws.quantity, ws.points_earned, 
+               ws.scan_date, ws.confidence_score, ws.bin_id,
+               ws.location_lat, ws.location_lng
+        FROM waste_scans ws
+    """ + where + " ORDER BY ws.scan_date DESC LIMIT %s OFFSET %s"
     
-    history = db_manager.execute_query(query, params)
+    history = db_manager.execute_query(query, params + [limit, offset])
+    bin_registry.decorate(history or [], {'location_name': 'bin_location', 'region': 'region'}, keep_key=False)
     
     # Get total count for pagination
-    count_query = query.replace(
-        "SELECT ws.id, ws.waste_type, ws.quantity, ws.points_earned, ws.scan_date, ws.confidence_score, b.location_name as bin_location, b.region, ws.location_lat, ws.location_lng",
-        "SELECT COUNT(*) as total"
-    ).replace(f"LIMIT {limit} OFFSET {offset}", "")
-    
-    total_count = db_manager.execute_query(count_query, params[:-2])
+    total_count = db_manager.execute_query("SELECT COUNT(*) as total FROM waste_scans ws" + where, params)
     total = total_count[0]['total'] if total_count else 0
     
     # Get summary stats for this user
@@ -94,16 +97,23 @@ def get_user_disposal_history(user_id):
     })
 
 @reports_bp.route('/leaderboard', methods=['GET'])
+@conditional('leaderboard', max_age=LEADERBOARD_CACHE_SECONDS)
 def get_leaderboard():
     """Enhanced leaderboard with multiple ranking criteria"""
     
     period = request.args.get('period', 'all_time')  # all_time, weekly, monthly
     category = request.args.get('category', 'points')  # points, disposals, co2_saved
-    limit = int(request.args.get('limit', 10))
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    limit = min(limit, MAX_LEADERBOARD_LIMIT)
     
     # Base query parts
-    base_select = """
-        SELECT u.username, u.total_points, u.region, u.created_at,
+    base_select = f"""
+        SELECT u.username, {balance_sql('u')} as total_points, u.region, u.created_at,
                COUNT(ws.id) as total_disposals,
                SUM(ws.quantity) as total_waste_disposed,
                ROUND(SUM(ws.quantity) * 0.02, 2) as estimated_co2_saved
@@ -121,13 +131,13 @@ def get_leaderboard():
     
     # Add ordering based on category
     if category == 'points':
-        order_by = " ORDER BY u.total_points DESC, total_disposals DESC"
+        order_by = " ORDER BY total_points DESC, total_disposals DESC"
     elif category == 'disposals':
-        order_by = " ORDER BY total_disposals DESC, u.total_points DESC"
+        order_by = " ORDER BY total_disposals DESC, total_points DESC"
     elif category == 'co2_saved':
         order_by = " ORDER BY estimated_co2_saved DESC, total_disposals DESC"
     else:
-        order_by = " ORDER BY u.total_points DESC"
+        order_by = " ORDER BY total_points DESC"
     
     query = base_select + order_by + f" LIMIT {limit}"
     
@@ -155,21 +165,23 @@ def get_leaderboard():
 @reports_bp.route('/export/history/<int:user_id>', methods=['GET'])
 def export_user_history(user_id):
     """Export user disposal history as CSV"""
+    user_id, auth_error = request_user_id(user_id)
+    if auth_error:
+        return jsonify({'error': auth_error}), 403
     
     format_type = request.args.get('format', 'csv')  # csv or json
     
     query = """
         SELECT ws.scan_date as 'Date', ws.waste_type as 'Waste Type', 
                ws.quantity as 'Quantity (kg)', ws.points_earned as 'Points Earned',
-               ws.confidence_score as 'Confidence %', 
-               b.location_name as 'Bin Location', b.region as 'Region'
+               ws.confidence_score as 'Confidence %', ws.bin_id
         FROM waste_scans ws
-        LEFT JOIN bins b ON ws.bin_id = b.id
         WHERE ws.user_id = %s
         ORDER BY ws.scan_date DESC
     """
     
     data = db_manager.execute_query(query, (user_id,))
+    bin_registry.decorate(data or [], {'location_name': 'Bin Location', 'region': 'Region'}, keep_key=False)
     
     if format_type == 'csv':
         # Create CSV
@@ -200,8 +212,8 @@ def export_leaderboard():
     period = request.args.get('period', 'monthly')
     format_type = request.args.get('format', 'csv')
     
-    query = """
-        SELECT u.username as 'Username', u.total_points as 'Total Points', 
+    query = f"""
+        SELECT u.username as 'Username', {balance_sql('u')} as 'Total Points', 
                u.region as 'Region', 
                COUNT(ws.id) as 'Total Disposals',
                SUM(ws.quantity) as 'Total Waste (kg)',
@@ -217,7 +229,7 @@ def export_leaderboard():
     
     query += """
         GROUP BY u.id, u.username, u.total_points, u.region
-        ORDER BY u.total_points DESC, COUNT(ws.id) DESC
+        ORDER BY `Total Points` DESC, COUNT(ws.id) DESC
         LIMIT 50
     """
     
@@ -250,15 +262,17 @@ def export_leaderboard():
 @reports_bp.route('/summary/<int:user_id>', methods=['GET'])
 def get_user_summary_stats(user_id):
     """Get summary statistics for a user"""
-    
-    # Main user stats
-    user_stats = db_manager.execute_query("""
-        SELECT u.*, 
-               COUNT(ws.id) as total_disposals,
-               SUM(ws.quantity) as total_waste_disposed,
-               AVG(ws.points_earned) as avg_points_per_disposal,
-               COUNT(DISTINCT ws.waste_type) as waste_types_used,
-               COUNT(DISTINCT DATE(ws.scan_date)) as active_days
+    user_id, auth_error = request_user_id(user_id)
+    if auth_error:
+        return jsonify({'error': auth_error}), 403
+    fields, error = USER_SUMMARY_FIELDS.requested()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # Main user stats; milestones and the CO2 estimate need two columns whatever was asked for
+    columns = USER_SUMMARY_FIELDS.select(fields, required=('total_points', 'total_waste_disposed'))
+    user_stats = db_manager.execute_query(f"""
+        SELECT {columns}
         FROM users u
         LEFT JOIN waste_scans ws ON u.id = ws.user_id
         WHERE u.id = %s
@@ -296,23 +310,14 @@ def get_user_summary_stats(user_id):
         ORDER BY year DESC, month DESC
     """, (user_id,))
     
-    # Recent milestones
-    milestones = []
-    if user_data['total_points'] >= 1000:
-        milestones.append({'title': 'Eco Champion', 'description': 'Earned 1000+ points', 'achieved': True})
-    elif user_data['total_points'] >= 500:
-        milestones.append({'title': 'Eco Warrior', 'description': 'Earned 500+ points', 'achieved': True})
-        milestones.append({'title': 'Eco Champion', 'description': 'Earn 1000+ points', 'achieved': False, 'progress': user_data['total_points']/1000*100})
-    elif user_data['total_points'] >= 100:
-        milestones.append({'title': 'Eco Beginner', 'description': 'Earned 100+ points', 'achieved': True})
-        milestones.append({'title': 'Eco Warrior', 'description': 'Earn 500+ points', 'achieved': False, 'progress': user_data['total_points']/500*100})
-    else:
-        milestones.append({'title': 'Eco Beginner', 'description': 'Earn 100+ points', 'achieved': False, 'progress': user_data['total_points']/100*100})
+    # Milestones come from the achievements engine's rule table
+    milestones = milestone_progress(user_data['total_points'])
     
     return jsonify({
-        'user_stats': user_data,
+        'user_stats': USER_SUMMARY_FIELDS.project(user_data, fields),
         'waste_breakdown': waste_breakdown or [],
         'monthly_progress': monthly_progress or [],
         'milestones': milestones,
+        'achievements': get_user_achievements(user_id),
         'estimated_co2_impact': round((user_data['total_waste_disposed'] or 0) * 0.02, 2)
     })
@@ -0,0 +1,237 @@
+"""
+Notification Retention for Bin Smart
+Expires old notifications per type in small chunks, with optional monthly
+partitioning so whole months can be dropped instead of deleted row by row
+"""
+
+from database import DatabaseManager
+from notifications import rebuild_unread_counters, unread_counts
+from scheduler import check_job, prune_job_runs
+from datetime import datetime, timedelta
+import time
+
+db_manager = DatabaseManager()
+
+# Days each notification type is kept
+NOTIFICATION_TTL_DAYS = {
+    'alert': 7,
+    'reminder': 14,
+    'reward': 30,
+    'info': 90,
+    'milestone': 365
+}
+
+DELETE_CHUNK_SIZE = 1000
+CHUNK_PAUSE_SECONDS = 0.05  # Lets other writers at the table between chunks
+PARTITION_MONTHS_AHEAD = 3
+
+
+def _table_row_size():
+    """Average bytes per notifications row, data plus indexes"""
+    result = db_manager.execute_query("""
+        SELECT AVG_ROW_LENGTH as avg_row_length, DATA_LENGTH as data_length,
+               INDEX_LENGTH as index_length, TABLE_ROWS as table_rows
+        FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = 'notifications'
+    """)
+    if not result or not result[0]['table_rows']:
+        return 0
+    stats = result[0]
+    return (stats['data_length'] + stats['index_length']) / stats['table_rows']
+
+
+def _release_unread(cursor, unread_by_user):
+    """Take deleted unread notifications off the users' badge counters in one statement"""
+    if not unread_by_user:
+        return
+    values = ', '.join(['(%s, %s)'] * len(unread_by_user))
+    params = [value for item in unread_by_user.items() for value in item]
+    cursor.execute(f"""
+        INSERT INTO notification_counters (user_id, unread_count) VALUES {values}
+        ON DUPLICATE KEY UPDATE unread_count = GREATEST(unread_count - VALUES(unread_count), 0)
+    """, params)
+
+
+def purge_expired_notifications(ttl_days=None, chunk_size=DELETE_CHUNK_SIZE, pause=CHUNK_PAUSE_SECONDS):
+    """Delete notifications older than their type's TTL, one short transaction per chunk"""
+    ttl_days = ttl_days or NOTIFICATION_TTL_DAYS
+    rows_deleted = {}
+
+    for notification_type, days in ttl_days.items():
+        cutoff = datetime.now() - timedelta(days=days)
+        deleted = 0
+
+        while True:
+            check_job()
+            with db_manager.transaction() as cursor:
+                # Locked so a mark-read can't flip is_read between this read and the
+                # delete, which would take the same row off the counter twice
+                cursor.execute("""
+                    SELECT id, user_id, is_read FROM notifications
+                    WHERE type = %s AND created_at < %s
+                    ORDER BY created_at, id
+                    LIMIT %s
+                    FOR UPDATE
+                """, (notification_type, cutoff, chunk_size))
+                expired = cursor.fetchall()
+                if not expired:
+                    break
+
+                ids = [row['id'] for row in expired]
+                cursor.execute(
+                    f"DELETE FROM notifications WHERE id IN ({', '.join(['%s'] * len(ids))})", ids
+                )
+
+                unread_by_user = {}
+                for row in expired:
+                    if not row['is_read']:
+                        unread_by_user[row['user_id']] = unread_by_user.get(row['user_id'], 0) + 1
+                _release_unread(cursor, unread_by_user)
+
+            for user_id, count in unread_by_user.items():
+                unread_counts.adjust(user_id, -count)
+            deleted += len(expired)
+
+            if len(expired) < chunk_size:
+                break
+            time.sleep(pause)
+
+        rows_deleted[notification_type] = deleted
+
+    return rows_deleted
+
+
+def is_partitioned():
+    result = db_manager.execute_query("""
+        SELECT COUNT(*) as count FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = 'notifications'
+        AND partition_name IS NOT NULL
+    """)
+    return bool(result and result[0]['count'])
+
+
+def _month_start(moment, months_ahead=0):
+    month_index = moment.year * 12 + moment.month - 1 + months_ahead
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_clause(month_start):
+    upper = _month_start(month_start, 1)
+    return f"PARTITION p{month_start:%Y%m} VALUES LESS THAN (UNIX_TIMESTAMP('{upper:%Y-%m-%d}'))"
+
+
+def enable_partitioning(months_back=12, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Convert notifications to monthly RANGE partitions on created_at (one-off, admin only).
+
+    MySQL needs the partitioning column in every unique key and does not
+    support foreign keys on partitioned tables, so this drops the users
+    foreign key (deleting a user no longer cascades to their notifications)
+    and widens the primary key to (id, created_at).
+    """
+    if is_partitioned():
+        return False
+
+    foreign_keys = db_manager.execute_query("""
+        SELECT constraint_name as name FROM information_schema.referential_constraints
+        WHERE constraint_schema = DATABASE() AND table_name = 'notifications'
+    """)
+    for foreign_key in foreign_keys or []:
+        db_manager.execute_query(f"ALTER TABLE notifications DROP FOREIGN KEY {foreign_key['name']}")
+
+    db_manager.execute_query("ALTER TABLE notifications DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)")
+
+    now = datetime.now()
+    partitions = [_partition_clause(_month_start(now, offset)) for offset in range(-months_back, months_ahead + 1)]
+    # Rows older than the first month fall into the first partition's range
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    return db_manager.execute_query(
+        f"ALTER TABLE notifications PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) ({', '.join(partitions)})"
+    )
+
+
+def _partitions():
+    return db_manager.execute_query("""
+        SELECT partition_name as name, partition_description as upper_bound,
+               table_rows, data_length + index_length as bytes
+        FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = 'notifications'
+        AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position
+    """) or []
+
+
+def maintain_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Pre-create upcoming months and drop months past the longest TTL"""
+    partitions = _partitions()
+    existing = {partition['name'] for partition in partitions}
+    now = datetime.now()
+
+    upcoming = [
+        _partition_clause(_month_start(now, offset))
+        for offset in range(0, months_ahead + 1)
+        if f"p{_month_start(now, offset):%Y%m}" not in existing
+    ]
+    if upcoming and 'pmax' in existing:
+        db_manager.execute_query(f"""
+            ALTER TABLE notifications REORGANIZE PARTITION pmax INTO (
+                {', '.join(upcoming)}, PARTITION pmax VALUES LESS THAN MAXVALUE
+            )
+        """)
+
+    # A month can only go once every type in it has expired
+    oldest_kept = datetime.now() - timedelta(days=max(NOTIFICATION_TTL_DAYS.values()))
+    dropped = []
+    rows_dropped = 0
+    bytes_dropped = 0
+
+    for partition in partitions:
+        if partition['name'] == 'pmax' or int(partition['upper_bound']) > oldest_kept.timestamp():
+            continue
+        check_job()
+
+        # A mark-read between this read and the drop would make any subtraction
+        # wrong, so the affected users are recounted from what's left instead.
+        # Nothing turns unread again, so this set can only be too large.
+        unread = db_manager.execute_query(f"""
+            SELECT DISTINCT user_id FROM notifications PARTITION ({partition['name']})
+            WHERE is_read = FALSE
+        """)
+        db_manager.execute_query(f"ALTER TABLE notifications DROP PARTITION {partition['name']}")
+        rebuild_unread_counters([row['user_id'] for row in unread or []])
+
+        dropped.append(partition['name'])
+        rows_dropped += partition['table_rows'] or 0
+        bytes_dropped += partition['bytes'] or 0
+
+    return {
+        'partitions_added': len(upcoming),
+        'partitions_dropped': dropped,
+        'rows_dropped': rows_dropped,
+        'bytes_dropped': bytes_dropped
+    }
+
+
+def run_retention():
+    """Expire notifications and report what was reclaimed.
+
+    Row deletes free space inside the tablespace for reuse rather than
+    shrinking the file, so their bytes are an estimate from the average row
+    size; dropped partitions report their actual size.
+    """
+    started = time.monotonic()
+    row_size = _table_row_size()
+
+    report = {'partitioned': is_partitioned()}
+    if report['partitioned']:
+        report.update(maintain_partitions())
+
+    rows_deleted = purge_expired_notifications()
+    deleted_total = sum(rows_deleted.values())
+
+    report['job_runs_pruned'] = prune_job_runs()
+    report['rows_deleted'] = rows_deleted
+    report['rows_reclaimed'] = deleted_total + report.get('rows_dropped', 0)
+    report['bytes_reclaimed'] = int(deleted_total * row_size) + report.get('bytes_dropped', 0)
+    report['duration_ms'] = int((time.monotonic() - started) * 1000)
+    return report
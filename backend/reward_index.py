@@ -0,0 +1,143 @@
+"""
+Reward Eligibility Index for Bin Smart
+Keeps the active reward catalog and recently seen user balances in memory so
+we know who can afford which rewards without joining users against rewards
+"""
+
+from bisect import bisect_right
+from database import DatabaseManager
+from auth import TTLCache
+from points_ledger import balance_sql
+import hashlib
+import os
+import threading
+import time
+
+db_manager = DatabaseManager()
+
+# How often the reward catalog is re-read from the database
+CATALOG_REFRESH_SECONDS = 300
+# Balances changed on other nodes, or by the ledger audit, show up after this
+POINTS_CACHE_SECONDS = int(os.getenv('REWARD_POINTS_CACHE_SECONDS', 60))
+POINTS_CACHE_MAX_ENTRIES = 100000
+
+
+class RewardEligibilityIndex:
+    """Sorted reward thresholds plus a short-lived balance per recently seen user.
+
+    The points update path calls apply_points() to keep cached balances
+    current, and record_changes() inside its transaction: a bisect against
+    the cached thresholds tells whether a user can now afford more rewards,
+    and if so a reward_eligibility_changes row queues them for the alert job,
+    whichever node the scheduler leader is. Balances are loaded one user at
+    a time on demand and expire after POINTS_CACHE_SECONDS.
+    """
+
+    def __init__(self, refresh_seconds=CATALOG_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._rewards = []
+        self._rewards_by_id = {}
+        self._thresholds = []
+        self._catalog_loaded_at = 0
+        self._catalog_version = None
+        self._points = TTLCache(POINTS_CACHE_SECONDS, POINTS_CACHE_MAX_ENTRIES)
+
+    def refresh_catalog(self):
+        """Reload active rewards sorted by points required"""
+        rewards = db_manager.execute_query("""
+            SELECT * FROM rewards
+            WHERE is_active = TRUE
+            ORDER BY points_required ASC
+        """)
+        if rewards is None:
+            return False
+
+        with self._lock:
+            self._rewards = rewards
+            self._rewards_by_id = {reward['id']: reward for reward in rewards}
+            self._thresholds = [reward['points_required'] for reward in rewards]
+            self._catalog_version = hashlib.blake2b(repr(rewards).encode(), digest_size=8).hexdigest()
+            self._catalog_loaded_at = time.time()
+        return True
+
+    def _ensure_catalog(self):
+        if time.time() - self._catalog_loaded_at > self.refresh_seconds:
+            self.refresh_catalog()
+
+    def apply_points(self, user_id, delta=0, total=None):
+        """Record a balance change; total, when known, is authoritative"""
+        if not user_id:
+            return
+        self._ensure_catalog()
+
+        with self._lock:
+            if total is not None:
+                self._points.set(user_id, total)
+                return
+            old_points = self._points.get(user_id)
+            if old_points is not None:
+                self._points.set(user_id, old_points + delta)
+
+    def crossed_threshold(self, old_points, new_points):
+        """Whether going from old_points to new_points makes another reward affordable"""
+        self._ensure_catalog()
+        with self._lock:
+            return bisect_right(self._thresholds, new_points) > bisect_right(self._thresholds, old_points)
+
+    def record_changes(self, cursor, totals, deltas):
+        """Queue users a credit let afford more rewards, in the credit's own transaction"""
+        user_ids = [
+            user_id for user_id, total in sorted(totals.items())
+            if self.crossed_threshold(total - deltas[user_id], total)
+        ]
+        if user_ids:
+            cursor.execute(f"""
+                INSERT INTO reward_eligibility_changes (user_id)
+                VALUES {', '.join(['(%s)'] * len(user_ids))}
+            """, user_ids)
+        return user_ids
+
+    def points(self, user_id):
+        """A user's balance, re-read from the database once the cached one expires"""
+        cached = self._points.get(user_id)
+        if cached is not None:
+            return cached
+
+        result = db_manager.execute_query(
+            f"SELECT {balance_sql('u')} as total_points FROM users u WHERE u.id = %s", (user_id,)
+        )
+        if not result:
+            return None
+        points = int(result[0]['total_points'] or 0)
+        self._points.set(user_id, points)
+        return points
+
+    def affordable(self, user_id):
+        """Active rewards a user can currently afford, cheapest first"""
+        self._ensure_catalog()
+        user_points = self.points(user_id)
+        if user_points is None:
+            return None, []
+        with self._lock:
+            return user_points, self._rewards[:bisect_right(self._thresholds, user_points)]
+
+    def rewards(self):
+        """The cached active reward catalog"""
+        self._ensure_catalog()
+        with self._lock:
+            return list(self._rewards)
+
+    @property
+    def catalog_version(self):
+        """Digest of the cached catalog, taken when it loads; None if it never has"""
+        self._ensure_catalog()
+        return self._catalog_version
+
+    def get_reward(self, reward_id):
+        self._ensure_catalog()
+        with self._lock:
+            return self._rewards_by_id.get(reward_id)
+
+
+reward_index = RewardEligibilityIndex()
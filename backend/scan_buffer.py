@@ -0,0 +1,287 @@
+"""
+Scan Write-Behind Buffer for Bin Smart
+Collects single scans from concurrent requests and commits them together,
+one multi-row INSERT per flush, so scan throughput isn't capped by commits
+"""
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from collections import deque
+from scans import record_scans, scans_recorded, scan_result, cached_result
+from mysql.connector import errorcode
+from mysql.connector.errors import InterfaceError, OperationalError, PoolError
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+# 'direct' commits each request itself; 'buffered' waits for the group
+# commit; 'fire_and_forget' answers as soon as the scan is queued
+SCAN_WRITE_MODE = os.getenv('SCAN_WRITE_MODE', 'direct')
+SCAN_BUFFER_FLUSH_MS = int(os.getenv('SCAN_BUFFER_FLUSH_MS', 20))
+SCAN_BUFFER_MAX_ROWS = int(os.getenv('SCAN_BUFFER_MAX_ROWS', 500))
+# Scans waiting for a flush before submitters are made to wait
+SCAN_BUFFER_CAPACITY = int(os.getenv('SCAN_BUFFER_CAPACITY', 10000))
+# How long a submitter waits for room before giving up
+SCAN_BUFFER_PUT_TIMEOUT_SECONDS = float(os.getenv('SCAN_BUFFER_PUT_TIMEOUT_SECONDS', 1))
+# How long a 'buffered' request waits for its flush to commit
+SCAN_BUFFER_COMMIT_TIMEOUT_SECONDS = float(os.getenv('SCAN_BUFFER_COMMIT_TIMEOUT_SECONDS', 5))
+# Retries of a flush that hit a lost connection, deadlock or lock wait timeout
+SCAN_BUFFER_FLUSH_RETRIES = int(os.getenv('SCAN_BUFFER_FLUSH_RETRIES', 2))
+SCAN_BUFFER_RETRY_BACKOFF_SECONDS = float(os.getenv('SCAN_BUFFER_RETRY_BACKOFF_SECONDS', 0.1))
+# Times a scan nobody waits for goes back on the queue after its flush failed
+SCAN_BUFFER_MAX_REQUEUES = int(os.getenv('SCAN_BUFFER_MAX_REQUEUES', 5))
+FLUSH_LATENCY_SAMPLES = 1000
+TRANSIENT_ERRNOS = {errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT}
+
+
+class ScanBufferFull(Exception):
+    """The buffer stayed full for the whole put timeout; callers should answer 503"""
+
+
+def _is_transient(error):
+    """Whether a failed flush may succeed if simply run again"""
+    return (isinstance(error, (InterfaceError, OperationalError, PoolError))
+            or getattr(error, 'errno', None) in TRANSIENT_ERRNOS)
+
+
+class ScanEntry:
+    """A queued scan, the future for its commit, and whether a caller still waits on it"""
+
+    __slots__ = ('scan', 'future', 'waited', 'requeues')
+
+    def __init__(self, scan, waited):
+        self.scan = scan
+        self.future = Future()
+        self.waited = waited
+        self.requeues = 0
+
+
+class ScanBuffer:
+    """Queue of ScanEntry objects drained by one flusher thread.
+
+    A flush starts once SCAN_BUFFER_MAX_ROWS scans are waiting or the oldest
+    has waited SCAN_BUFFER_FLUSH_MS, whichever comes first. Each future
+    resolves after its flush commits to a (status, result) pair as returned by
+    commit_scan; total_points in the result is the balance after the flush.
+
+    A flush that fails on a lost connection, deadlock or lock wait is retried
+    with backoff; any other failure splits the batch in halves until the bad
+    row fails alone. Scans nobody waits for are requeued when their flush
+    still fails, and logged in full once they run out of requeues.
+    """
+
+    def __init__(self, flush_ms=SCAN_BUFFER_FLUSH_MS, max_rows=SCAN_BUFFER_MAX_ROWS,
+                 capacity=SCAN_BUFFER_CAPACITY, put_timeout=SCAN_BUFFER_PUT_TIMEOUT_SECONDS):
+        self.flush_seconds = flush_ms / 1000
+        self.max_rows = max_rows
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=capacity)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=FLUSH_LATENCY_SAMPLES)
+        self._counters = {
+            'flushes': 0,
+            'scans_flushed': 0,
+            'scans_rejected': 0,
+            'scans_replayed': 0,
+            'largest_flush': 0,
+            'failed_flushes': 0,
+            'flush_retries': 0,
+            'batches_split': 0,
+            'scans_requeued': 0,
+            'scans_lost': 0,
+            'backpressure_refusals': 0
+        }
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='scan-buffer', daemon=True)
+                self._thread.start()
+                atexit.register(self.drain)
+
+    def submit(self, scan, wait=True):
+        """Queue a validated scan; returns its ScanEntry or raises ScanBufferFull.
+
+        wait=False marks a fire-and-forget scan, so a failed flush requeues it
+        rather than reporting to a caller.
+        """
+        self.start()
+        entry = ScanEntry(scan, wait)
+        try:
+            self._queue.put(entry, timeout=self.put_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self._counters['backpressure_refusals'] += 1
+            raise ScanBufferFull('Scan buffer is full')
+        return entry
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self.flush(batch)
+            except Exception as e:
+                print(f"Error after flushing buffered scans: {e}")
+
+    def drain(self):
+        """Flush whatever is queued right now, requeued scans included; used at exit"""
+        while True:
+            batch = []
+            while len(batch) < self.max_rows:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self.flush(batch)
+
+    def flush(self, batch):
+        """Commit a batch of entries, retrying transient failures and isolating bad rows"""
+        scans = [entry.scan for entry in batch]
+        started = time.perf_counter()
+        for attempt in range(SCAN_BUFFER_FLUSH_RETRIES + 1):
+            try:
+                skipped, replayed, by_user = record_scans(scans)
+                break
+            except Exception as e:
+                if not _is_transient(e):
+                    self._split(batch, e)
+                    return
+                if attempt == SCAN_BUFFER_FLUSH_RETRIES:
+                    self._failed(batch, e)
+                    return
+                print(f"Retrying flush of {len(scans)} buffered scans: {e}")
+                with self._stats_lock:
+                    self._counters['flush_retries'] += 1
+                time.sleep(SCAN_BUFFER_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for index, entry in enumerate(batch):
+            entry.future.set_result(_outcome(index, entry.scan, skipped, replayed, by_user))
+
+        with self._stats_lock:
+            self._latencies.append(elapsed_ms)
+            self._counters['flushes'] += 1
+            self._counters['scans_flushed'] += len(scans) - len(skipped) - len(replayed)
+            self._counters['scans_rejected'] += len(skipped)
+            self._counters['scans_replayed'] += len(replayed)
+            self._counters['largest_flush'] = max(self._counters['largest_flush'], len(scans))
+
+        # One more transaction for the whole batch's counters and achievements
+        scans_recorded(by_user)
+
+    def _split(self, batch, error):
+        """Flush each half of a batch that failed, so one bad row doesn't fail the rest"""
+        if len(batch) == 1:
+            self._failed(batch, error)
+            return
+        with self._stats_lock:
+            self._counters['batches_split'] += 1
+        middle = len(batch) // 2
+        self.flush(batch[:middle])
+        self.flush(batch[middle:])
+
+    def _failed(self, batch, error):
+        """Report a failed flush to waiting callers and requeue the scans nobody waits for"""
+        print(f"Error flushing {len(batch)} buffered scans: {error}")
+        requeued = lost = 0
+        for entry in batch:
+            if entry.waited:
+                entry.future.set_exception(error)
+            elif entry.requeues < SCAN_BUFFER_MAX_REQUEUES and self._requeue(entry):
+                requeued += 1
+            else:
+                lost += 1
+                print(f"Lost buffered scan after {entry.requeues} requeues: {json.dumps(entry.scan, default=str)}")
+        with self._stats_lock:
+            self._counters['failed_flushes'] += 1
+            self._counters['scans_requeued'] += requeued
+            self._counters['scans_lost'] += lost
+
+    def _requeue(self, entry):
+        entry.requeues += 1
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            return False
+        return True
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self._counters)
+            latencies = sorted(self._latencies)
+        flushes = counters['flushes']
+        return {
+            **counters,
+            'mode': SCAN_WRITE_MODE,
+            'queued': self._queue.qsize(),
+            'capacity': self._queue.maxsize,
+            'average_flush_size': round(counters['scans_flushed'] / flushes, 1) if flushes else 0,
+            'flush_ms_p50': round(latencies[len(latencies) // 2], 2) if latencies else 0,
+            'flush_ms_p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2) if latencies else 0
+        }
+
+
+scan_buffer = ScanBuffer()
+
+
+def _outcome(index, scan, skipped, replayed, by_user):
+    if index in skipped:
+        return 'unknown_user', None
+    if index in replayed:
+        return 'replayed', replayed[index]
+    return 'recorded', scan_result(scan, by_user)
+
+
+def commit_scan(scan):
+    """Record one validated scan the way SCAN_WRITE_MODE says.
+
+    Returns (status, result). status is 'recorded', 'replayed' (the scan's
+    idempotency key was already used; result is the original one),
+    'unknown_user', or 'queued' for fire-and-forget and for a buffered scan
+    whose flush didn't commit in time; it is still queued and will commit, so
+    the caller must not be told to retry. result holds waste_type,
+    confidence, points_earned and total_points. Raises ScanBufferFull when
+    the buffer can't take the scan.
+    """
+    cached = cached_result(scan)
+    if cached is not None:
+        return 'replayed', cached
+
+    if SCAN_WRITE_MODE == 'direct':
+        skipped, replayed, by_user = record_scans([scan])
+        scans_recorded(by_user)
+        return _outcome(0, scan, skipped, replayed, by_user)
+
+    if SCAN_WRITE_MODE == 'fire_and_forget':
+        scan_buffer.submit(scan, wait=False)
+        return 'queued', scan_result(scan, {})
+
+    entry = scan_buffer.submit(scan)
+    try:
+        return entry.future.result(timeout=SCAN_BUFFER_COMMIT_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        # Nobody waits any more, so a failed flush requeues it like a fire-and-forget scan
+        entry.waited = False
+        if entry.future.done():
+            # Settled while we gave up, before the flag was read; report it as it is
+            return entry.future.result()
+        return 'queued', scan_result(scan, {})
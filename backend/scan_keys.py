@@ -0,0 +1,120 @@
+"""
+Scan Deduplication for Bin Smart
+Remembers client-supplied idempotency keys for scans, so a retried upload
+returns the original result instead of recording the scan twice
+"""
+
+from database import DatabaseManager
+from scheduler import check_job
+from auth import TTLCache
+import json
+import threading
+import time
+
+db_manager = DatabaseManager()
+
+MAX_SCAN_KEY_LENGTH = 64
+# Keys are kept this long in the database; a retry after that is a new scan
+SCAN_KEY_TTL_HOURS = 24
+# Recent keys answered from memory without touching the database
+RECENT_KEYS_TTL_SECONDS = 600
+RECENT_KEYS_MAX_ENTRIES = 100000
+PURGE_CHUNK_SIZE = 5000
+
+
+def scoped_key(user_id, key):
+    """Keys are per user; anonymous kiosk scans share user 0"""
+    return f"{user_id or 0}:{key}"
+
+
+class RecentScanKeys:
+    """Results of recently recorded keyed scans, plus duplicate counters"""
+
+    def __init__(self, ttl_seconds=RECENT_KEYS_TTL_SECONDS, max_entries=RECENT_KEYS_MAX_ENTRIES):
+        self._results = TTLCache(ttl_seconds, max_entries)
+        self._lock = threading.Lock()
+        self._counters = {
+            'keys_recorded': 0,
+            'duplicates_from_memory': 0,
+            'duplicates_from_database': 0,
+            'duplicates_within_request': 0
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key):
+        """The stored result for a key, counting a hit as an absorbed duplicate"""
+        result = self._results.get(key)
+        if result is not None:
+            self._count('duplicates_from_memory')
+        return result
+
+    def remember(self, key, result):
+        self._results.set(key, result)
+
+    def find_recorded(self, cursor, keys):
+        """Stored results for keys already in the database, inside the caller's transaction"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        cursor.execute(f"""
+            SELECT scan_key, result FROM scan_keys
+            WHERE scan_key IN ({', '.join(['%s'] * len(keys))})
+        """, keys)
+        found = {row['scan_key']: json.loads(row['result']) for row in cursor.fetchall()}
+        if found:
+            self._count('duplicates_from_database', len(found))
+        return found
+
+    def insert(self, cursor, results):
+        """Store key -> result pairs; a key committed concurrently raises a duplicate-key error"""
+        if not results:
+            return
+        params = []
+        for key, result in results.items():
+            params.extend((key, json.dumps(result)))
+        cursor.execute(f"""
+            INSERT INTO scan_keys (scan_key, result)
+            VALUES {', '.join(['(%s, %s)'] * len(results))}
+        """, params)
+
+    def recorded(self, results, repeats=0):
+        """Cache results once their transaction has committed; repeats counts keys sent twice in one request"""
+        for key, result in results.items():
+            self.remember(key, result)
+        self._count('keys_recorded', len(results))
+        if repeats:
+            self._count('duplicates_within_request', repeats)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['duplicates_absorbed'] = (
+            counters['duplicates_from_memory'] + counters['duplicates_from_database']
+            + counters['duplicates_within_request']
+        )
+        return counters
+
+
+scan_keys = RecentScanKeys()
+
+
+def purge_expired_scan_keys(ttl_hours=SCAN_KEY_TTL_HOURS, chunk_size=PURGE_CHUNK_SIZE):
+    """Delete scan keys older than their TTL in short chunks"""
+    deleted = 0
+    while True:
+        check_job()
+        with db_manager.transaction() as cursor:
+            cursor.execute("""
+                DELETE FROM scan_keys
+                WHERE created_at < NOW() - INTERVAL %s HOUR
+                LIMIT %s
+            """, (ttl_hours, chunk_size))
+            count = cursor.rowcount
+        deleted += count
+        if count < chunk_size:
+            break
+        time.sleep(0.05)
+    return {'scan_keys_deleted': deleted}
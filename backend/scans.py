@@ -0,0 +1,218 @@
+"""
+Waste Scans for Bin Smart
+Validates and records waste scans in bulk: one multi-row INSERT and one
+points credit per user, however many scans arrive together
+"""
+
+from database import DatabaseManager
+from bin_registry import bin_registry
+from reward_index import reward_index
+from achievements import record_disposals
+from auth import invalidate_user
+from points_ledger import credit
+from scan_keys import scan_keys, scoped_key, MAX_SCAN_KEY_LENGTH
+from mysql.connector import errorcode, IntegrityError
+import math
+import random
+
+db_manager = DatabaseManager()
+
+# Points per unit of each waste type
+SCAN_POINTS = {
+    'Plastic': 10,
+    'Organic': 5,
+    'Paper': 8,
+    'E-Waste': 20,
+    'Glass': 12
+}
+MAX_BATCH_SIZE = 500
+SCAN_COLUMNS = (
+    'user_id', 'bin_id', 'waste_type', 'confidence_score', 'points_earned',
+    'quantity', 'location_lat', 'location_lng'
+)
+
+
+def _optional_number(item, field, low=None, high=None):
+    value = item.get(field)
+    if value is None:
+        return None
+    value = float(value)
+    # NaN fails every comparison below, and neither NaN nor infinity can be stored
+    if not math.isfinite(value):
+        raise ValueError(f'{field} must be a finite number')
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f'{field} must be between {low} and {high}')
+    return value
+
+
+def validate_scan(item):
+    """A scan row ready for insert_scans, or an error message"""
+    if not isinstance(item, dict):
+        return None, 'scan must be an object'
+
+    waste_type = item.get('waste_type')
+    if waste_type not in SCAN_POINTS:
+        return None, f'waste_type must be one of {sorted(SCAN_POINTS)}'
+
+    try:
+        quantity = _optional_number(item, 'quantity', 0.01, 999999)
+        quantity = 1.0 if quantity is None else quantity
+        confidence = _optional_number(item, 'confidence', 0, 100)
+        location_lat = _optional_number(item, 'location_lat', -90, 90)
+        location_lng = _optional_number(item, 'location_lng', -180, 180)
+        user_id = int(item['user_id']) if item.get('user_id') is not None else None
+        bin_id = int(item['bin_id']) if item.get('bin_id') is not None else None
+    except (TypeError, ValueError, OverflowError) as e:
+        return None, str(e) if 'between' in str(e) or 'finite' in str(e) else 'numeric fields must be numbers'
+
+    if bin_id is not None and not bin_registry.exists(bin_id):
+        return None, 'Invalid bin ID'
+
+    idempotency_key = item.get('idempotency_key')
+    if idempotency_key is not None and (
+        not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= MAX_SCAN_KEY_LENGTH
+    ):
+        return None, f'idempotency_key must be a string of at most {MAX_SCAN_KEY_LENGTH} characters'
+
+    return {
+        'user_id': user_id,
+        'bin_id': bin_id,
+        'waste_type': waste_type,
+        'confidence_score': confidence if confidence is not None else random.uniform(80, 100),
+        'points_earned': round(SCAN_POINTS[waste_type] * quantity),
+        'quantity': quantity,
+        'location_lat': location_lat,
+        'location_lng': location_lng,
+        'idempotency_key': idempotency_key
+    }, None
+
+
+def existing_user_ids(cursor, user_ids):
+    """The subset of user_ids that have a users row"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    cursor.execute(
+        f"SELECT id FROM users WHERE id IN ({', '.join(['%s'] * len(user_ids))})", user_ids
+    )
+    return {row['id'] for row in cursor.fetchall()}
+
+
+def insert_scans(cursor, scans):
+    """Insert scan rows with a single multi-row INSERT"""
+    row_placeholder = f"({', '.join(['%s'] * len(SCAN_COLUMNS))})"
+    params = []
+    for scan in scans:
+        params.extend(scan[column] for column in SCAN_COLUMNS)
+    cursor.execute(f"""
+        INSERT INTO waste_scans ({', '.join(SCAN_COLUMNS)})
+        VALUES {', '.join([row_placeholder] * len(scans))}
+    """, params)
+
+
+def summarize_by_user(scans):
+    """Points and waste types per user for a list of scans; anonymous scans are left out"""
+    by_user = {}
+    for scan in scans:
+        if scan['user_id'] is None:
+            continue
+        entry = by_user.setdefault(scan['user_id'], {'points': 0, 'waste_types': []})
+        entry['points'] += scan['points_earned']
+        entry['waste_types'].append(scan['waste_type'])
+    return by_user
+
+
+def scan_result(scan, by_user):
+    """What a client is told about a recorded scan, and what a retry of it replays"""
+    user = by_user.get(scan['user_id']) or {}
+    return {
+        'waste_type': scan['waste_type'],
+        'confidence': scan['confidence_score'],
+        'points_earned': scan['points_earned'],
+        'total_points': user.get('total_points')
+    }
+
+
+def cached_result(scan):
+    """The original result of a keyed scan recorded recently, from memory only"""
+    if not scan.get('idempotency_key'):
+        return None
+    return scan_keys.get(scoped_key(scan['user_id'], scan['idempotency_key']))
+
+
+def record_scans(scans):
+    """Record validated scans in one transaction.
+
+    Returns (skipped, replayed, by_user). skipped holds the indexes of scans
+    for users that don't exist. replayed maps the indexes of scans whose
+    idempotency key was already recorded, earlier or in this same list, to
+    the original result; they are not recorded again. by_user gives, per
+    user, the points added, waste types and new total. Call scans_recorded()
+    with by_user once this returns; it updates counters and achievements.
+    """
+    for attempt in range(2):
+        try:
+            return _record_scans(scans)
+        except IntegrityError as e:
+            # Another request committed one of our keys first; the retry replays it
+            if e.errno != errorcode.ER_DUP_ENTRY or attempt:
+                raise
+
+
+def _record_scans(scans):
+    keys = {
+        index: scoped_key(scan['user_id'], scan['idempotency_key'])
+        for index, scan in enumerate(scans) if scan.get('idempotency_key')
+    }
+
+    with db_manager.transaction() as cursor:
+        stored = scan_keys.find_recorded(cursor, set(keys.values()))
+        replayed = {index: stored[key] for index, key in keys.items() if key in stored}
+
+        # A key repeated within the list only counts once
+        first_index = {}
+        repeats = {}
+        for index, key in keys.items():
+            if index in replayed:
+                continue
+            if key in first_index:
+                repeats[index] = first_index[key]
+            else:
+                first_index[key] = index
+        pending = [index for index in range(len(scans)) if index not in replayed and index not in repeats]
+
+        known = existing_user_ids(cursor, {scans[index]['user_id'] for index in pending if scans[index]['user_id'] is not None})
+        skipped = {index for index in pending if scans[index]['user_id'] is not None and scans[index]['user_id'] not in known}
+        accepted = [index for index in pending if index not in skipped]
+
+        by_user = summarize_by_user([scans[index] for index in accepted])
+        results = {}
+        if accepted:
+            insert_scans(cursor, [scans[index] for index in accepted])
+            points_by_user = {user_id: entry['points'] for user_id, entry in by_user.items()}
+            totals = credit(cursor, points_by_user, 'scan')
+            for user_id, total in totals.items():
+                by_user[user_id]['total_points'] = total
+            reward_index.record_changes(cursor, totals, points_by_user)
+
+            results = {index: scan_result(scans[index], by_user) for index in accepted if index in keys}
+            scan_keys.insert(cursor, {keys[index]: result for index, result in results.items()})
+
+    scan_keys.recorded({keys[index]: result for index, result in results.items()}, len(repeats))
+    for index, first in repeats.items():
+        if first in skipped:
+            skipped.add(index)
+        else:
+            replayed[index] = results[first]
+    return skipped, replayed, by_user
+
+
+def scans_recorded(by_user):
+    """Caches, reward eligibility, activity counters and achievements after scans commit"""
+    for user_id, entry in by_user.items():
+        invalidate_user(user_id)
+        reward_index.apply_points(user_id, entry['points'], total=entry.get('total_points'))
+    try:
+        record_disposals(by_user)
+    except Exception as e:
+        print(f"Warning: Failed to update achievements: {e}")
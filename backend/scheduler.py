@@ -0,0 +1,364 @@
+"""
+Job Scheduler for Bin Smart
+Runs periodic jobs on cron-like schedules, on exactly one node at a time
+"""
+
+from database import DatabaseManager
+from mysql.connector import Error
+from collections import deque
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+db_manager = DatabaseManager()
+
+LEADER_LOCK_NAME = 'bin_smart_scheduler_leader'
+TICK_SECONDS = 5
+HISTORY_SIZE = 20
+# A running job re-checks that its node still holds the leader lock at most this often
+LEADERSHIP_CHECK_SECONDS = 5
+# scheduled_job_runs rows older than this are pruned by the retention job
+JOB_RUN_RETENTION_DAYS = 30
+PRUNE_CHUNK_SIZE = 1000
+
+_running = threading.local()
+
+
+class JobCancelled(Exception):
+    """Raised by check_job() in a job past its timeout or on a node that lost leadership"""
+
+
+def check_job():
+    """Stop the calling job if it ran past its timeout or its node no longer leads.
+
+    Jobs call this between chunks of work; outside a scheduled run it does nothing.
+    """
+    run = getattr(_running, 'run', None)
+    if run is not None:
+        run.check()
+
+
+class CronTrigger:
+    """Five-field cron expression: minute hour day-of-month month day-of-week.
+
+    Fields accept '*', 'a-b', 'a,b,c' and '/step'; day-of-week uses 0 (or 7)
+    for Sunday. As in cron, when both day fields are restricted a day matches
+    if either does.
+    """
+
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)
+        ]
+        self.weekdays = {0 if day == 7 else day for day in weekdays}
+        self.days_restricted = parts[2] != '*'
+        self.weekdays_restricted = parts[4] != '*'
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for item in field.split(','):
+            spec, _, step = item.partition('/')
+            step = int(step) if step else 1
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, end = (int(v) for v in spec.split('-', 1))
+            else:
+                start = int(spec)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Invalid cron field: {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        # Python: Monday=0 ... Sunday=6; cron: Sunday=0 ... Saturday=6
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment):
+        """The first matching minute strictly after moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 4)
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+
+class Job:
+    """A registered job plus its next run time and recent history"""
+
+    def __init__(self, name, func, cron, timeout, jitter):
+        self.name = name
+        self.func = func
+        self.trigger = CronTrigger(cron)
+        self.timeout = timeout
+        self.jitter = jitter
+        self.next_run = None
+        self.running = False
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+    def schedule_next(self, now):
+        self.next_run = self.trigger.next_after(now) + timedelta(seconds=random.uniform(0, self.jitter))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'cron': self.trigger.expression,
+            'timeout_seconds': self.timeout,
+            'jitter_seconds': self.jitter,
+            'next_run': self.next_run.isoformat() if self.next_run else None,
+            'running': self.running,
+            'history': list(self.history)
+        }
+
+
+class JobRun:
+    """One execution of a job: its deadline and the leadership it runs under"""
+
+    def __init__(self, scheduler, job):
+        self.scheduler = scheduler
+        self.job = job
+        self.deadline = time.monotonic() + job.timeout
+        self._leadership_checked_at = time.monotonic()
+
+    def check(self):
+        now = time.monotonic()
+        if now > self.deadline:
+            raise JobCancelled(f"Job {self.job.name} ran past its {self.job.timeout}s timeout")
+        if now - self._leadership_checked_at >= LEADERSHIP_CHECK_SECONDS:
+            self._leadership_checked_at = now
+            if not self.scheduler.holds_lock():
+                raise JobCancelled(f"Job {self.job.name} stopped: {self.scheduler.node} lost leadership")
+
+
+class Scheduler:
+    """In-process scheduler with MySQL GET_LOCK leader election.
+
+    Every node runs the scheduler loop, but only the node holding the named
+    lock executes jobs. The lock lives on a dedicated connection, so if the
+    leader dies its session ends, the lock is released and another node takes
+    over on its next tick. Jobs stop at their next check_job() once they pass
+    their timeout or the lock is gone, so a job never keeps running next to
+    the new leader's run of it.
+    """
+
+    def __init__(self, lock_name=LEADER_LOCK_NAME, tick_seconds=TICK_SECONDS):
+        self.lock_name = lock_name
+        self.tick_seconds = tick_seconds
+        self.node = f"{socket.gethostname()}:{os.getpid()}"
+        self.jobs = {}
+        self._lock_connection = None
+        # Job threads check the lock connection too; a connection isn't thread-safe
+        self._lock_guard = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, func, cron, timeout=300, jitter=0):
+        """Register func to run on a cron schedule, at most timeout seconds per run"""
+        job = Job(name, func, cron, timeout, jitter)
+        job.schedule_next(datetime.now())
+        self.jobs[name] = job
+        return job
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='bin-smart-scheduler', daemon=True)
+        self._thread.start()
+        print(f"Scheduler started on {self.node} with {len(self.jobs)} jobs")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.tick_seconds * 2)
+        self._release_leadership()
+
+    @property
+    def is_leader(self):
+        return self._lock_connection is not None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                leader = self._ensure_leadership()
+                now = datetime.now()
+                for job in self.jobs.values():
+                    if job.next_run > now or job.running:
+                        continue
+                    job.schedule_next(now)
+                    # Followers just roll the schedule forward so a failover
+                    # doesn't replay a slot the old leader already ran
+                    if leader:
+                        self._start_job(job)
+            except Exception as e:
+                print(f"Scheduler tick failed: {e}")
+            self._stop.wait(self.tick_seconds)
+
+    def holds_lock(self):
+        """Whether this node's lock connection still holds the leader lock"""
+        with self._lock_guard:
+            if self._lock_connection is None:
+                return False
+            try:
+                cursor = self._lock_connection.cursor()
+                cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (self.lock_name,))
+                held = cursor.fetchone()[0] == 1
+                cursor.close()
+                return held
+            except Error:
+                return False
+
+    def _ensure_leadership(self):
+        """Hold the leader lock, acquiring it if free; returns whether we lead"""
+        if self._lock_connection is not None:
+            if self.holds_lock():
+                return True
+            print(f"Scheduler on {self.node} lost leadership")
+            self._release_leadership()
+
+        try:
+            connection = db_manager.create_connection()
+            cursor = connection.cursor()
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (self.lock_name,))
+            acquired = cursor.fetchone()[0] == 1
+            cursor.close()
+        except Error:
+            return False
+
+        if acquired:
+            self._lock_connection = connection
+            print(f"Scheduler on {self.node} is now the leader")
+            return True
+
+        connection.close()
+        return False
+
+    def _release_leadership(self):
+        with self._lock_guard:
+            if self._lock_connection is None:
+                return
+            try:
+                cursor = self._lock_connection.cursor()
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (self.lock_name,))
+                cursor.fetchall()
+                cursor.close()
+                self._lock_connection.close()
+            except Error:
+                pass
+            self._lock_connection = None
+
+    def _start_job(self, job):
+        job.running = True
+        threading.Thread(target=self._supervise, args=(job,), name=f"job-{job.name}", daemon=True).start()
+
+    def _supervise(self, job):
+        """Run a job in a worker thread and stop waiting for it after its timeout.
+
+        Python threads can't be killed, so a timed-out job runs on until its
+        next check_job() raises JobCancelled; job.running stays set until it
+        really ends so it is never started twice.
+        """
+        outcome = {}
+        run = JobRun(self, job)
+
+        def target():
+            _running.run = run
+            try:
+                outcome['result'] = job.func()
+            except Exception as e:
+                outcome['error'] = e
+
+        started_at = datetime.now()
+        start = time.monotonic()
+        worker = threading.Thread(target=target, name=f"job-{job.name}-worker", daemon=True)
+        worker.start()
+        worker.join(job.timeout)
+
+        duration_ms = int((time.monotonic() - start) * 1000)
+        if worker.is_alive():
+            status, detail = 'timeout', f"Still running after {job.timeout}s"
+        elif 'error' in outcome:
+            status, detail = 'error', str(outcome['error'])
+        else:
+            status, detail = 'success', json.dumps(outcome.get('result'), default=str)
+
+        self._record_run(job, status, started_at, duration_ms, detail)
+
+        worker.join()
+        job.running = False
+
+    def _record_run(self, job, status, started_at, duration_ms, detail):
+        run = {
+            'status': status,
+            'started_at': started_at.isoformat(),
+            'duration_ms': duration_ms,
+            'detail': detail
+        }
+        job.history.append(run)
+        print(f"Job {job.name} finished with status {status} in {duration_ms}ms")
+
+        try:
+            with db_manager.transaction() as cursor:
+                cursor.execute("""
+                    INSERT INTO scheduled_job_runs (job_name, node, status, started_at, duration_ms, detail)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (job.name, self.node, status, started_at, duration_ms, detail))
+        except Error as e:
+            print(f"Failed to record run of job {job.name}: {e}")
+
+    def status(self):
+        return {
+            'node': self.node,
+            'is_leader': self.is_leader,
+            'jobs': [job.to_dict() for job in self.jobs.values()]
+        }
+
+
+def prune_job_runs(days=JOB_RUN_RETENTION_DAYS, chunk_size=PRUNE_CHUNK_SIZE):
+    """Delete scheduled_job_runs history older than days, in short chunks"""
+    deleted = 0
+    while True:
+        check_job()
+        with db_manager.transaction() as cursor:
+            cursor.execute("""
+                DELETE FROM scheduled_job_runs
+                WHERE started_at < NOW() - INTERVAL %s DAY
+                LIMIT %s
+            """, (days, chunk_size))
+            count = cursor.rowcount
+        deleted += count
+        if count < chunk_size:
+            return deleted
+
+
+scheduler = Scheduler()
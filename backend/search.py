@@ -0,0 +1,180 @@
+"""
+Feedback Search for Bin Smart
+Ranked full-text search over complaint reports and suggestions for the
+admin view, backed by MySQL FULLTEXT indexes
+"""
+
+from database import DatabaseManager
+from bin_registry import bin_registry
+import re
+
+db_manager = DatabaseManager()
+
+# InnoDB ignores shorter tokens (innodb_ft_min_token_size defaults to 3)
+MIN_TOKEN_LENGTH = 3
+MAX_TERMS = 10
+# InnoDB's default stopword list; a required stopword would match nothing
+STOPWORDS = {
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from',
+    'how', 'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the', 'this', 'to',
+    'was', 'what', 'when', 'where', 'who', 'will', 'with', 'und', 'www'
+}
+LEGACY_SUGGESTION_PATTERN = re.compile(r'^SUGGESTION \[(?P<category>[^\]]*)\]: (?P<title>.*?) - (?P<message>.*)$', re.S)
+
+
+def tokenize(text):
+    """Case-folded word tokens, dropping stopwords and ones too short for the index"""
+    tokens = re.findall(r'\w+', (text or '').casefold())
+    seen = []
+    for token in tokens:
+        if len(token) >= MIN_TOKEN_LENGTH and token not in STOPWORDS and token not in seen:
+            seen.append(token)
+    return seen[:MAX_TERMS]
+
+
+def boolean_query(terms):
+    """Every term required, each matching as a prefix ('bin' finds 'bins')"""
+    return ' '.join(f"+{term}*" for term in terms)
+
+
+def _date_filters(column, date_from, date_to, clauses, params):
+    if date_from:
+        clauses.append(f"{column} >= %s")
+        params.append(date_from)
+    if date_to:
+        clauses.append(f"{column} <= %s")
+        params.append(date_to)
+
+
+def search_complaints(terms, complaint_type=None, region=None, status=None,
+                      date_from=None, date_to=None, limit=20):
+    """Incidents whose reports match, one row per incident ranked by its best-matching report"""
+    clauses, params = [], []
+    if terms:
+        clauses.append("MATCH(r.description) AGAINST (%s IN BOOLEAN MODE)")
+        params.append(boolean_query(terms))
+    if complaint_type:
+        clauses.append("i.complaint_type = %s")
+        params.append(complaint_type)
+    if status:
+        clauses.append("i.status = %s")
+        params.append(status)
+    if region:
+        bin_ids = [record.id for record in bin_registry.all() if record.region == region]
+        if not bin_ids:
+            return []
+        clauses.append(f"i.bin_id IN ({', '.join(['%s'] * len(bin_ids))})")
+        params.extend(bin_ids)
+    _date_filters('r.reported_at', date_from, date_to, clauses, params)
+
+    score = "MAX(MATCH(r.description) AGAINST (%s IN BOOLEAN MODE))" if terms else "0"
+    query = f"""
+        SELECT i.id, i.bin_id, i.complaint_type as type, i.status, i.reporter_count,
+               i.description as text, MAX(r.reported_at) as created_at, {score} as score
+        FROM incident_reporters r
+        JOIN complaint_incidents i ON r.incident_id = i.id
+        {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+        GROUP BY i.id
+        ORDER BY score DESC, created_at DESC
+        LIMIT %s
+    """
+    score_params = [boolean_query(terms)] if terms else []
+    results = db_manager.execute_query(query, score_params + params + [limit]) or []
+
+    for row in results:
+        row['kind'] = 'complaint'
+    return bin_registry.decorate(results, {'location_name': 'location_name', 'region': 'region'})
+
+
+def search_suggestions(terms, category=None, region=None, status=None,
+                       date_from=None, date_to=None, limit=20):
+    """Suggestions whose title or message match, ranked by relevance"""
+    clauses, params = [], []
+    if terms:
+        clauses.append("MATCH(s.title, s.message) AGAINST (%s IN BOOLEAN MODE)")
+        params.append(boolean_query(terms))
+    if category:
+        clauses.append("s.category = %s")
+        params.append(category)
+    if status:
+        clauses.append("s.status = %s")
+        params.append(status)
+    if region:
+        clauses.append("u.region = %s")
+        params.append(region)
+    _date_filters('s.created_at', date_from, date_to, clauses, params)
+
+    score = "MATCH(s.title, s.message) AGAINST (%s IN BOOLEAN MODE)" if terms else "0"
+    query = f"""
+        SELECT s.id, s.user_id, s.category as type, s.status, s.title,
+               s.message as text, s.created_at, u.region, {score} as score
+        FROM suggestions s
+        JOIN users u ON s.user_id = u.id
+        {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+        ORDER BY score DESC, s.created_at DESC
+        LIMIT %s
+    """
+    score_params = [boolean_query(terms)] if terms else []
+    results = db_manager.execute_query(query, score_params + params + [limit]) or []
+
+    for row in results:
+        row['kind'] = 'suggestion'
+    return results
+
+
+def search_feedback(text, kind='all', type_filter=None, region=None, status=None,
+                    date_from=None, date_to=None, limit=20):
+    """Search complaints and/or suggestions; results are merged by score, newest first on ties.
+
+    type_filter is a complaint type for complaints and a category for
+    suggestions. Scores come from separate indexes, so they are comparable
+    within each kind but only roughly across kinds.
+    """
+    terms = tokenize(text)
+    results = []
+    if kind in ('all', 'complaint'):
+        results += search_complaints(terms, type_filter, region, status, date_from, date_to, limit)
+    if kind in ('all', 'suggestion'):
+        results += search_suggestions(terms, type_filter, region, status, date_from, date_to, limit)
+
+    results.sort(key=lambda row: (row['score'] or 0, str(row['created_at'])), reverse=True)
+    return terms, results[:limit]
+
+
+def migrate_legacy_suggestions(chunk_size=500):
+    """Move suggestions stored as 'SUGGESTION [...]' bin_complaints rows into the suggestions table"""
+    moved = 0
+    while True:
+        with db_manager.transaction() as cursor:
+            cursor.execute("""
+                SELECT id, user_id, description, status, created_at
+                FROM bin_complaints
+                WHERE complaint_type = 'other' AND description LIKE 'SUGGESTION [%%'
+                ORDER BY id
+                LIMIT %s
+            """, (chunk_size,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            for row in rows:
+                match = LEGACY_SUGGESTION_PATTERN.match(row['description'])
+                category, title, message = (
+                    match.group('category', 'title', 'message') if match
+                    else ('general', 'Service Suggestion', row['description'])
+                )
+                cursor.execute("""
+                    INSERT INTO suggestions (user_id, category, title, message, status, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (row['user_id'], category, title[:200], message, row['status'], row['created_at']))
+
+            ids = [row['id'] for row in rows]
+            cursor.execute(f"DELETE FROM bin_complaints WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+
+        moved += len(rows)
+        if len(rows) < chunk_size:
+            break
+
+    if moved:
+        print(f"Moved {moved} legacy suggestions out of bin_complaints")
+    return moved
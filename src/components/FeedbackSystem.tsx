@@ -19,6 +19,12 @@ import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import { Alert, AlertDescription } from '@/components/ui/alert';
 import Navigation from '@/components/Navigation';
 
+// The signed-in user's token; feedback endpoints act as the user it names
+const authHeaders = (): Record<string, string> => {
+  const token = localStorage.getItem('token');
+  return token ? { 'Authorization': `Bearer ${token}` } : {};
+};
+
 // API service for feedback system
 const feedbackApiService = {
   // Improved waste type validation for feedback system
@@ -45,7 +51,7 @@ const feedbackApiService = {
       
       const response = await fetch('http://localhost:8080/api/feedback/complaints', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
         body: JSON.stringify(complaintData)
       });
       if (!response.ok) throw new Error('Failed to submit complaint');
@@ -59,7 +65,7 @@ const feedbackApiService = {
   },
 
   async getComplaints(userId: number) {
-    const response = await fetch(`http://localhost:8080/api/feedback/complaints?user_id=${userId}`);
+    const response = await fetch(`http://localhost:8080/api/feedback/complaints?user_id=${userId}`, { headers: authHeaders() });
     if (!response.ok) throw new Error('Failed to fetch complaints');
     const data = await response.json();
     
@@ -80,7 +86,7 @@ const feedbackApiService = {
     try {
       const response = await fetch('http://localhost:8080/api/feedback/ratings', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
         body: JSON.stringify(ratingData)
       });
       if (!response.ok) throw new Error('Failed to submit rating');
@@ -117,7 +123,7 @@ const feedbackApiService = {
     try {
       const response = await fetch('http://localhost:8080/api/feedback/suggestions', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...authHeaders() },
         body: JSON.stringify(suggestionData)
       });
       if (!response.ok) throw new Error('Failed to submit suggestion');
@@ -131,7 +137,7 @@ const feedbackApiService = {
   },
 
   async getNotifications(userId) {
-    const response = await fetch(`http://localhost:8080/api/feedback/notifications/${userId}`);
+    const response = await fetch(`http://localhost:8080/api/feedback/notifications/${userId}`, { headers: authHeaders() });
     if (!response.ok) throw new Error('Failed to fetch notifications');
     return await response.json();
   },
@@ -139,7 +145,7 @@ const feedbackApiService = {
   async markNotificationAsRead(notificationId) {
     const response = await fetch(`http://localhost:8080/api/feedback/notifications/${notificationId}/mark-read`, {
       method: 'PUT',
-      headers: { 'Content-Type': 'application/json' }
+      headers: { 'Content-Type': 'application/json', ...authHeaders() }
     });
     if (!response.ok) throw new Error('Failed to mark notification as read');
     return await response.json();
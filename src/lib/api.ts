@@ -142,6 +142,22 @@ class ApiService {
     return this.request(`/user/${userId}/stats`);
   }
 
+  // Everything the dashboard shows on mount, in one request; failed sections come back null
+  async getBootstrap(userId: number, sections?: string[]): Promise<{
+    status: 'success' | 'partial';
+    user_id: number;
+    user?: User;
+    stats?: any[] | null;
+    summary?: any | null;
+    notifications?: { unread_count: number; recent: any[] } | null;
+    rewards?: { catalog: Reward[]; affordable_ids: number[] } | null;
+    leaderboard?: Array<{ username: string; total_points: number; created_at: string }> | null;
+    errors: Record<string, string>;
+  }> {
+    const query = sections ? `?sections=${sections.join(',')}` : '';
+    return this.request(`/bootstrap/${userId}${query}`);
+  }
+
   // Waste scanning
   async submitScan(userId: number, wasteType: string, confidence?: number): Promise<ScanResult> {
     return this.request('/scan', {
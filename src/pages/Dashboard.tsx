@@ -466,11 +466,12 @@ const Dashboard = () => {
         
         // Fetch fresh user data from API
         try {
-          const user = await apiService.getUser(userData.username);
-          const userStatsData = await apiService.getUserStats(user.id);
+          // One round trip for the user row and scan statistics
+          const bootstrap = await apiService.getBootstrap(userData.id, ['user', 'stats']);
+          const user = bootstrap.user!;
           
           setUserStats({
-            totalDisposals: userStatsData.scan_statistics.reduce((sum: number, stat: any) => sum + stat.scan_count, 0),
+            totalDisposals: (bootstrap.stats ?? []).reduce((sum: number, stat: any) => sum + stat.scan_count, 0),
             rewardPoints: user.total_points,
             co2Saved: Math.round(user.total_points * 0.02 * 100) / 100,
             currentLevel: user.total_points > 500 ? 'Eco Champion' : user.total_points > 200 ? 'Eco Warrior' : 'Beginner',